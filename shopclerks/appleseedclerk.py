@@ -1,26 +1,87 @@
+import cStringIO
+
 import hou
 import clerkutil
 
+import appleseedshading
+import appleseedshaders
+
 
 class AppleseedClerk(object):
 
 	def __init__(self):
 		self.__name = 'appleseed'
 
+		# Entity classes of the SHOP types, by style. appleseed has no light
+		# or texture SHOP, the EDF and the color stand for them.
 		self.__shaderSupported = {
-			'light'   : ['shop_appleseedLight'],
-			'surface' : ['shop_appleseedBSDF',  'shop_appleseedMaterial'],
-			'texture' : ['shop_appleseedColor', 'shop_appleseedTexture'],
+			'light'   : {
+				'appleseedEDF'           : appleseedshaders.EDF,
+			},
+			'surface' : {
+				'appleseedMaterial'      : appleseedshaders.Material,
+				'appleseedBSDF'          : appleseedshaders.BSDF,
+				'appleseedSurfaceShader' : appleseedshaders.SurfaceShader,
+			},
+			'texture' : {
+				'appleseedColor'         : appleseedshaders.Color,
+			},
 		}
 
+		# Shader string built per SHOP and time, as (shading graph entries of
+		# the nodes it was built from as (path, kind, entry), string).
+		self.__shaderStrings = {}
+
 	def getName(self):
 		return self.__name
 
 	def isShaderSupported(self, style):
 		return self.__shaderSupported.has_key(style)
 
+	##
+	# Returns the XML of the entity of the SHOP and of the entities it refers
+	# to, in the order of an assembly, with the SHOPs evaluated at time. The
+	# SHOPs are resolved through the shading graph shared with appleseed.py,
+	# the string is built again only once the graph resolved again one of the
+	# nodes it was built from.
+	#
 	def buildShaderString(self, style, shopName, time, parmNames, options):
-		return 'AppleseedClerk::buildShaderString %s %s %s %s %s' % (style, shopName, time, parmNames, options)
+		shopNode = hou.node(shopName)
+		if shopNode is None:
+			return ''
+
+		entityClass = self.__shaderSupported.get(style, {}).get(shopNode.type().name())
+		if entityClass is None:
+			return ''
+
+		key = (shopName, time)
+		memo = self.__shaderStrings.get(key)
+		if memo is not None and self.__isCurrent(memo[0], time):
+			return memo[1]
+
+		tables = appleseedshaders.ShadingTables()
+		appleseedshaders.ResolveNetwork(tables, entityClass, shopName, lambda entityClass, path: appleseedshaders.ResolveShopNode(entityClass, path, [time]))
+
+		stream = cStringIO.StringIO()
+		appleseedshaders.XmlWriter(stream).WriteTables(tables)
+
+		shadingGraph = appleseedshading.TheGraph()
+		entries = []
+		for (tableName, writerName) in appleseedshaders.TABLES:
+			for (path, entity) in getattr(tables, tableName).iteritems():
+				kind = entity.__class__.__name__
+				entries.append((path, kind, shadingGraph.Entry(path, kind, time)))
+
+		shaderString = stream.getvalue()
+		self.__shaderStrings[key] = (entries, shaderString)
+		return shaderString
+
+	def __isCurrent(self, entries, time):
+		shadingGraph = appleseedshading.TheGraph()
+		for (path, kind, entry) in entries:
+			if entry is None or shadingGraph.Entry(path, kind, time) is not entry:
+				return False
+		return True
 
 theAppleseedClerk = AppleseedClerk()
 
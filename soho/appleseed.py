@@ -19,145 +19,981 @@
 # THE SOFTWARE.
 
 
+import cStringIO
+import hashlib
+import json
+import multiprocessing
 import os
+import posixpath
+import re
 import sys
-import uuid
+import time
 
 import hou
 import soho
 import sohog
 
-from xml.etree.ElementTree import Element, ElementTree, SubElement, tostring
+import appleseedcache
+import appleseedcull
+import appleseedfarm
+import appleseedgeo
+import appleseedipr
+import appleseedlauncher
+import appleseedprofile
+import appleseedshaders
+import appleseedshading
+import appleseedtiles
 
 ##
 # Global variables.
 #
 theProject = None
+theSettings = None
+theGeometryCache = None
+theGeometryWriter = None
+theResolvedEntities = None
+theIprScene = None
+
+# Assembly files of the groups of objects, see Settings.ASSEMBLIES, the
+# group being resolved and the dependencies of the groups resolved, by group
+# key, stored once the mesh files are written. See ArchiveFile.
+theAssemblyCache = None
+theArchiveFile = None
+theArchiveDependencies = {}
+
+# Culling of the objects out of the camera view, see Settings.CULL.
+theCuller = None
+
+# Geometry of the SOPs of the frame being exported, and its bounds and size,
+# by path and time, see SopGeometry() and SopBounds().
+theSopGeometries = {}
+theSopBounds = {}
+
+# Profile of the export, see Settings.PROFILE.
+theProfiler = appleseedprofile.Profiler(False)
 
 ##
 # Global functions.
 #
-def ProcessColor(colorNodeName, project, moments):
-	if not project.scene.assembly.colors.has_key(colorNodeName):
-		colorNodePath = colorNodeName
-		colorNode = hou.node(colorNodePath)
-		color = Color()
-		color.Resolve(colorNode, moments)
-		project.scene.assembly.colors[colorNodeName] = color
-
-def ProcessBSDF(bsdfName, project, moments):
-	if not project.scene.assembly.bsdfs.has_key(bsdfName):
-		bsdfShopNodePath = bsdfName
-		bsdfShopNode = hou.node(bsdfShopNodePath)
-		bsdf = BSDF()
-		bsdf.Resolve(bsdfShopNode, moments)
-		project.scene.assembly.bsdfs[bsdfName] = bsdf
-		
-		bsdfModel = bsdf.attrs[BSDF.MODEL]
-		if bsdfModel == BSDF.ASHIKHMIN_BRDF:
-			diffuseNodeName = bsdf.attrs[BSDF.ASHIKHMIN_DIFFUSE_REFLECTANCE]
-			ProcessColor(diffuseNodeName, project, moments)
-			glossyNodeName = bsdf.attrs[BSDF.ASHIKHMIN_GLOSSY_REFLECTANCE]
-			ProcessColor(glossyNodeName, project, moments)
-
-		elif bsdfModel == BSDF.KELEMEN_BRDF:
-			matteNodeName = bsdf.attrs[BSDF.KELEMEN_MATTE_REFLECTANCE]
-			ProcessColor(matteNodeName, project, moments)
-			specularNodeName = bsdf.attrs[BSDF.KELEMEN_SPECULAR_REFLECTANCE]
-			ProcessColor(specularNodeName, project, moments)
-
-		elif bsdfModel == BSDF.BSDF_MIX:
-			bsdfName0 = bsdf.attrs[BSDF.BSDF_MIX_BSDF0]
-			if not project.scene.assembly.bsdfs.has_key(bsdfName0):
-				ProcessBSDF(bsdfName0, project, moments)
-
-			bsdfName1 = bsdf.attrs[BSDF.BSDF_MIX_BSDF1]
-			if not project.scene.assembly.bsdfs.has_key(bsdfName1):
-				ProcessBSDF(bsdfName1, project, moments)
-
-		elif bsdfModel == BSDF.LAMBERTIAN_BRDF:
-			reflectanceNodeName = bsdf.attrs[BSDF.LAMBERTIAN_REFLECTANCE]
-			ProcessColor(reflectanceNodeName, project, moments)
-
-		elif bsdfModel == BSDF.SPECULAR_BRDF:
-			reflectanceNodeName = bsdf.attrs[BSDF.SPECULAR_BRDF_REFLECTANCE]
-			ProcessColor(reflectanceNodeName, project, moments)
-
-		elif bsdfModel == BSDF.SPECULAR_BTDF:
-			reflectanceNodeName = bsdf.attrs[BSDF.SPECULAR_BTDF_REFLECTANCE]
-			ProcessColor(reflectanceNodeName, project, moments)
-
-			transmittanceNodeName = bsdf.attrs[BSDF.SPECULAR_BTDF_TRANSMITTANCE]
-			ProcessColor(transmittanceNodeName, project, moments)	
+def Log(message):
+	sys.stderr.write('appleseed: %s\n' % message)
+
+##
+# Returns the directory holding the files referred by the project, it is
+# created if needed.
+#
+def CompanionDir():
+	sohoDiskFilePath = soho.getDefaultedString('soho_diskfile', [''])[0]
+	sohoDiskFileDir = os.path.dirname(sohoDiskFilePath)
+	sohoDiskFileBaseName = os.path.basename(sohoDiskFilePath)
+	companionDir = os.path.join(sohoDiskFileDir, '%s-assets' % sohoDiskFileBaseName.split('.')[0])
+	appleseedcache.EnsureDirectory(companionDir)
+
+	return companionDir
+
+##
+# Returns the number of the frame at time.
+#
+def FrameNumber(time):
+	return int(round(hou.timeToFrame(time)))
+
+##
+# Returns the path of the project of a frame of the sequence.
+#
+def SequenceFilePath(frameNumber):
+	return FrameFilePath(soho.getDefaultedString('soho_diskfile', [''])[0], frameNumber)
+
+##
+# Returns filePath numbered for a frame, the number ending its name is
+# replaced or one is appended.
+#
+def FrameFilePath(filePath, frameNumber):
+	(root, extension) = os.path.splitext(filePath)
+	match = re.search(r'\d+$', root)
+	if match is not None:
+		return '%s%0*d%s' % (root[:match.start()], len(match.group()), frameNumber, extension)
+
+	return '%s.%04d%s' % (root, frameNumber, extension)
+
+##
+# Returns True unless the node is known not to change over time.
+#
+def IsTimeDependent(nodePath):
+	node = hou.node(nodePath)
+	try:
+		return node.isTimeDependent()
+	except AttributeError:
+		return True
+
+##
+# Returns the digest of the parameters at moments of the nodes at paths, of
+# the nodes a SOP is cooked from and of the SOP an object node displays. It
+# changes with the time when one of them depends on time, a missing node is
+# digested by its path alone.
+#
+def NodesDigest(paths, moments):
+	sha = hashlib.sha1()
+	timeDependent = False
+	digested = set()
+	for path in paths:
+		sha.update('%s\n' % path)
+		node = hou.node(path)
+		if node is None:
+			continue
+
+		if getattr(node, 'displayNode', None) is not None:
+			sha.update('display %s\n' % DisplaySopPath(node))
+
+		nodes = [node]
+		inputAncestors = getattr(node, 'inputAncestors', None)
+		if inputAncestors is not None:
+			nodes.extend(inputAncestors())
+
+		for digestedNode in nodes:
+			digestedPath = digestedNode.path()
+			if digestedPath in digested:
+				continue
+			digested.add(digestedPath)
+
+			sha.update('%s %s\n' % (digestedPath, appleseedshading.ParmDigest(digestedNode.parms(), moments[0])))
+			if not timeDependent:
+				timeDependent = IsTimeDependent(digestedPath)
+
+	if timeDependent:
+		sha.update('time %r\n' % moments[0])
+
+	return sha.hexdigest()
+
+##
+# Returns the size and the modification time of a file, None if it is gone.
+#
+def FileStamp(filePath):
+	try:
+		stat = os.stat(filePath)
+	except OSError:
+		return None
+
+	return [stat.st_size, stat.st_mtime]
+
+##
+# Opens the geometry cache if it is enabled on the ROP.
+#
+def OpenGeometryCache(settings):
+	if not settings.attrs[Settings.GEOMETRY_CACHE]:
+		return None
+
+	geometryCacheDir = settings.attrs[Settings.GEOMETRY_CACHE_DIR]
+	if geometryCacheDir == '':
+		geometryCacheDir = os.path.join(CompanionDir(), Settings.GEOMETRY_CACHE_DIR_DEFAULT)
+
+	return appleseedcache.ContentStore(geometryCacheDir, settings.attrs[Settings.GEOMETRY_CACHE_SIZE] << 20)
+
+##
+# Opens the render cache if it is enabled on the ROP.
+#
+def OpenRenderCache(settings):
+	if not settings.attrs[Settings.RENDER_CACHE]:
+		return None
+
+	renderCacheDir = settings.attrs[Settings.RENDER_CACHE_DIR]
+	if renderCacheDir == '':
+		renderCacheDir = os.path.join(CompanionDir(), Settings.RENDER_CACHE_DIR_DEFAULT)
+
+	return appleseedcache.ContentStore(renderCacheDir, settings.attrs[Settings.RENDER_CACHE_SIZE] << 20)
+
+##
+# Opens the store of the assembly files if the objects are exported by group.
+#
+def OpenAssemblyCache(settings):
+	if settings.attrs[Settings.ASSEMBLIES] not in (Settings.ASSEMBLIES_SUBNETS, Settings.ASSEMBLIES_GROUPS):
+		return None
+
+	assemblyCacheDir = os.path.join(CompanionDir(), Settings.ASSEMBLY_CACHE_DIR_DEFAULT)
+	return appleseedcache.ContentStore(assemblyCacheDir, settings.attrs[Settings.ASSEMBLY_CACHE_SIZE] << 20)
+
+##
+# Renders the projects exported with appleseed.cli, the frames of the sequence
+# or the current frame, see appleseedfarm. Within Houdini the renders go on in
+# the background, their progress shown in the status bar; otherwise the export
+# waits for them and an interrupt of the ROP cancels them.
+#
+def RenderProject(settings, moments):
+	projectFilePath = soho.getDefaultedString('soho_diskfile', [''])[0]
+	if projectFilePath == '':
+		soho.warning('appleseed: render needs the project written to a disk file')
+		return
+
+	# The project is the standard output of soho, what is buffered is written
+	# before the renderer reads it.
+	sys.stdout.flush()
+
+	currentFrameNumber = FrameNumber(moments[0])
+	if settings.attrs[Settings.SEQUENCE]:
+		frameNumbers = settings.SequenceFrames()
+	else:
+		frameNumbers = [currentFrameNumber]
+
+	jobs = []
+	for frameNumber in frameNumbers:
+		(frameProjectFilePath, outputFilePath) = (projectFilePath, settings.attrs[Settings.RENDER_OUTPUT])
+		if frameNumber != currentFrameNumber:
+			frameProjectFilePath = SequenceFilePath(frameNumber)
+			if outputFilePath != '':
+				outputFilePath = FrameFilePath(outputFilePath, frameNumber)
+		if outputFilePath == '':
+			outputFilePath = os.path.splitext(frameProjectFilePath)[0] + '.png'
+
+		jobs.append(appleseedfarm.Job(frameProjectFilePath, outputFilePath, frameNumber))
+
+	# A single frame may be split into regions rendered at once, then
+	# stitched.
+	stitch = None
+	tileCount = settings.attrs[Settings.RENDER_TILES]
+	if tileCount > 1 and len(jobs) > 1:
+		Log('regions are for a single frame, rendering whole frames')
+	elif tileCount > 1 and os.path.splitext(jobs[0].outputFilePath)[1].lower() != '.png':
+		Log('regions are stitched into png images only, rendering the whole frame')
+	elif tileCount > 1:
+		outputFilePath = jobs[0].outputFilePath
+		(resolution, tiles) = appleseedtiles.SplitProject(projectFilePath, tileCount)
+		jobs = [appleseedfarm.Job(tileFilePath, os.path.splitext(tileFilePath)[0] + '.png') for (tileFilePath, region) in tiles]
+		stitch = (outputFilePath, resolution, [(region, job.outputFilePath) for ((tileFilePath, region), job) in zip(tiles, jobs)])
+
+	render = appleseedfarm.Farm(settings.attrs[Settings.RENDER_CLI], jobs, settings.attrs[Settings.RENDER_WORKERS], settings.attrs[Settings.RENDER_RETRIES], settings.attrs[Settings.RENDER_JOB_MEMORY], settings.attrs[Settings.RENDER_ARGUMENTS].split(), OpenRenderCache(settings))
+	if stitch is not None:
+		render = appleseedtiles.TiledRender(render, *stitch)
+		Log('rendering %d regions, %d at once' % (len(jobs), render.workers))
+	else:
+		Log('rendering %d frames, %d at once' % (len(jobs), render.workers))
+
+	if hou.isUIAvailable():
+		FollowRender(render)
+		return
+
+	try:
+		while render.Wait(Settings.RENDER_STATUS_INTERVAL) is None:
+			Log(render.Status())
+	except (KeyboardInterrupt, hou.OperationInterrupted):
+		Log('interrupted, cancelling the renders')
+		render.Cancel()
+	Log(render.Status())
+
+##
+# Shows the progress of a render in the status bar of Houdini until it is
+# over, from the event loop which also drives it.
+#
+def FollowRender(render):
+	state = {'shown' : 0.0}
+
+	def ShowStatus():
+		done = render.Poll() is not None
+		now = time.time()
+		if not done and now - state['shown'] < 0.5:
+			return
+
+		state['shown'] = now
+		hou.ui.setStatusMessage('appleseed: %s' % render.Status())
+		if done:
+			hou.ui.removeEventLoopCallback(ShowStatus)
+
+	hou.ui.addEventLoopCallback(ShowStatus)
+
+##
+# Returns the geometry of sopPath at moments. It is kept until its mesh is
+# read, see TakeSopGeometry(), so that the SOP is cooked once however many
+# times its size and bounds are asked for before.
+#
+def SopGeometry(sopPath, moments):
+	key = (sopPath, moments[0])
+	sohoGeometry = theSopGeometries.get(key)
+	if sohoGeometry is None:
+		sohoGeometry = sohog.SohoGeometry(sopPath, moments[0])
+		theSopGeometries[key] = sohoGeometry
+
+	return sohoGeometry
+
+##
+# Returns the geometry of sopPath at moments and forgets it, for its mesh or
+# its points to be read once.
+#
+def TakeSopGeometry(sopPath, moments):
+	sohoGeometry = SopGeometry(sopPath, moments)
+	del theSopGeometries[(sopPath, moments[0])]
+	return sohoGeometry
+
+##
+# Orders objects by decreasing size so that the longest writes start first,
+# objects of the same size keep their order.
+#
+def SortLargestFirst(sohoObjects, moments):
+	sizes = []
+	for (i, sohoObject) in enumerate(sohoObjects):
+		sopPath = sohoObject.getDefaultedString('object:soppath', sohoObject, [''])[0]
+		size = SopBounds(sopPath, moments)[1]
+		sizes.append((-size, i, sohoObject))
+	sizes.sort()
 
+	return [sohoObject for (size, i, sohoObject) in sizes]
+
+##
+# Returns the values of parameters evaluated by soho, by key.
+#
+def SohoParmValues(sohoParmsValues):
+	return dict([(key, parm.Value) for (key, parm) in sohoParmsValues.iteritems()])
+
+##
+# Returns the values of the parameters of node described by sohoParms, by key,
+# the way soho evaluates them. The keys are the names of the parameters or of
+# the parameter tuples, missing parameters take their default.
+#
+def EvalNodeParms(node, sohoParms):
+	values = {}
+	for (key, sohoParm) in sohoParms.iteritems():
+		parmTuple = node.parmTuple(key)
+		if parmTuple is not None:
+			values[key] = list(parmTuple.eval())
+			continue
+
+		parm = node.parm(key)
+		if parm is not None:
+			values[key] = [parm.eval()]
+		else:
+			values[key] = list(sohoParm.Value)
+	return values
+
+##
+# Formatters of the values written into the XML.
+#
+FormatValue  = appleseedshaders.FormatValue
+FormatFloats = appleseedshaders.FormatFloats
+FormatInts   = appleseedshaders.FormatInts
+FormatMatrix = appleseedshaders.FormatMatrix
+EscapeXml    = appleseedshaders.EscapeXml
+
+##
+# Returns the entity resolved from the node at nodePath, see
+# appleseedshaders.ResolveShopNode().
+#
+def ResolveShopNode(entityClass, nodePath, moments):
+	theProfiler.Begin('shading')
+	try:
+		return appleseedshaders.ResolveShopNode(entityClass, nodePath, moments)
+	finally:
+		theProfiler.End()
+
+##
+# Adds to project the material materialNodeName and the shading entities it
+# refers to.
+#
 def ProcessMaterial(materialNodeName, project, moments):
-	materialNodePath = materialNodeName
-	materialNode = hou.node(materialNodePath)
-	if materialNode.type().name() != 'appleseedMaterial':
-			soho.error('%s Must be appleseedMaterial.' % materialNode.path())
+	appleseedshaders.ResolveNetwork(project.scene.assembly, Material, materialNodeName, lambda entityClass, path: ResolveShopNode(entityClass, path, moments))
 
-	if not project.scene.assembly.materials.has_key(materialNodeName):
-		material = Material()
-		material.Resolve(materialNode, moments)
-		project.scene.assembly.materials[materialNodeName] = material
 
-		if material.attrs.has_key(Material.BSDF):
-			bsdfName = material.attrs[Material.BSDF]
-			ProcessBSDF(bsdfName, project, moments)
+##
+# Adds to project the object of the mesh returned by readMesh, named after
+# name. sopPath is the SOP the mesh comes from. Within a sequence the mesh of
+# a SOP not depending on time is written for the first frame only.
+#
+# Returns the name of the object.
+#
+def ProcessObject(name, sopPath, readMesh, project, moments):
+	if theArchiveFile is not None:
+		theArchiveFile.DependOnNode(sopPath)
+
+	objectName = name.replace('/', '__')
+	if project.scene.assembly.objects.has_key(objectName):
+		return objectName
+
+	key = (Object.__name__, name)
+	if theResolvedEntities is not None and theResolvedEntities.has_key(key):
+		object = theResolvedEntities[key]
+	else:
+		object = Object()
+
+		theProfiler.Begin('mesh_extraction')
+		mesh = readMesh()
+		theProfiler.End()
 
-		if material.attrs.has_key(Material.EDF):
-			edfName = material.attrs[Material.EDF]
-			if not project.scene.assembly.edfs.has_key(edfName):
-				edfShopNodePath = edfName
-				edfShopNode = hou.node(edfShopNodePath)
-				edf = EDF()
-				edf.Resolve(edfShopNode, moments)
-				project.scene.assembly.edfs[edfName] = edf
+		object.ResolveMesh(name, sopPath, mesh, moments)
+		if theResolvedEntities is not None and not IsTimeDependent(sopPath):
+			theResolvedEntities[key] = object
 
-				colorNodeName = edf.attrs[EDF.EXITANCE]
-				ProcessColor(colorNodeName, project, moments)
+	project.scene.assembly.objects[objectName] = object
+	if theArchiveFile is not None:
+		theArchiveFile.DependOnFile(object.filePath)
 
-		surfaceShaderName = material.attrs[Material.SURFACE_SHADER]
-		if not project.scene.assembly.surfaceShaders.has_key(surfaceShaderName):
-			surfaceShaderShopNode = hou.node(surfaceShaderName)
-			surfaceShader = SurfaceShader()
-			surfaceShader.Resolve(surfaceShaderShopNode, moments)
-			project.scene.assembly.surfaceShaders[surfaceShaderName] = surfaceShader
+	return objectName
 
-			# Collect color from surface shader.
-			model = surfaceShader.attrs[SurfaceShader.MODEL]
-			if model == SurfaceShader.CONSTANT_SURFACE_SHADER:
-				colorNodeName = surfaceShader.attrs[SurfaceShader.CONSTANT_COLOR]
-				ProcessColor(colorNodeName, project, moments)
-			elif model == SurfaceShader.FAST_SSS_SURFACE_SHADER:
-				albedoNodeName = surfaceShader.attrs[SurfaceShader.FAST_SSS_ALBEDO]
-				ProcessColor(albedoNodeName, project, moments)
-			elif model == SurfaceShader.PHYSICAL_SURFACE_SHADER:
-				if surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE] == SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR:
-					skyColorNodeName = surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_SKY_COLOR].value
-					ProcessColor(skyColorNodeName, project, moments)
+def ProcessSopObject(sopPath, project, moments):
+	return ProcessObject(sopPath, sopPath, lambda: appleseedgeo.ReadMesh(TakeSopGeometry(sopPath, moments), theSettings.attrs[Settings.UV_WELD_TOLERANCE]), project, moments)
 
+##
+# Adds an instance of the object objectName to project, matrix is its world
+# transform.
+#
+def ProcessObjectInstance(name, objectName, matrix, materialNodeName, project, moments):
+	ProcessMaterial(materialNodeName, project, moments)
+
+	if not project.scene.assembly.objectInstances.has_key(name):
+		objectInstance = ObjectInstance()
+		objectInstance.ResolveInstance(name, objectName, matrix)
+		objectInstance.assignMaterial.attrs[AssignMaterial.MATERIAL] = materialNodeName
+		project.scene.assembly.objectInstances[name] = objectInstance
 
 ##
+# Returns the path of the SOP displayed by an object node, None if there is
+# none.
 #
-class Attr(object):
+def DisplaySopPath(objectNode):
+	if objectNode is None:
+		return None
 
-	NAME  = 'name'
-	VALUE = 'value'
+	displayNode = objectNode.displayNode()
+	if displayNode is None:
+		return None
 
-	def __init__(self, *args):
-		self.value = list(args)
+	return displayNode.path()
 
 ##
+# Returns the bounds of the geometry of sopPath as (xmin, ymin, zmin, xmax,
+# ymax, zmax), None if sohog does not know them, and its size in points and
+# primitives. Both are kept for the frame, the geometry itself may be gone.
 #
-class Node(object):
+def SopBounds(sopPath, moments):
+	key = (sopPath, moments[0])
+	if theSopBounds.has_key(key):
+		return theSopBounds[key]
 
-	def __init__(self):
-		self.attrs = {}
+	sohoGeometry = SopGeometry(sopPath, moments)
+	size = sohoGeometry.globalValue('geo:pointcount')[0] + sohoGeometry.globalValue('geo:primcount')[0]
+
+	bounds = sohoGeometry.globalValue('geo:boundingbox')
+	if not bounds or len(bounds) != 6:
+		bounds = None
+
+	theSopBounds[key] = (bounds, size)
+	return (bounds, size)
+
+##
+# Returns the bounds of the geometry of the object node at path, relative to
+# instancerNode, None if unknown.
+#
+def PrototypeBounds(instancerNode, path, moments):
+	sopPath = DisplaySopPath(instancerNode.node(path))
+	if sopPath is None:
+		return None
+
+	return SopBounds(sopPath, moments)[0]
+
+##
+# Adds the object of the object node at path, relative to instancerNode,
+# returns its name and its material or None if there is no such object.
+#
+def ProcessPrototype(instancerNode, path, materialNodeName, project, moments):
+	prototypeNode = instancerNode.node(path)
+	if theArchiveFile is not None:
+		if prototypeNode is not None:
+			theArchiveFile.DependOnNode(prototypeNode.path())
+		else:
+			theArchiveFile.DependOnNode(posixpath.normpath(posixpath.join(instancerNode.path(), path)))
+
+	sopPath = DisplaySopPath(prototypeNode)
+	if sopPath is None:
+		soho.warning('%s: no geometry to instance at %s.' % (instancerNode.path(), path))
+		return None
+
+	if materialNodeName == '':
+		materialNodeName = prototypeNode.evalParm('shop_materialpath')
+
+	return (ProcessSopObject(sopPath, project, moments), materialNodeName)
+
+##
+# Adds an instance of the prototype of each point of sopPath.
+#
+# The prototype is the object named by the instance point attribute if any,
+# the instancepath object otherwise.
+#
+def ProcessPointInstances(instancerNode, sopPath, instancePath, world, materialNodeName, project, moments):
+	sohoGeometry = TakeSopGeometry(sopPath, moments)
+	pointCount = sohoGeometry.globalValue('geo:pointcount')[0]
+	pointAttribs = sohoGeometry.globalValue('geo:pointattribs') or []
+
+	handles = [(name, sohoGeometry.attribute('geo:point', name)) for name in appleseedgeo.POINT_INSTANCE_ATTRIBS if name in pointAttribs]
+	instanceHandle = None
+	if 'instance' in pointAttribs:
+		instanceHandle = sohoGeometry.attribute('geo:point', 'instance')
+	materialHandle = None
+	if 'shop_materialpath' in pointAttribs:
+		materialHandle = sohoGeometry.attribute('geo:point', 'shop_materialpath')
+
+	value = sohoGeometry.value
+	instancerPath = instancerNode.path()
+	prototypes = {}
+	prototypeBounds = {}
+	for i in xrange(pointCount):
+		path = instancePath
+		if instanceHandle is not None:
+			path = value(instanceHandle, i)[0] or instancePath
+
+		values = dict([(name, value(handle, i)) for (name, handle) in handles])
+		matrix = appleseedgeo.MultiplyMatrices(appleseedgeo.PointInstanceMatrix(values), world)
+
+		# Prototypes are only exported once an instance of them is kept.
+		if theCuller is not None:
+			if not prototypeBounds.has_key(path):
+				prototypeBounds[path] = PrototypeBounds(instancerNode, path, moments)
+			if theCuller.Cull(prototypeBounds[path], matrix, appleseedcull.Culler.INSTANCES):
+				continue
+			startTime = time.time()
+
+		if not prototypes.has_key(path):
+			prototypes[path] = ProcessPrototype(instancerNode, path, materialNodeName, project, moments)
+		prototype = prototypes[path]
+		if prototype is None:
+			continue
+
+		(objectName, pointMaterialNodeName) = prototype
+		if materialHandle is not None:
+			pointMaterialNodeName = value(materialHandle, i)[0] or pointMaterialNodeName
+
+		ProcessObjectInstance('%s.%d' % (instancerPath, i), objectName, matrix, pointMaterialNodeName, project, moments)
+
+		if theCuller is not None:
+			theCuller.Keep(appleseedcull.Culler.INSTANCES, time.time() - startTime)
+
+##
+# Returns the packed primitives of the geometry of sopPath at moments[0], an
+# empty list unless its first primitive is packed.
+#
+def PackedPrims(sopPath, moments):
+	packedPrimClass = getattr(hou, 'PackedPrim', None)
+	if packedPrimClass is None:
+		return []
 
-	def Resolve(self, materialShopNode, moments):
+	geometry = hou.node(sopPath).geometryAtFrame(hou.timeToFrame(moments[0]))
+	prims = geometry.iterPrims()
+	if len(prims) == 0 or not isinstance(prims[0], packedPrimClass):
+		return []
+
+	packedPrims = [prim for prim in geometry.prims() if isinstance(prim, packedPrimClass)]
+	if len(packedPrims) != len(prims):
+		soho.warning('%s: %d primitives mixed with packed primitives are not exported.' % (sopPath, len(prims) - len(packedPrims)))
+
+	return packedPrims
+
+##
+# Returns a key identifying the geometry of a packed primitive and a function
+# returning its mesh, the key is None if the geometry can not be extracted.
+#
+def PackedPrimGeometry(prim):
+	fileName = ''
+	try:
+		fileName = prim.intrinsicValue('filename')
+	except hou.OperationFailed:
 		pass
 
+	if fileName:
+		if theArchiveFile is not None:
+			theArchiveFile.DependOnFile(fileName)
+
+		def ReadFile():
+			geometry = hou.Geometry()
+			geometry.loadFromFile(fileName)
+			return appleseedgeo.ReadHouGeometry(geometry, theSettings.attrs[Settings.UV_WELD_TOLERANCE])
+
+		return ('file:' + fileName, ReadFile)
+
+	getEmbeddedGeometry = getattr(prim, 'getEmbeddedGeometry', None)
+	geometry = getEmbeddedGeometry and getEmbeddedGeometry()
+	if not geometry:
+		return (None, None)
+
+	mesh = appleseedgeo.ReadHouGeometry(geometry, theSettings.attrs[Settings.UV_WELD_TOLERANCE])
+	return ('mesh:' + mesh.Digest(''), lambda: mesh)
+
+##
+# Returns the transform of a packed primitive, its position included.
+#
+def PackedPrimMatrix(prim):
+	fullTransform = getattr(prim, 'fullTransform', None)
+	if fullTransform is not None:
+		return fullTransform().asTuple()
+
+	rotation = prim.transform().asTuple()
+	position = prim.vertex(0).point().position()
+	return rotation[0:3] + (0.0,) + rotation[3:6] + (0.0,) + rotation[6:9] + (0.0, position[0], position[1], position[2], 1.0)
+
+##
+# Adds an instance per packed primitive, primitives sharing their geometry
+# share their object.
+#
+def ProcessPackedInstances(instancerNode, sopPath, packedPrims, world, materialNodeName, project, moments):
+	instancerPath = instancerNode.path()
+	objectNames = {}
+	for prim in packedPrims:
+		(key, readMesh) = PackedPrimGeometry(prim)
+		if key is None:
+			soho.warning('%s: the geometry of packed primitive %d can not be exported.' % (sopPath, prim.number()))
+			continue
+
+		if not objectNames.has_key(key):
+			name = '%s/packed%d' % (sopPath, len(objectNames))
+			objectNames[key] = ProcessObject(name, sopPath, readMesh, project, moments)
+
+		primMaterialNodeName = materialNodeName
+		try:
+			primMaterialNodeName = prim.attribValue('shop_materialpath') or materialNodeName
+		except hou.OperationFailed:
+			pass
+
+		matrix = appleseedgeo.MultiplyMatrices(PackedPrimMatrix(prim), world)
+		ProcessObjectInstance('%s.packed%d' % (instancerPath, prim.number()), objectNames[key], matrix, primMaterialNodeName, project, moments)
+
+##
+# Adds the objects and the object instances of an instance of soho:
+#
+# - with point instancing, an instance per point, see ProcessPointInstances(),
+# - with an instancepath object, an instance of the geometry of that object,
+# - with packed primitives, an instance per primitive,
+# - otherwise an instance of its own geometry.
+#
+# An object is written once however many times it is instanced.
+#
+def ProcessInstances(sohoObject, project, moments):
+	instancerNode = hou.node(sohoObject.getName())
+	materialNodeName = instancerNode.evalParm('shop_materialpath')
+	sopPath = sohoObject.getDefaultedString('object:soppath', moments[0], [''])[0]
+
+	world = []
+	sohoObject.evalFloat('space:world', moments[0], world)
+
+	instancePath = sohoObject.getDefaultedString('instancepath', moments[0], [''])[0]
+	if instancePath != '':
+		if sohoObject.getDefaultedInt('ptinstance', moments[0], [0])[0]:
+			ProcessPointInstances(instancerNode, sopPath, instancePath, world, materialNodeName, project, moments)
+			return
+
+		if theCuller is not None and theCuller.Cull(PrototypeBounds(instancerNode, instancePath, moments), world, appleseedcull.Culler.INSTANCES):
+			return
+
+		prototype = ProcessPrototype(instancerNode, instancePath, materialNodeName, project, moments)
+		if prototype is not None:
+			ProcessObjectInstance(instancerNode.path(), prototype[0], world, prototype[1], project, moments)
+		return
+
+	packedPrims = PackedPrims(sopPath, moments)
+	if packedPrims:
+		ProcessPackedInstances(instancerNode, sopPath, packedPrims, world, materialNodeName, project, moments)
+		return
+
+	if theCuller is not None:
+		(bounds, size) = SopBounds(sopPath, moments)
+		if theCuller.Cull(bounds, world, appleseedcull.Culler.OBJECTS, size):
+			return
+		startTime = time.time()
+
+	objectName = ProcessSopObject(sopPath, project, moments)
+	ProcessObjectInstance(sopPath, objectName, world, materialNodeName, project, moments)
+
+	if theCuller is not None:
+		theCuller.Keep(appleseedcull.Culler.OBJECTS, time.time() - startTime, size)
+
+##
+# Returns the path of the outermost subnet holding the object node at path,
+# None if it is in none.
+#
+def OutermostSubnetPath(path):
+	subnetPath = None
+
+	node = hou.node(path)
+	parentNode = node and node.parent()
+	while parentNode is not None and parentNode.path() != '/obj':
+		if parentNode.type().name() == 'subnet':
+			subnetPath = parentNode.path()
+		parentNode = parentNode.parent()
+
+	return subnetPath
+
+##
+# Returns the name of the node group of /obj of the object nodes by path, the
+# first group by name for a node in several.
+#
+def NodeGroupNames():
+	objNode = hou.node('/obj')
+	if objNode is None:
+		return {}
+
+	nodeGroupNames = {}
+	for nodeGroup in sorted(objNode.nodeGroups(), key = lambda nodeGroup: nodeGroup.name()):
+		for node in nodeGroup.nodes():
+			nodeGroupNames.setdefault(node.path(), nodeGroup.name())
+
+	return nodeGroupNames
+
+##
+# Returns the objects as [(name, objects)] by the group exported to an
+# assembly file of its own, sorted by name, followed by the objects of no
+# group whose name is None. See Settings.ASSEMBLIES.
+#
+def GroupObjects(sohoObjects):
+	if theAssemblyCache is None:
+		return [(None, sohoObjects)]
+
+	assemblies = theSettings.attrs[Settings.ASSEMBLIES]
+
+	nodeGroupNames = {}
+	if assemblies == Settings.ASSEMBLIES_GROUPS:
+		nodeGroupNames = NodeGroupNames()
+
+	groups = {}
+	for sohoObject in sohoObjects:
+		path = sohoObject.getName()
+		if assemblies == Settings.ASSEMBLIES_SUBNETS:
+			name = OutermostSubnetPath(path)
+			if name is not None:
+				name = name.replace('/', '__')
+		else:
+			name = nodeGroupNames.get(path)
+		groups.setdefault(name, []).append(sohoObject)
+
+	ungrouped = groups.pop(None, [])
+	return sorted(groups.items()) + [(None, ungrouped)]
+
+##
+# Returns the key of a group of objects exported at moments to an assembly
+# file, known before it is resolved: its name, the settings and the camera it
+# is culled by, the paths, SOPs and world transforms of its objects and the
+# parameters of their nodes. See ArchiveFile.
+#
+def GroupKey(name, sohoObjects, moments):
+	sha = hashlib.sha1()
+	sha.update('%s\n%s\n' % (name, os.path.abspath(CompanionDir())))
+	for key in ArchiveFile.KEY_SETTINGS:
+		sha.update('%s=%r\n' % (key, theSettings.attrs[key]))
+
+	if theCuller is not None:
+		sha.update('cull %r %r %r %r\n' % (theCuller.toCamera, theCuller.slopeX, theCuller.slopeY, theCuller.maxDistance))
+
+	nodePaths = []
+	for sohoObject in sohoObjects:
+		path = sohoObject.getName()
+		sopPath = sohoObject.getDefaultedString('object:soppath', moments[0], [''])[0]
+
+		world = []
+		sohoObject.evalFloat('space:world', moments[0], world)
+
+		sha.update('%s %s %r\n' % (path, sopPath, world))
+		nodePaths.extend([path, sopPath])
+
+	sha.update(NodesDigest(nodePaths, moments))
+	return sha.hexdigest()
+
+##
+# Stores the dependencies of the groups resolved to assembly files, once the
+# files they refer to are written, with the size, the modification time and
+# the digest of each file. A group whose files are gone is resolved again
+# next time. See ArchiveFile.
+#
+def SaveArchiveDependencies():
+	for (groupKey, dependencies) in sorted(theArchiveDependencies.items()):
+		fileStamps = [(filePath, FileStamp(filePath)) for filePath in dependencies[ArchiveFile.FILES]]
+		if [stamp for (filePath, stamp) in fileStamps if stamp is None]:
+			continue
+
+		dependencies = dict(dependencies)
+		dependencies[ArchiveFile.FILES] = [[filePath] + stamp + [appleseedcache.FileDigest(filePath)] for (filePath, stamp) in fileStamps]
+
+		key = groupKey + ArchiveFile.DEPENDENCIES_FILE_EXTENSION
+		filePath = theAssemblyCache.FilePath(key)
+		temporaryFilePath = '%s.%d' % (filePath, os.getpid())
+
+		file = open(temporaryFilePath, 'w')
+		try:
+			json.dump(dependencies, file)
+		finally:
+			file.close()
+
+		if os.name == 'nt' and os.path.exists(filePath):
+			os.remove(filePath)
+		os.rename(temporaryFilePath, filePath)
+		theAssemblyCache.Insert(key)
+
+	theArchiveDependencies.clear()
+
+##
+# Resolves the scene at moments and writes its project to stream.
+#
+def ExportFrame(moments, stream):
+	global theProject
+	global theCuller
+	global theArchiveFile
+
+	theProject = Project()
+	theCuller = None
+
+	theProfiler.Begin('camera')
+	for sohoCamera in soho.objectList('objlist:camera'):
+		camera = Camera()
+		camera.Resolve(sohoCamera, moments)
+		theProject.scene.camera = camera
+		if theIprScene is not None:
+			theIprScene.TrackCamera(camera)
+
+		# The IPR session moves the camera after the export, nothing is
+		# culled then.
+		if theSettings.attrs[Settings.CULL] and theIprScene is None:
+			theCuller = appleseedcull.Culler(
+				hou.Matrix4(camera.transform.matrix.data).transposed().asTuple(),
+				camera.attrs[Camera.FILM_DIMENSIONS].value[0],
+				camera.attrs[Camera.FOCAL_LENGTH].value[0],
+				theSettings.attrs[Settings.CULL_PADDING],
+				theSettings.attrs[Settings.CULL_DISTANCE])
+		break
+	theProfiler.End()
+
+	# Entities are written as soon as they are resolved.
+	#
+	# The IPR session updates entities by their own names, they are kept.
+	#
+	deduplicator = None
+	if theSettings.attrs[Settings.DEDUPLICATE_SHADING] and theIprScene is None:
+		deduplicator = appleseedshaders.Deduplicator()
+
+	serializer = XmlSerializer(theProfiler.Stream(stream), deduplicator)
+	theProfiler.Begin('serialization')
+	serializer.Begin(theProject)
+	theProfiler.End()
+
+	# Export light.
+	# TODO: Not use wrangler now
+	#
+	for sohoLight in soho.objectList('objlist:light'):
+		theProfiler.Begin('lights')
+		sohoLightName = sohoLight.getDefaultedString('object:name', sohoLight, [''])[0]
+		if not theProject.scene.assembly.lights.has_key(sohoLightName):
+			light = Light()
+			light.Resolve(sohoLight, moments)
+			theProject.scene.assembly.lights[sohoLightName] = light
+
+			exitanceName = light.exitance.attrs[Color.NAME]
+			if not theProject.scene.assembly.colors.has_key(exitanceName):
+				theProject.scene.assembly.colors[exitanceName] = light.exitance
+
+			if theIprScene is not None:
+				theIprScene.TrackLight(light)
+		theProfiler.End()
+
+		theProfiler.Begin('serialization')
+		serializer.Flush(theProject)
+		theProfiler.End()
+
+	# Export geometry data. Meshes are extracted here and written by the
+	# geometry writer, the largest first when it has several processes.
+	#
+	# The objects of a group exported to an assembly file of its own come
+	# before the others, a group at a time. An assembly only refers to its
+	# own shading entities, each file has and merges its own. A group which
+	# depends on nothing changed since its file was written keeps the file
+	# and is not resolved, see ArchiveFile. The groups come first so that
+	# their files are checked before the other objects write meshes again.
+	#
+	serializers = [serializer]
+	reused = 0
+	for (groupName, sohoObjects) in GroupObjects(soho.objectList('objlist:instance')):
+		(project, groupSerializer, archiveFile) = (theProject, serializer, None)
+		if groupName is not None:
+			theProfiler.Begin('assembly_keys')
+			archiveFile = ArchiveFile(groupName, GroupKey(groupName, sohoObjects, moments), moments)
+			isReused = archiveFile.Reuse()
+			theProfiler.End()
+
+			if isReused:
+				if archiveFile.archive is not None:
+					theProject.scene.archiveAssemblies.append(archiveFile.archive)
+				reused += 1
+				continue
+
+			groupDeduplicator = None
+			if deduplicator is not None:
+				groupDeduplicator = appleseedshaders.Deduplicator()
+
+			archiveFile.Open(groupDeduplicator)
+			(project, groupSerializer) = (archiveFile.project, archiveFile.serializer)
+			serializers.append(groupSerializer)
+
+		if theGeometryWriter.pool is not None:
+			sohoObjects = SortLargestFirst(sohoObjects, moments)
+
+		theArchiveFile = archiveFile
+		for sohoObjectInstance in sohoObjects:
+			theProfiler.BeginObject()
+			ProcessInstances(sohoObjectInstance, project, moments)
+			theProfiler.EndObject(sohoObjectInstance.getName())
+
+			if theIprScene is not None:
+				theIprScene.TrackInstancer(sohoObjectInstance.getName(), project)
+
+			theProfiler.Begin('serialization')
+			groupSerializer.Flush(project)
+			theProfiler.End()
+		theArchiveFile = None
+
+		if archiveFile is not None:
+			theProfiler.Begin('serialization')
+			archiveFile.Close()
+			if archiveFile.archive is not None:
+				theProject.scene.archiveAssemblies.append(archiveFile.archive)
+			theProfiler.End()
+
+	theProfiler.Begin('frame')
+	frame = Frame()
+	frame.Resolve(None, moments)
+	theProject.output.frames[frame.attrs[Frame.NAME]] = frame
+
+	theProject.configurations.Resolve(None, moments)
+	theProfiler.End()
+
+	theProfiler.Begin('serialization')
+	serializer.End(theProject)
+	theProfiler.End()
+
+	if theIprScene is not None:
+		theIprScene.TrackShading(theProject)
+
+	if theCuller is not None:
+		Log('cull: %s' % theCuller.Statistics())
+
+	pruned = sum([groupSerializer.pruned for groupSerializer in serializers])
+	if pruned:
+		Log('pruned %d unreferenced shading entities' % pruned)
+
+	merged = sum([groupSerializer.deduplicator.merged for groupSerializer in serializers if groupSerializer.deduplicator is not None])
+	if merged:
+		Log('merged %d duplicate shading entities' % merged)
+
+	if theProject.scene.archiveAssemblies:
+		Log('%d groups in assembly files, %d reused' % (len(theProject.scene.archiveAssemblies), reused))
+
+	theProject = None
+	theCuller = None
+	theSopGeometries.clear()
+	theSopBounds.clear()
+
+
+##
+#
+Attr = appleseedshading.Attr
+
+##
+# Entities shared with the SHOP clerk, see appleseedshaders.
+#
+Node          = appleseedshaders.Node
+EntityTable   = appleseedshaders.EntityTable
+Material      = appleseedshaders.Material
+BSDF          = appleseedshaders.BSDF
+EDF           = appleseedshaders.EDF
+SurfaceShader = appleseedshaders.SurfaceShader
+Color         = appleseedshaders.Color
 
 ##
 #
@@ -178,6 +1014,10 @@ class Scene(Node):
 		self.assembly         = Assembly()
 		self.assemblyInstance = AssemblyInstance()
 
+		# Assemblies read from files of their own and their instances, as
+		# [(ArchiveAssembly, AssemblyInstance)].
+		self.archiveAssemblies = []
+
 
 ##
 #
@@ -188,16 +1028,16 @@ class Assembly(Node):
 	def __init__(self):
 		super(Assembly, self).__init__()
 
-		self.lights = {}
+		self.lights = EntityTable()
 
-		self.materials = {}
-		self.bsdfs = {}
-		self.edfs = {}
-		self.colors = {}
-		self.surfaceShaders = {}
+		self.materials = EntityTable()
+		self.bsdfs = EntityTable()
+		self.edfs = EntityTable()
+		self.colors = EntityTable()
+		self.surfaceShaders = EntityTable()
 
-		self.objects = {}
-		self.objectInstances = {}
+		self.objects = EntityTable()
+		self.objectInstances = EntityTable()
 
 
 ##
@@ -215,115 +1055,35 @@ class AssemblyInstance(Node):
 
 		self.transform = Transform()
 
-		
+
 ##
+# An assembly whose contents appleseed reads from an assembly file, see
+# ArchiveFile.
 #
-class BSDF(Assembly):
-
-	NAME  = 'name'
-	MODEL = 'model'
-
-	ASHIKHMIN_BRDF = 'ashikhmin_brdf'
-	ASHIKHMIN_DIFFUSE_REFLECTANCE = 'ashikhmin_diffuse_reflectance'
-	ASHIKHMIN_GLOSSY_REFLECTANCE = 'ashikhmin_glossy_reflectance'
-	ASHIKHMIN_SHININESS_U = 'ashikhmin_shininess_u'
-	ASHIKHMIN_SHININESS_V = 'ashikhmin_shininess_v'
-
-	BSDF_MIX = 'bsdf_mix'
-	BSDF_MIX_BSDF0 = 'bsdf_mix_bsdf0'
-	BSDF_MIX_WEIGHT0 = 'bsdf_mix_weight0'
-	BSDF_MIX_BSDF1 = 'bsdf_mix_bsdf1'
-	BSDF_MIX_WEIGHT1 = 'bsdf_mix_weight1'
-
-	KELEMEN_BRDF = 'kelemen_brdf'
-	KELEMEN_MATTE_REFLECTANCE = 'kelemen_matte_reflectance'
-	KELEMEN_SPECULAR_REFLECTANCE = 'kelemen_specular_reflectance'
-	KELEMEN_ROUGHNESS = 'kelemen_roughness'
-
-	LAMBERTIAN_BRDF = 'lambertian_brdf'
-	LAMBERTIAN_REFLECTANCE = 'lambertian_reflectance'
-
-	SPECULAR_BRDF = 'specular_brdf'
-	SPECULAR_BRDF_REFLECTANCE = 'specular_brdf_reflectance'
-
-	SPECULAR_BTDF = 'specular_btdf'
-	SPECULAR_BTDF_REFLECTANCE = 'specular_btdf_reflectance'
-	SPECULAR_BTDF_TRANSMITTANCE = 'specular_btdf_transmittance'
-	SPECULAR_BTDF_FROM_IOR = 'specular_btdf_from_ior'
-	SPECULAR_BTDF_TO_IOR = 'specular_btdf_to_ior'
-
-	def __init__(self):
-		super(BSDF, self).__init__()
-
-		self.bsdf0 = None
-		self.bsdf1 = None
-
-	def AsAshikhminBrdf(self, shopNode, moments):
-		self.attrs[BSDF.ASHIKHMIN_DIFFUSE_REFLECTANCE] = shopNode.evalParm(BSDF.ASHIKHMIN_DIFFUSE_REFLECTANCE)
-		self.attrs[BSDF.ASHIKHMIN_GLOSSY_REFLECTANCE] = shopNode.evalParm(BSDF.ASHIKHMIN_GLOSSY_REFLECTANCE)
-		self.attrs[BSDF.ASHIKHMIN_SHININESS_U] = Attr(shopNode.evalParm(BSDF.ASHIKHMIN_SHININESS_U))
-		self.attrs[BSDF.ASHIKHMIN_SHININESS_V] = Attr(shopNode.evalParm(BSDF.ASHIKHMIN_SHININESS_V))
-
-	def AsKelemenBrdf(self, shopNode, moments):
-		self.attrs[BSDF.KELEMEN_MATTE_REFLECTANCE] = shopNode.evalParm(BSDF.KELEMEN_MATTE_REFLECTANCE)
-		self.attrs[BSDF.KELEMEN_SPECULAR_REFLECTANCE] = shopNode.evalParm(BSDF.KELEMEN_SPECULAR_REFLECTANCE)
-		self.attrs[BSDF.KELEMEN_ROUGHNESS] = Attr(shopNode.evalParm(BSDF.KELEMEN_ROUGHNESS))
-
-	def AsLambertianBrdf(self, shopNode, moments):
-		self.attrs[BSDF.LAMBERTIAN_REFLECTANCE] = shopNode.evalParm(BSDF.LAMBERTIAN_REFLECTANCE)
-
-	def AsSpecularBrdf(self, shopNode, moments):
-		self.attrs[BSDF.SPECULAR_BRDF_REFLECTANCE] = shopNode.evalParm(BSDF.SPECULAR_BRDF_REFLECTANCE)
-
-	def AsSpecularBtdf(self, shopNode, moments):
-		self.attrs[BSDF.SPECULAR_BTDF_REFLECTANCE] = shopNode.evalParm(BSDF.SPECULAR_BTDF_REFLECTANCE)
-		self.attrs[BSDF.SPECULAR_BTDF_TRANSMITTANCE] = shopNode.evalParm(BSDF.SPECULAR_BTDF_TRANSMITTANCE)
-		self.attrs[BSDF.SPECULAR_BTDF_FROM_IOR] = shopNode.evalParm(BSDF.SPECULAR_BTDF_FROM_IOR)
-		self.attrs[BSDF.SPECULAR_BTDF_TO_IOR] = shopNode.evalParm(BSDF.SPECULAR_BTDF_TO_IOR)
-
-	def Resolve(self, shopNode, moments):
-		self.attrs[BSDF.NAME] = shopNode.path()
-
-		model = shopNode.evalParm(BSDF.MODEL)
-		self.attrs[BSDF.MODEL] = model
-		if model == BSDF.ASHIKHMIN_BRDF:
-			self.AsAshikhminBRDF(shopNode, moments)
-		if model == BSDF.BSDF_MIX:
-			self.attrs[BSDF.BSDF_MIX_BSDF0] = shopNode.evalParm(BSDF.BSDF_MIX_BSDF0)
-			self.attrs[BSDF.BSDF_MIX_WEIGHT0] = Attr(shopNode.evalParm(BSDF.BSDF_MIX_WEIGHT0))
-			self.attrs[BSDF.BSDF_MIX_BSDF1] = shopNode.evalParm(BSDF.BSDF_MIX_BSDF1)
-			self.attrs[BSDF.BSDF_MIX_WEIGHT1] = Attr(shopNode.evalParm(BSDF.BSDF_MIX_WEIGHT1))
-		elif model == BSDF.KELEMEN_BRDF:
-			self.AsKelemenBrdf(shopNode, moments)
-		elif model == BSDF.LAMBERTIAN_BRDF:
-			self.AsLambertianBrdf(shopNode, moments)
-		elif model == BSDF.SPECULAR_BRDF:
-			self.AsSpecularBrdf(shopNode, moments)
-		elif model == BSDF.SPECULAR_BTDF:
-			self.AsSpecularBtdf(shopNode, moments)
+class ArchiveAssembly(Node):
 
+	NAME     = 'name'
+	MODEL    = 'model'
 
-##
-#
-class EDF(Assembly):
+	FILENAME = 'filename'
 
-	NAME = 'name'
-	MODEL = 'model'
+	ARCHIVE_ASSEMBLY = 'archive_assembly'
 
-	EXITANCE = 'exitance'
+	PARAMETERS = {
+		ARCHIVE_ASSEMBLY : (
+			(FILENAME, FILENAME, FormatValue),
+		),
+	}
 
 	def __init__(self):
-		super(EDF, self).__init__()
+		super(ArchiveAssembly, self).__init__()
 
-	def Resolve(self, shopNode, moments):
-		self.attrs[EDF.NAME] = shopNode.path()
-		self.attrs[EDF.MODEL] = 'diffuse_edf'
-		self.attrs[EDF.MODEL] = 'diffuse_edf'
-		self.attrs[EDF.EXITANCE] = shopNode.evalParm(EDF.EXITANCE)
+		self.attrs[ArchiveAssembly.MODEL] = ArchiveAssembly.ARCHIVE_ASSEMBLY
 
+		
 ##
 #
-class Light(Assembly):
+class Light(Node):
 
 	NAME = 'name'
 	MODEL = 'model'
@@ -332,6 +1092,7 @@ class Light(Assembly):
 	SPOT_LIGHT = 'spot_light'
 
 	EXITANCE = 'exitance'
+	EXITANCE_SUFFIX = '_exitance'
 	INNER_ANGLE = 'inner_angle'
 	OUTER_ANGLE = 'outer_angle'
 
@@ -346,6 +1107,21 @@ class Light(Assembly):
 		LIGHT_COLOR : soho.SohoParm(LIGHT_COLOR, 'real', [1, 1, 1], False)
 	}
 
+	COMMON_PARAMETERS = (
+		(EXITANCE, EXITANCE, FormatValue),
+	)
+
+	PARAMETERS = {
+		SPOT_LIGHT : (
+			(INNER_ANGLE, INNER_ANGLE, FormatValue),
+			(OUTER_ANGLE, OUTER_ANGLE, FormatValue),
+		),
+	}
+
+	COMMON_REFERENCES = (
+		(EXITANCE, 'Color'),
+	)
+
 	def __init__(self):
 		super(Light, self).__init__()
 
@@ -353,346 +1129,247 @@ class Light(Assembly):
 		self.exitance = Color()
 
 	def Resolve(self, sohoLight, moments):
-		self.attrs[Light.NAME] = sohoLight.getName()
-	
-		sohoLight.evalFloat('space:world', moments[0], self.transform.matrix.data)
-		self.transform.matrix.data = hou.Matrix4(self.transform.matrix.data).transposed().asTuple()
+		world = []
+		sohoLight.evalFloat('space:world', moments[0], world)
+
+		sohoParamsValues = sohoLight.evaluate(Light.SUPPORTED_SOHO_PARAMS, moments[0])
+		self.ResolveValues(sohoLight.getName(), world, SohoParmValues(sohoParamsValues))
+
+	##
+	# Resolves the light from its node rather than from soho, for the IPR
+	# session.
+	#
+	def ResolveNode(self, lightNode):
+		self.ResolveValues(lightNode.path(), lightNode.worldTransform().asTuple(), EvalNodeParms(lightNode, Light.SUPPORTED_SOHO_PARAMS))
+
+	def ResolveValues(self, name, world, values):
+		self.attrs[Light.NAME] = name
+
+		self.transform.matrix.data = hou.Matrix4(world).transposed().asTuple()
 
-		sohoParamsValues = sohoLight.evaluate(Light.SUPPORTED_SOHO_PARAMS, moments[0])		
-		if sohoParamsValues[Light.CONE_ENABLE].Value[0]:
+		if values[Light.CONE_ENABLE][0]:
 			self.attrs[Light.MODEL] = Light.SPOT_LIGHT
 			
-			self.attrs[Light.INNER_ANGLE] = Attr(sohoParamsValues[Light.CONE_ANGLE].Value[0] - sohoParamsValues[Light.CONE_DELTA].Value[0])
-			self.attrs[Light.OUTER_ANGLE]  = Attr(sohoParamsValues[Light.CONE_ANGLE].Value[0])
+			self.attrs[Light.INNER_ANGLE] = Attr(values[Light.CONE_ANGLE][0] - values[Light.CONE_DELTA][0])
+			self.attrs[Light.OUTER_ANGLE]  = Attr(values[Light.CONE_ANGLE][0])
 		else:
 			self.attrs[Light.MODEL] = Light.POINT_LIGHT
 
 		# TODO: Connect with SHOP
-		self.exitance.attrs[Color.NAME] = sohoLight.getName() + str(uuid.uuid4())
+		# The color is named after the light so that the same scene gives the
+		# same project, lights of the same color share one once written.
+		self.exitance.attrs[Color.NAME] = name + Light.EXITANCE_SUFFIX
 		self.exitance.attrs[Color.COLOR_SPACE] = 'srgb'
-		self.exitance.attrs[Color.VALUES] = Attr(sohoParamsValues[Light.LIGHT_COLOR].Value)
+		self.exitance.attrs[Color.VALUES] = Attr(values[Light.LIGHT_COLOR])
+
+		self.attrs[Light.EXITANCE] = self.exitance.attrs[Color.NAME]
 		
 
 ##
+# Represents the <object> in the XML scene description.
 #
-class Material(Assembly):
+class Object(Node):
 
+	##
+	# <object> used attributes.
 	NAME     = 'name'
 	MODEL    = 'model'
 
-	BSDF           = 'bsdf'
-	EDF            = 'edf'
-	SURFACE_SHADER = 'surface_shader'
-
-	def __init__(self):
-		super(Material, self).__init__()
-
-	def Resolve(self, shopNode, moments):
-		self.attrs[Material.NAME] = shopNode.path()
+	FILENAME = 'filename'
 
-		self.attrs[Material.MODEL] = 'generic_material'
-		
-		bsdf = shopNode.evalParm(Material.BSDF)
-		if bsdf != '':
-			self.attrs[Material.BSDF] = bsdf
+	PARAMETERS = {
+		'mesh_object' : (
+			(FILENAME, FILENAME, FormatValue),
+		),
+	}
 
-		edf = shopNode.evalParm(Material.EDF)
-		if edf != '':
-			self.attrs[Material.EDF] = edf
+	def __init__(self):
+		super(Object, self).__init__()
 
-		surfaceShader = shopNode.evalParm(Material.SURFACE_SHADER)
-		if surfaceShader == '':
-			soho.error('Must set surface shader for %s' % shopNode.path())
-		self.attrs[Material.SURFACE_SHADER] = surfaceShader
+		# Within a sequence, the frame number of geometry written per frame.
+		self.fileSuffix = ''
 
-##
-#
-class Color(Node):
+		# Path of the mesh file written.
+		self.filePath = None
 
-	COLOR = 'color'
+	def CompanionFilePath(self, sopPath, extension):
+		companionDir = CompanionDir()
 
-	NAME = 'name'
+		formattedSopPath = sopPath.replace('/', '__')
+		fileName = formattedSopPath + self.fileSuffix + extension
+		filePath = os.path.join(companionDir, fileName)
 
-	COLOR_SPACE = 'color_space'
-	COLOR_VALUES = 'color_values'
-	SPECTRAL_VALUES = 'spectral_values'
-	VALUES = 'values'
-	ALPHA = 'alpha'
-	WAVELENGTH = 'wavelength'
-	WAVELENGTH_RANGE_X = 'wavelength_rangex'
-	WAVELENGTH_RANGE_Y = 'wavelength_rangey'
-	MULTIPLIER = 'multiplier'
+		self.attrs[Object.FILENAME] = os.path.join('.', os.path.basename(companionDir), fileName)
 
-	def __init__(self):
-		super(Color, self).__init__()
+		return filePath
 
-	def Resolve(self, shopNode, moments):
-		self.attrs[Color.NAME] = shopNode.path()
-	
-		self.attrs[Color.COLOR_SPACE] = shopNode.evalParm(Color.COLOR_SPACE)
-		if self.attrs[Color.COLOR_SPACE] != 'spectral':
-			self.attrs[Color.VALUES] = Attr(shopNode.evalParmTuple(Color.COLOR_VALUES))
+	##
+	# Writes the mesh into the geometry cache unless an identical one is
+	# already there, the object then refers to the cached file.
+	#
+	def CachedFilePath(self, sopPath, mesh, writer, extension):
+		fileName = mesh.Digest(sopPath.replace('/', '__'), writer.CacheKey()) + extension
+		key = fileName + writer.FileSuffix()
+
+		filePath = theGeometryCache.Lookup(key)
+		if filePath is None:
+			filePath = theGeometryCache.FilePath(key)
+			theGeometryWriter.Write(writer, filePath, sopPath, mesh, key)
+
+		companionDir = CompanionDir()
+		if os.path.dirname(os.path.abspath(filePath)) == os.path.join(os.path.abspath(companionDir), Settings.GEOMETRY_CACHE_DIR_DEFAULT):
+			self.attrs[Object.FILENAME] = os.path.join('.', os.path.basename(companionDir), Settings.GEOMETRY_CACHE_DIR_DEFAULT, fileName)
 		else:
-			self.attrs[Color.VALUES] = shopNode.evalParm(Color.SPECTRAL_VALUES)
-			self.attrs[Color.WAVELENGTH] = (shopNode.evalParm(Color.WAVELENGTH_RANGE_X), shopNode.evalParm(Color.WAVELENGTH_RANGE_Y))
-
-		self.attrs[Color.ALPHA] = Attr(shopNode.evalParm(Color.ALPHA))
-		self.attrs[Color.MULTIPLIER] = Attr(shopNode.evalParm(Color.MULTIPLIER))
-
-##
-#
-class SurfaceShader(Node):
-
-	NAME  = 'name'
-	MODEL = 'model'
+			self.attrs[Object.FILENAME] = os.path.join(os.path.dirname(os.path.abspath(filePath)), fileName)
 
-	AO_SURFACE_SHADER  = 'ao_surface_shader'
-	AO_SAMPLING_METHOD = 'ao_sampling_method'
-	AO_SAMPLES         = 'ao_samples'
-	AO_MAX_DISTANCE    = 'ao_max_distance'
-
-	CONSTANT_SURFACE_SHADER = 'constant_surface_shader'
-	CONSTANT_COLOR = 'constant_color'
-
-	DIAGNOSTIC_SURFACE_SHADER = 'diagnostic_surface_shader'
-	DIAGNOSTIC_MODE = 'diagnostic_mode'
-	DIAGNOSTIC_AO = 'ambient_occlusion'
-	DIAGNOSTIC_AO_SAMPLES = 'diagnostic_ao_samples'
-	DIAGNOSTIC_AO_MAX_DISTANCE = 'diagnostic_ao_max_distance'
-
-	FAST_SSS_SURFACE_SHADER = 'fast_sss_surface_shader'
-	FAST_SSS_SCALE = 'fast_sss_scale'
-	FAST_SSS_AMBIENT_SSS = 'fast_sss_ambient_sss'
-	FAST_SSS_VIEW_DEP_SSS = 'fast_sss_view_dep_sss'
-	FAST_SSS_DIFFUSE = 'fast_sss_diffuse'
-	FAST_SSS_POWER = 'fast_sss_power'
-	FAST_SSS_DISTORTION = 'fast_sss_distortion'
-	FAST_SSS_ALBEDO = 'fast_sss_albedo'
-	FAST_SSS_LIGHT_SAMPLES = 'fast_sss_light_samples'
-	FAST_SSS_OCCLUSION_SAMPLES = 'fast_sss_occlusion_samples'
-
-	PHYSICAL_SURFACE_SHADER = 'physical_surface_shader'
-	PHYSICAL_COLOR_MULTIPLIER = 'physical_color_multiplier'
-	PHYSICAL_ALPHA_MULTIPLIER = 'physical_alpha_multiplier'
-	PHYSICAL_AERIAL_PERSP_MODE = 'physical_aerial_persp_mode'
-	PHYSICAL_AERIAL_PERSP_MODE_NONE = 'none'
-	PHYSICAL_AERIAL_PERSP_MODE_ENVIRONMENT_SHADER = 'environment_shader'
-	PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR = 'sky_color'
-	PHYSICAL_AERIAL_PERSP_SKY_COLOR = 'physical_aerial_persp_sky_color'
-	PHYSICAL_AERIAL_PERSP_DISTANCE = 'physical_aerial_persp_distance'
-	PHYSICAL_AERIAL_PERSP_INTENSITY = 'physical_aerial_persp_intensity'
-
-	SMOKE_SURFACE_SHADER = 'smoke_surface_shader'
-	SMOKE_BOUNDING_BOX = 'smoke_bounding_box'
-	SMOKE_BOUNDING_BOX_MIN = 'smoke_bounding_box_min'
-	SMOKE_BOUNDING_BOX_MAX = 'smoke_bounding_box_max'
-	SMOKE_SHADING_MODE = 'smoke_shading_mode'
-	SMOKE_INTERPOLATION_MODE = 'smoke_interpolation_mode'
-	SMOKE_ISOSURFACE_THRESHOLD = 'smoke_isosurface_threshold'
-	SMOKE_FILENAME = 'smoke_filename'
-	SMOKE_STEP_SIZE = 'smoke_step_size'
-	SMOKE_DENSITY_CUTOFF = 'smoke_density_cutoff'
-	SMOKE_DENSITY_SCALE = 'smoke_density_scale'
-	SMOKE_SMOKE_COLOR = 'smoke_smoke_color'
-	SMOKE_FUEL_COLOR = 'smoke_fuel_color'
-	SMOKE_FUEL_SCALE = 'smoke_fuel_scale'
-	SMOKE_LIGHT_DIRECTION = 'smoke_light_direction'
-	SMOKE_LIGHT_COLOR = 'smoke_light_color'
-	SMOKE_COLOR_SCALE = 'smoke_color_scale'
-	SMOKE_VOLUME_OPACITY = 'smoke_volume_opacity'
-	SMOKE_SHADOW_OPACITY = 'smoke_shadow_opacity'
+		return filePath
 
-	def __init__(self):
-		super(SurfaceShader, self).__init__()
-
-	def Resolve(self, shopNode, moments):
-		self.attrs[SurfaceShader.NAME] = shopNode.path()
-		self.attrs[SurfaceShader.MODEL] = shopNode.evalParm(SurfaceShader.MODEL)
-
-		model = self.attrs[SurfaceShader.MODEL]
-		# AO
-		if model == SurfaceShader.AO_SURFACE_SHADER:
-			aoSamplingMethod = shopNode.evalParm(SurfaceShader.AO_SAMPLING_METHOD)
-			if aoSamplingMethod != 'uniform':
-				self.attrs[SurfaceShader.AO_SAMPLING_METHOD] = Attr(aoSamplingMethod)
-
-			aoSamples = shopNode.evalParm(SurfaceShader.AO_SAMPLES)
-			if aoSamplingMethod != 16:
-				self.attrs[SurfaceShader.AO_SAMPLES] = Attr(aoSamples)
-
-			aoMaxDistance = shopNode.evalParm(SurfaceShader.AO_MAX_DISTANCE)
-			if aoSamplingMethod != 1.0:
-				self.attrs[SurfaceShader.AO_MAX_DISTANCE] = Attr(aoMaxDistance)
-
-		# Constant
-		elif model == SurfaceShader.CONSTANT_SURFACE_SHADER:
-			self.attrs[SurfaceShader.CONSTANT_COLOR] = shopNode.evalParm(SurfaceShader.CONSTANT_COLOR)
-
-		# Diagnostic
-		elif model == SurfaceShader.DIAGNOSTIC_SURFACE_SHADER:
-			self.attrs[SurfaceShader.DIAGNOSTIC_MODE] = Attr(shopNode.evalParm(SurfaceShader.DIAGNOSTIC_MODE))
-			
-			if self.attrs[SurfaceShader.DIAGNOSTIC_MODE].value == SurfaceShader.DIAGNOSTIC_AO:
-				diagAOSamples = shopNode.evalParm(SurfaceShader.DIAGNOSTIC_AO_SAMPLES)
-				if diagAOSamples != 16:
-					self.attrs[SurfaceShader.DIAGNOSTIC_AO_SAMPLES] = Attr(diagAOSamples)
-				diagAOMaxDistance = shopNode.evalParm(SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE)
-				if diagAOMaxDistance != 1.0:
-					self.attrs[SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE] = Attr(diagAOMaxDistance)
-
-		# Fast SSS
-		elif model == SurfaceShader.FAST_SSS_SURFACE_SHADER:
-			self.attrs[SurfaceShader.FAST_SSS_SCALE]        = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_SCALE))
-			self.attrs[SurfaceShader.FAST_SSS_AMBIENT_SSS]  = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_AMBIENT_SSS))
-			self.attrs[SurfaceShader.FAST_SSS_VIEW_DEP_SSS] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_VIEW_DEP_SSS))
-			self.attrs[SurfaceShader.FAST_SSS_DIFFUSE] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_DIFFUSE))
-			self.attrs[SurfaceShader.FAST_SSS_POWER] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_POWER))
-			self.attrs[SurfaceShader.FAST_SSS_DISTORTION] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_DISTORTION))
-			self.attrs[SurfaceShader.FAST_SSS_ALBEDO] = shopNode.evalParm(SurfaceShader.FAST_SSS_ALBEDO)
-			self.attrs[SurfaceShader.FAST_SSS_LIGHT_SAMPLES] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_LIGHT_SAMPLES))
-			self.attrs[SurfaceShader.FAST_SSS_OCCLUSION_SAMPLES] = Attr(shopNode.evalParm(SurfaceShader.FAST_SSS_OCCLUSION_SAMPLES))
-			
-		# Physical
-		elif model == SurfaceShader.PHYSICAL_SURFACE_SHADER:
-			self.attrs[SurfaceShader.PHYSICAL_COLOR_MULTIPLIER] = Attr(shopNode.evalParm(SurfaceShader.PHYSICAL_COLOR_MULTIPLIER))
-			self.attrs[SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER] = Attr(shopNode.evalParm(SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER))
-
-			aerialPerspMode = shopNode.evalParm(SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE)
-			self.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE] = aerialPerspMode
-			if aerialPerspMode != SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_NONE:
-				if aerialPerspMode == SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR:
-					self.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_SKY_COLOR] = shopNode.evalParm(SurfaceShader.PHYSICAL_AERIAL_PERSP_SKY_COLOR)
-			self.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_DISTANCE] = Attr(shopNode.evalParm(SurfaceShader.PHYSICAL_AERIAL_PERSP_DISTANCE))
-			self.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_INTENSITY] = Attr(shopNode.evalParm(SurfaceShader.PHYSICAL_AERIAL_PERSP_INTENSITY))
-
-		# Smoke
-		elif model == SurfaceShader.SMOKE_SURFACE_SHADER:
-			boundingBoxMin = (shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MIN + 'x'), shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MIN + 'y'), shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MIN + 'z'))
-			self.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MIN]     = Attr( boundingBoxMin)
-			boundingBoxMax = (shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MAX + 'x'), shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MAX + 'y'), shopNode.evalParm(SurfaceShader.SMOKE_BOUNDING_BOX_MAX + 'z'))
-			self.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MAX]     = Attr(boundingBoxMax)
-			self.attrs[SurfaceShader.SMOKE_SHADING_MODE]         = Attr(shopNode.evalParm(SurfaceShader.SMOKE_SHADING_MODE))
-			self.attrs[SurfaceShader.SMOKE_INTERPOLATION_MODE]   = Attr(shopNode.evalParm(SurfaceShader.SMOKE_INTERPOLATION_MODE))
-			self.attrs[SurfaceShader.SMOKE_ISOSURFACE_THRESHOLD] = Attr(shopNode.evalParm(SurfaceShader.SMOKE_ISOSURFACE_THRESHOLD))
-			self.attrs[SurfaceShader.SMOKE_FILENAME]             = Attr(shopNode.evalParm(SurfaceShader.SMOKE_FILENAME))
-			self.attrs[SurfaceShader.SMOKE_STEP_SIZE]            = Attr(shopNode.evalParm(SurfaceShader.SMOKE_STEP_SIZE))
-			self.attrs[SurfaceShader.SMOKE_DENSITY_CUTOFF]       = Attr(shopNode.evalParm(SurfaceShader.SMOKE_DENSITY_CUTOFF))
-			self.attrs[SurfaceShader.SMOKE_DENSITY_SCALE]        = Attr(shopNode.evalParm(SurfaceShader.SMOKE_DENSITY_SCALE))
-			smokeColor = (shopNode.evalParm(SurfaceShader.SMOKE_SMOKE_COLOR + 'r'), shopNode.evalParm(SurfaceShader.SMOKE_SMOKE_COLOR + 'g'), shopNode.evalParm(SurfaceShader.SMOKE_SMOKE_COLOR + 'b'))
-			self.attrs[SurfaceShader.SMOKE_SMOKE_COLOR]          = Attr(smokeColor)
-			fuelColor = (shopNode.evalParm(SurfaceShader.SMOKE_FUEL_COLOR + 'r'), shopNode.evalParm(SurfaceShader.SMOKE_FUEL_COLOR + 'g'), shopNode.evalParm(SurfaceShader.SMOKE_FUEL_COLOR + 'b'))
-			self.attrs[SurfaceShader.SMOKE_FUEL_COLOR]           = Attr(fuelColor)
-			self.attrs[SurfaceShader.SMOKE_FUEL_SCALE]           = Attr(shopNode.evalParm(SurfaceShader.SMOKE_FUEL_SCALE))
-			lightDirection = (shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_DIRECTION + 'x'), shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_DIRECTION + 'y'), shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_DIRECTION + 'z'))
-			self.attrs[SurfaceShader.SMOKE_LIGHT_DIRECTION]      = Attr(lightDirection)
-			lightColor = (shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_COLOR + 'r'), shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_COLOR + 'g'), shopNode.evalParm(SurfaceShader.SMOKE_LIGHT_COLOR + 'b'))
-			self.attrs[SurfaceShader.SMOKE_LIGHT_COLOR]          = Attr(lightColor)
-			self.attrs[SurfaceShader.SMOKE_COLOR_SCALE]          = Attr(shopNode.evalParm(SurfaceShader.SMOKE_COLOR_SCALE))
-			self.attrs[SurfaceShader.SMOKE_VOLUME_OPACITY]       = Attr(shopNode.evalParm(SurfaceShader.SMOKE_VOLUME_OPACITY))
-			self.attrs[SurfaceShader.SMOKE_SHADOW_OPACITY]       = Attr(shopNode.evalParm(SurfaceShader.SMOKE_SHADOW_OPACITY))
+	##
+	# Writes the mesh next to the project or into the geometry cache. A
+	# compressed file is written under the name of the object file followed
+	# by the suffix of the compression.
+	#
+	def SaveMesh(self, sopPath, mesh, writer, extension):
+		if theGeometryCache is not None:
+			self.filePath = self.CachedFilePath(sopPath, mesh, writer, extension)
+			return self.filePath
 
+		filePath = self.CompanionFilePath(sopPath, extension)
 
-##
-# Represents the <object> in the XML scene description.
-#
-class Object(Assembly):
+		# The plain file expanded from the one of a former export is out of
+		# date, it is expanded again before rendering.
+		if writer.FileSuffix() and os.path.exists(filePath):
+			os.remove(filePath)
 
-	##
-	# <object> used attributes.
-	NAME     = 'name'
-	MODEL    = 'model'
+		filePath += writer.FileSuffix()
+		theGeometryWriter.Write(writer, filePath, sopPath, mesh, None)
 
-	FILENAME = 'filename'
+		self.filePath = filePath
+		return filePath
 
-	def __init__(self):
-		super(Object, self).__init__()
+	def SaveToWavefrontObj(self, sopPath, mesh):
+		writer = appleseedgeo.WavefrontObjWriter(theSettings.Compression(), theSettings.attrs[Settings.POSITION_PRECISION], theSettings.attrs[Settings.UV_PRECISION])
+		return self.SaveMesh(sopPath, mesh, writer, '.obj')
 
-	def SaveToWavefrontObj(self, sopPath, sohoGeometry):
-		splittedSopPath = sopPath.split('/')
+	def SaveToBinaryMesh(self, sopPath, mesh):
+		return self.SaveMesh(sopPath, mesh, appleseedgeo.BinaryMeshWriter(theSettings.Compression()), '.binarymesh')
 
-		## Check if the asset folder exists.
-		#
-		sohoDiskFilePath = soho.getDefaultedString('soho_diskfile', [''])[0]
-		sohoDiskFileDir = os.path.dirname(sohoDiskFilePath)
-		sohoDiskFileBaseName = os.path.basename(sohoDiskFilePath)
-		companionDir = '%s%s-assets' % (sohoDiskFileDir, sohoDiskFileBaseName.split('.')[0])
-		if not os.path.exists(companionDir):
-			os.mkdir(companionDir)
+	##
+	# Resolves the object from a mesh of the SOP sopPath, the object and its
+	# file are named after name.
+	#
+	def ResolveMesh(self, name, sopPath, mesh, moments):
+		self.attrs[Object.NAME] = name.replace('/', '__')
 
-		formattedSopPath = sopPath.replace('/', '__')
-		objFileName = formattedSopPath + '.obj'
-		objFilePath = os.path.join(companionDir, objFileName)
+		self.attrs[Object.MODEL] = 'mesh_object'
 
-		self.attrs[Object.FILENAME] = os.path.join('.', os.path.basename(companionDir), objFileName)
+		if theResolvedEntities is not None and IsTimeDependent(sopPath):
+			self.fileSuffix = '.%04d' % FrameNumber(moments[0])
 
-		## Export out the polygons.
-		#
-		file = open(objFilePath, 'w')
-
-		file.write('# %s\n' % sopPath)
-		file.write('g %s\n' % formattedSopPath)
-
-		geoPointCount = sohoGeometry.globalValue('geo:pointcount')[0]
-		geoPrimCount = sohoGeometry.globalValue('geo:primcount')[0]
-
-		file.write('# %d vertices, %d primitives.\n' % (geoPointCount, geoPrimCount))
-
-		# v		
-		geoPointP = sohoGeometry.attribute('geo:point', 'P')
-		for i in xrange(geoPointCount):
-			v = sohoGeometry.value(geoPointP, i)
-			file.write('v %.10f %.10f %.10f\n' % (v[0], v[1], v[2]))
-
-		# vt
-		hasUV = False
-		geoPrimVertexCount = sohoGeometry.attribute('geo:prim', 'geo:vertexcount')
-		geoVertexAttribs = sohoGeometry.globalValue('geo:vertexattribs')
-		for geoVertexAttrib in geoVertexAttribs:
-			if geoVertexAttrib == 'uv':
-				geoVertexUV = sohoGeometry.attribute('geo:vertex', 'uv')
-				for i in xrange(geoPrimCount):
-					for j in xrange(sohoGeometry.value(geoPrimVertexCount, i)[0]):
-						v = sohoGeometry.vertex(geoVertexUV, i, j)
-						file.write('vt %.10f %.10f\n' % (v[0], v[1]))
-				hasUV = True
-
-		# f
-		fakeUVIndex = 1;
-		geoVertexPointRef = sohoGeometry.attribute('geo:vertex', 'geo:pointref')
-
-		if hasUV:
-			for i in xrange(geoPrimCount):
-				file.write('f')
-				for j in reversed(xrange(sohoGeometry.value(geoPrimVertexCount, i)[0])):
-					v = sohoGeometry.vertex(geoVertexPointRef, i, j)
-					file.write(' %d/%d' % (v[0] + 1, fakeUVIndex))
-					fakeUVIndex += 1
-				file.write('\n')
+		if theSettings.attrs[Settings.GEOMETRY_FORMAT] == Settings.GEOMETRY_FORMAT_BINARYMESH:
+			self.SaveToBinaryMesh(name, mesh)
 		else:
-			for i in xrange(geoPrimCount):
-				file.write('f')
-				for j in reversed(xrange(sohoGeometry.value(geoPrimVertexCount, i)[0])):
-					v = sohoGeometry.vertex(geoVertexPointRef, i, j)
-					file.write(' %d' % (v[0] + 1))
-				file.write('\n')
+			self.SaveToWavefrontObj(name, mesh)
 
-		file.close()
 
-		return objFilePath
-
-	def Resolve(self, sohoObject, moments):
-		sopPath = sohoObject.getDefaultedString('object:soppath', sohoObject, [''])[0]
-		self.attrs[Object.NAME] = sopPath.replace('/', '__')
+##
+# Returns whether a pool of processes can be started from this one: the
+# processes are forks of it, which is only safe from a Python interpreter or
+# hython, not from a Houdini session.
+#
+def CanStartProcesses():
+	executableName = os.path.basename(sys.executable).lower()
+	return executableName.startswith('python') or executableName.startswith('hython')
 
-		self.attrs[Object.MODEL] = 'mesh_object'
+##
+# Writes the mesh files, in place or through a pool of processCount
+# processes. Meshes are extracted by the caller since sohog is only available
+# to the main process.
+#
+class GeometryWriter(object):
+
+	def __init__(self, processCount = 1):
+		self.pool = None
+		self.pending = []
+
+		self.fileCount = 0
+		self.bytesWritten = 0
+		self.compressedBytes = 0
+		self.seconds = 0.0
+
+		processCount = max(1, processCount)
+		if processCount > 1 and not CanStartProcesses():
+			soho.warning('Meshes are written by a single process from %s.' % os.path.basename(sys.executable))
+			processCount = 1
+		if processCount > 1:
+			self.pool = multiprocessing.Pool(processCount)
+
+		# Bounds the number of extracted meshes waiting for a process.
+		self.maxPending = 2 * processCount
+
+	def Write(self, writer, filePath, sopPath, mesh, cacheKey):
+		if self.pool is None:
+			theProfiler.Begin('mesh_writes')
+			self.Finish(cacheKey, appleseedgeo.WriteMesh(writer, filePath, sopPath, mesh))
+			theProfiler.End()
+			return
+
+		while len(self.pending) >= self.maxPending:
+			self.WaitOne()
+
+		result = self.pool.apply_async(appleseedgeo.WriteMesh, (writer, filePath, sopPath, mesh))
+		self.pending.append((filePath, cacheKey, result))
+
+	def WaitOne(self):
+		(filePath, cacheKey, result) = self.pending.pop(0)
+		theProfiler.Begin('mesh_writes')
+		try:
+			statistics = result.get()
+		except Exception, e:
+			theProfiler.End()
+			soho.error('Unable to write %s: %s' % (filePath, e))
+			return
+		theProfiler.End()
+
+		self.Finish(cacheKey, statistics)
+
+	def Finish(self, cacheKey, statistics):
+		(bytesWritten, compressedBytes, seconds) = statistics
+		self.fileCount += 1
+		self.bytesWritten += bytesWritten
+		self.compressedBytes += compressedBytes
+		self.seconds += seconds
+
+		if cacheKey is not None:
+			theGeometryCache.Insert(cacheKey)
+
+	def Statistics(self):
+		statistics = '%d files, %d bytes' % (self.fileCount, self.bytesWritten)
+		if self.compressedBytes != self.bytesWritten:
+			ratio = 0.0
+			if self.compressedBytes:
+				ratio = float(self.bytesWritten) / self.compressedBytes
+			statistics += ' compressed to %d bytes (%.2fx)' % (self.compressedBytes, ratio)
+		if self.seconds > 0.0:
+			statistics += ', %.1f MiB/s' % (self.bytesWritten / self.seconds / (1 << 20))
+		return statistics
+
+	def Close(self):
+		while self.pending:
+			self.WaitOne()
+
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+
+		if self.fileCount:
+			Log('geometry: %s' % self.Statistics())
 
-		sohoGeometry = sohog.SohoGeometry(sopPath, moments[0])
-		objFilePath = self.SaveToWavefrontObj(sopPath, sohoGeometry)
-		
 
 ##
 #
-class ObjectInstance(Assembly):
+class ObjectInstance(Node):
 	
 	##
 	# <object> used attributes.
@@ -706,14 +1383,16 @@ class ObjectInstance(Assembly):
 
 		self.assignMaterial = AssignMaterial()
 
-	def Resolve(self, sohoObject, moments):
-		sopPath = sohoObject.getDefaultedString('object:soppath', sohoObject, [''])[0]
-		name = sopPath
+	##
+	# Resolves an instance of the object objectName, matrix is its world
+	# transform.
+	#
+	def ResolveInstance(self, name, objectName, matrix):
 		self.attrs[ObjectInstance.NAME] = name
-		self.attrs[ObjectInstance.OBJECT] = name.replace('/', '__') + '.' + name.replace('/', '__')
+		# Objects loaded from a mesh file are named <object name>.<mesh name>.
+		self.attrs[ObjectInstance.OBJECT] = objectName + '.' + objectName
 
-		sohoObject.evalFloat('space:world', moments[0], self.transform.matrix.data)
-		self.transform.matrix.data = hou.Matrix4(self.transform.matrix.data).transposed().asTuple()
+		self.transform.matrix.data = hou.Matrix4(matrix).transposed().asTuple()
 
 
 ##
@@ -792,28 +1471,47 @@ class Camera(Node):
 		RESY     : soho.SohoParm(RESY,     'int',   [480],  False),
 	}
 
+	PARAMETERS = {
+		'pinhole_camera' : (
+			(FILM_DIMENSIONS, FILM_DIMENSIONS, FormatFloats),
+			(FOCAL_LENGTH,    FOCAL_LENGTH,    FormatFloats),
+		),
+	}
+
 	def __init__(self):
 		super(Camera, self).__init__()
 
 		self.transform = Transform()
 
 	def Resolve(self, sohoObject, moments):
-		self.attrs[Camera.NAME] = sohoObject.getName()
+		sohoParmsValues = sohoObject.evaluate(Camera.SUPPORTED_SOHO_PARAMS, moments[0])
 
-		self.attrs[Camera.MODEL] = 'pinhole_camera'
+		world = []
+		sohoObject.evalFloat('space:world', moments[0], world)
 
-		sohoParmsValues = sohoObject.evaluate(Camera.SUPPORTED_SOHO_PARAMS, moments[0])
+		self.ResolveValues(sohoObject.getName(), world, SohoParmValues(sohoParmsValues))
+
+	##
+	# Resolves the camera from its node rather than from soho, for the IPR
+	# session.
+	#
+	def ResolveNode(self, cameraNode):
+		self.ResolveValues(cameraNode.path(), cameraNode.worldTransform().asTuple(), EvalNodeParms(cameraNode, Camera.SUPPORTED_SOHO_PARAMS))
+
+	def ResolveValues(self, name, world, values):
+		self.attrs[Camera.NAME] = name
+
+		self.attrs[Camera.MODEL] = 'pinhole_camera'
 
-		resx = sohoParmsValues[Camera.RESX].Value[0]
-		resy = sohoParmsValues[Camera.RESY].Value[0]
+		resx = values[Camera.RESX][0]
+		resy = values[Camera.RESY][0]
 
-		aperture = sohoParmsValues[Camera.APERTURE].Value[0] / 1000.0
+		aperture = values[Camera.APERTURE][0] / 1000.0
 		self.attrs[Camera.FILM_DIMENSIONS] = Attr((aperture, float(resy) /  float(resx) * aperture))
 
-		self.attrs[Camera.FOCAL_LENGTH] = Attr(sohoParmsValues[Camera.FOCAL].Value[0] / 1000.0)
+		self.attrs[Camera.FOCAL_LENGTH] = Attr(values[Camera.FOCAL][0] / 1000.0)
 
-		sohoObject.evalFloat('space:world', moments[0], self.transform.matrix.data)
-		self.transform.matrix.data = hou.Matrix4(self.transform.matrix.data).transposed().asTuple()
+		self.transform.matrix.data = hou.Matrix4(world).transposed().asTuple()
 
 
 ##
@@ -842,20 +1540,23 @@ class Frame(Node):
 		TILE_SIZE   : soho.SohoParm(TILE_SIZE,   'int',    [32],           True),
 	}
 
+	COMMON_PARAMETERS = (
+		(CAMERA,     CAMERA,     FormatValue),
+		(RESOLUTION, RESOLUTION, FormatInts),
+	)
+
 	def __init__(self):
 		super(Frame, self).__init__()
 
 	def Resolve(self, sohoObject, moments):
 		(basicName, extensionName) = os.path.splitext(os.path.basename(hou.hipFile.name()))
-		frameNumber = int(moments[0] * 24 + 1)
+		frameNumber = FrameNumber(moments[0])
 		self.attrs[Frame.NAME] = '%s.%.4d' % (basicName, frameNumber)
 
 		sohoParmsValues = soho.sohoglue.evaluate(Frame.SUPPORTED_SOHO_PARAMS, None, None)
 		self.attrs[Frame.CAMERA] = sohoParmsValues[Frame.CAMERA].Value[0]
 		cameraHouNode = hou.node(sohoParmsValues[Frame.CAMERA].Value[0])
-		resx = cameraHouNode.evalParm('resx')
-		resy = cameraHouNode.evalParm('resy')
-		self.attrs[Frame.RESOLUTION] = (resx, resy)
+		self.attrs[Frame.RESOLUTION] = cameraHouNode.evalParmTuple('res')
 
 		if sohoParmsValues.has_key(Frame.TILE_SIZE):
 			self.attrs[Frame.TILE_SIZE] = sohoParmsValues[Frame.TILE_SIZE].Value[0]
@@ -906,544 +1607,849 @@ class Configurations(Node):
 
 
 ##
+# Export options of the ROP, they are not part of the appleseed project.
 #
-class XmlSerializer(object):
+class Settings(Node):
+
+	GEOMETRY_FORMAT              = 'geometry_format'
+	GEOMETRY_FORMAT_OBJ          = 'obj'
+	GEOMETRY_FORMAT_BINARYMESH   = 'binarymesh'
+
+	GEOMETRY_CACHE               = 'geometry_cache'
+	GEOMETRY_CACHE_DIR           = 'geometry_cache_dir'
+	GEOMETRY_CACHE_DIR_DEFAULT   = 'cache'
+	GEOMETRY_CACHE_SIZE          = 'geometry_cache_size'
+
+	GEOMETRY_COMPRESSION         = 'geometry_compression'
+	GEOMETRY_COMPRESSION_NONE    = 'none'
+	GEOMETRY_COMPRESSION_LEVEL   = 'geometry_compression_level'
+	GEOMETRY_COMPRESSION_THREADS = 'geometry_compression_threads'
+
+	UV_WELD_TOLERANCE            = 'uv_weld_tolerance'
+
+	# Decimals of the floats written as text, -1 for the fewest digits reading
+	# back as the same float. The transform precision applies to all the
+	# floats of the project file.
+	POSITION_PRECISION           = 'position_precision'
+	UV_PRECISION                 = 'uv_precision'
+	TRANSFORM_PRECISION          = 'transform_precision'
+
+	EXPORT_PROCESSES             = 'export_processes'
+
+	SEQUENCE                     = 'sequence'
+	SEQUENCE_START               = 'sequence_start'
+	SEQUENCE_END                 = 'sequence_end'
+	SEQUENCE_STEP                = 'sequence_step'
+
+	# Keeps sending the changes of the scene to the renderer listening at the
+	# address after the export, see appleseedipr.
+	IPR                          = 'ipr'
+	IPR_ADDRESS                  = 'ipr_address'
+	IPR_ADDRESS_DEFAULT          = 'localhost:%d' % appleseedipr.DEFAULT_PORT
+
+	# Renders the projects with appleseed.cli once exported, see
+	# appleseedfarm. The output defaults to the project with a png
+	# extension, the arguments are added to the command line. Frames render
+	# a few at once, as many as the workers or, if 0, as many renders of the
+	# job memory in MiB as the memory holds.
+	RENDER                       = 'render'
+	RENDER_CLI                   = 'render_cli'
+	RENDER_OUTPUT                = 'render_output'
+	RENDER_ARGUMENTS             = 'render_arguments'
+	RENDER_WORKERS               = 'render_workers'
+	RENDER_RETRIES               = 'render_retries'
+	RENDER_JOB_MEMORY            = 'render_job_memory'
+
+	# Splits a single frame into as many regions rendered at once, their
+	# images stitched into the output, see appleseedtiles.
+	RENDER_TILES                 = 'render_tiles'
+
+	# Reuses the image of a frame whose project, meshes and renderer did not
+	# change since it was rendered, from a cache of the size in MiB, in the
+	# companion directory by default.
+	RENDER_CACHE                 = 'render_cache'
+	RENDER_CACHE_DIR             = 'render_cache_dir'
+	RENDER_CACHE_DIR_DEFAULT     = 'renders'
+	RENDER_CACHE_SIZE            = 'render_cache_size'
+
+	# Seconds between the progress reports of a render followed without UI.
+	RENDER_STATUS_INTERVAL       = 10.0
+
+	# Writes the time, parameter evaluations, bytes written and peak memory
+	# of every phase of the export, and the time of every object, as JSON
+	# next to the project, see appleseedprofile. The summary goes to the log
+	# too if asked.
+	PROFILE                      = 'profile'
+	PROFILE_LOG                  = 'profile_log'
+	PROFILE_SUFFIX               = '.profile.json'
+
+	# Skips the objects and instances whose bounds are out of the view of the
+	# camera, widened by the padding, a fraction of the frame, or farther
+	# from the camera than the distance if not 0, see appleseedcull.
+	CULL                         = 'cull'
+	CULL_PADDING                 = 'cull_padding'
+	CULL_DISTANCE                = 'cull_distance'
+
+	# Patterns of the objects and lights exported among the displayed ones,
+	# as for soho.addObjects(). The objects and lights of the bundle are
+	# exported too, displayed or not, so that a layer could be exported from
+	# a bundle alone with an empty object pattern.
+	OBJECT_PATTERN               = 'object_pattern'
+	LIGHT_PATTERN                = 'light_pattern'
+	BUNDLE                       = 'bundle'
+
+	# Merges the colors, BSDFs, EDFs and surface shaders of equal contents,
+	# see appleseedshaders.Deduplicator.
+	DEDUPLICATE_SHADING          = 'deduplicate_shading'
+
+	# Exports the objects of each outermost subnet, or of each node group of
+	# /obj, to an assembly file of its own the project refers to, see
+	# ArchiveFile. The files are kept in the companion directory up to the
+	# size in MiB, the objects of no group stay in the project. A group is
+	# only resolved again once something it depends on changed.
+	ASSEMBLIES                   = 'assemblies'
+	ASSEMBLIES_SINGLE            = 'single'
+	ASSEMBLIES_SUBNETS           = 'subnets'
+	ASSEMBLIES_GROUPS            = 'groups'
+	ASSEMBLY_CACHE_DIR_DEFAULT   = 'assemblies'
+	ASSEMBLY_CACHE_SIZE          = 'assembly_cache_size'
+
+	SUPPORTED_SOHO_PARAMS = {
+		GEOMETRY_FORMAT              : soho.SohoParm(GEOMETRY_FORMAT,              'string', [GEOMETRY_FORMAT_OBJ],       False),
+		GEOMETRY_CACHE               : soho.SohoParm(GEOMETRY_CACHE,               'int',    [0],                         False),
+		GEOMETRY_CACHE_DIR           : soho.SohoParm(GEOMETRY_CACHE_DIR,           'string', [''],                        False),
+		GEOMETRY_CACHE_SIZE          : soho.SohoParm(GEOMETRY_CACHE_SIZE,          'int',    [4096],                      False),
+		GEOMETRY_COMPRESSION         : soho.SohoParm(GEOMETRY_COMPRESSION,         'string', [GEOMETRY_COMPRESSION_NONE], False),
+		GEOMETRY_COMPRESSION_LEVEL   : soho.SohoParm(GEOMETRY_COMPRESSION_LEVEL,   'int',    [6],                         False),
+		GEOMETRY_COMPRESSION_THREADS : soho.SohoParm(GEOMETRY_COMPRESSION_THREADS, 'int',    [1],                         False),
+		UV_WELD_TOLERANCE            : soho.SohoParm(UV_WELD_TOLERANCE,            'float',  [0.0],                       False),
+		POSITION_PRECISION           : soho.SohoParm(POSITION_PRECISION,           'int',    [10],                        False),
+		UV_PRECISION                 : soho.SohoParm(UV_PRECISION,                 'int',    [10],                        False),
+		TRANSFORM_PRECISION          : soho.SohoParm(TRANSFORM_PRECISION,          'int',    [6],                         False),
+		EXPORT_PROCESSES             : soho.SohoParm(EXPORT_PROCESSES,             'int',    [1],                         False),
+		SEQUENCE                     : soho.SohoParm(SEQUENCE,                     'int',    [0],                         False),
+		SEQUENCE_START               : soho.SohoParm(SEQUENCE_START,               'int',    [1],                         False),
+		SEQUENCE_END                 : soho.SohoParm(SEQUENCE_END,                 'int',    [1],                         False),
+		SEQUENCE_STEP                : soho.SohoParm(SEQUENCE_STEP,                'int',    [1],                         False),
+		IPR                          : soho.SohoParm(IPR,                          'int',    [0],                         False),
+		IPR_ADDRESS                  : soho.SohoParm(IPR_ADDRESS,                  'string', [IPR_ADDRESS_DEFAULT],       False),
+		RENDER                       : soho.SohoParm(RENDER,                       'int',    [0],                         False),
+		RENDER_CLI                   : soho.SohoParm(RENDER_CLI,                   'string', ['appleseed.cli'],           False),
+		RENDER_OUTPUT                : soho.SohoParm(RENDER_OUTPUT,                'string', [''],                        False),
+		RENDER_ARGUMENTS             : soho.SohoParm(RENDER_ARGUMENTS,             'string', [''],                        False),
+		RENDER_WORKERS               : soho.SohoParm(RENDER_WORKERS,               'int',    [0],                         False),
+		RENDER_RETRIES               : soho.SohoParm(RENDER_RETRIES,               'int',    [1],                         False),
+		RENDER_JOB_MEMORY            : soho.SohoParm(RENDER_JOB_MEMORY,            'int',    [4096],                      False),
+		RENDER_TILES                 : soho.SohoParm(RENDER_TILES,                 'int',    [1],                         False),
+		RENDER_CACHE                 : soho.SohoParm(RENDER_CACHE,                 'int',    [0],                         False),
+		RENDER_CACHE_DIR             : soho.SohoParm(RENDER_CACHE_DIR,             'string', [''],                        False),
+		RENDER_CACHE_SIZE            : soho.SohoParm(RENDER_CACHE_SIZE,            'int',    [4096],                      False),
+		PROFILE                      : soho.SohoParm(PROFILE,                      'int',    [0],                         False),
+		PROFILE_LOG                  : soho.SohoParm(PROFILE_LOG,                  'int',    [0],                         False),
+		CULL                         : soho.SohoParm(CULL,                         'int',    [0],                         False),
+		CULL_PADDING                 : soho.SohoParm(CULL_PADDING,                 'float',  [0.1],                       False),
+		CULL_DISTANCE                : soho.SohoParm(CULL_DISTANCE,                'float',  [0.0],                       False),
+		OBJECT_PATTERN               : soho.SohoParm(OBJECT_PATTERN,               'string', ['*'],                       False),
+		LIGHT_PATTERN                : soho.SohoParm(LIGHT_PATTERN,                'string', ['*'],                       False),
+		BUNDLE                       : soho.SohoParm(BUNDLE,                       'string', [''],                        False),
+		DEDUPLICATE_SHADING          : soho.SohoParm(DEDUPLICATE_SHADING,          'int',    [1],                         False),
+		ASSEMBLIES                   : soho.SohoParm(ASSEMBLIES,                   'string', [ASSEMBLIES_SINGLE],         False),
+		ASSEMBLY_CACHE_SIZE          : soho.SohoParm(ASSEMBLY_CACHE_SIZE,          'int',    [1024],                      False),
+	}
 
 	def __init__(self):
-		pass
+		super(Settings, self).__init__()
 
-	def Serialize(self, project):
-		projectNode = Element('project')
-		sceneNode = SubElement(projectNode, 'scene')
+		for (key, parm) in Settings.SUPPORTED_SOHO_PARAMS.iteritems():
+			self.attrs[key] = parm.Value[0]
 
-		## Serialize project:scene:camera.
-		#
-		camera = project.scene.camera
+	def Resolve(self, sohoObject, moments):
+		sohoParmsValues = soho.sohoglue.evaluate(Settings.SUPPORTED_SOHO_PARAMS, None, None)
+		for (key, value) in sohoParmsValues.iteritems():
+			self.attrs[key] = value.Value[0]
 
-		cameraNode = SubElement(sceneNode, 'camera')
+		if self.attrs[Settings.GEOMETRY_COMPRESSION] == appleseedgeo.ZSTD and appleseedgeo.zstandard is None:
+			Log('zstandard is not available, geometry is compressed with gzip')
+			self.attrs[Settings.GEOMETRY_COMPRESSION] = appleseedgeo.GZIP
 
-		cameraNode.attrib[Camera.NAME]  = camera.attrs[Camera.NAME]
-		cameraNode.attrib[Camera.MODEL] = camera.attrs[Camera.MODEL]
+	##
+	# Returns how the mesh files are compressed, see appleseedgeo.MeshWriter.
+	#
+	def Compression(self):
+		codec = self.attrs[Settings.GEOMETRY_COMPRESSION]
+		if codec == Settings.GEOMETRY_COMPRESSION_NONE:
+			return None
 
-		parameterNode = SubElement(cameraNode, 'parameter')
-		parameterNode.attrib[Attr.NAME]  = Camera.FILM_DIMENSIONS
-		parameterNode.attrib[Attr.VALUE] = '%f %f' % (camera.attrs[Camera.FILM_DIMENSIONS].value[0])
+		threads = self.attrs[Settings.GEOMETRY_COMPRESSION_THREADS]
+		if threads <= 0:
+			threads = multiprocessing.cpu_count()
 
-		parameterNode = SubElement(cameraNode, 'parameter')
-		parameterNode.attrib[Attr.NAME]  = Camera.FOCAL_LENGTH
-		parameterNode.attrib[Attr.VALUE]    = '%f' % (camera.attrs[Camera.FOCAL_LENGTH].value[0])
+		return (codec, self.attrs[Settings.GEOMETRY_COMPRESSION_LEVEL], threads)
 
-		transformNode = SubElement(cameraNode, 'transform')
-		matrixNode = SubElement(transformNode, 'matrix')
-		matrixNode.text = ''
-		for i in xrange(16):
-			matrixNode.text += '%f ' % camera.transform.matrix.data[i]
+	##
+	# Returns the frame numbers to export in sequence mode.
+	#
+	def SequenceFrames(self):
+		step = max(self.attrs[Settings.SEQUENCE_STEP], 1)
+		return range(self.attrs[Settings.SEQUENCE_START], self.attrs[Settings.SEQUENCE_END] + 1, step)
 
-		## Serialize project:scene:assembly
-		#
-		assemblyNode = SubElement(sceneNode, 'assembly')
-		assemblyNode.attrib[Assembly.NAME] = 'assembly'
 
-		## Serialize project:scene:assembly:light
-		#
-		for (lightName, light) in project.scene.assembly.lights.iteritems():
-			lightNode = SubElement(assemblyNode, 'light')
+##
+# Entities of the exported project the IPR session resolves again from their
+# nodes once these change, see appleseedipr.IprSession.
+#
+# The world transform and the material of an object node apply to all the
+# instances resolved from it, point and packed instances included, so these
+# are moved by the change of the transform rather than resolved again.
+# Editing the geometry still needs a new export.
+#
+class IprScene(object):
 
-			lightNode.attrib[Light.NAME] = light.attrs[Light.NAME]
+	LIGHT     = 'light'
+	CAMERA    = 'camera'
+	INSTANCER = 'instancer'
+	SHADING   = 'shading'
 
-			lightNode.attrib[Light.MODEL] = light.attrs[Light.MODEL]
+	##
+	# Tag and writer of the entities sent, by assembly table.
+	ENTITIES = {
+		'camera'          : ('camera',          'WriteCamera'),
+		'colors'          : ('color',           'WriteColor'),
+		'bsdfs'           : ('bsdf',            'WriteBSDF'),
+		'edfs'            : ('edf',             'WriteEDF'),
+		'surfaceShaders'  : ('surface_shader',  'WriteSurfaceShader'),
+		'materials'       : ('material',        'WriteMaterial'),
+		'lights'          : ('light',           'WriteLight'),
+		'objectInstances' : ('object_instance', 'WriteObjectInstance'),
+	}
 
-			parameterNode = SubElement(lightNode, 'parameter')
-			parameterNode.attrib[Attr.NAME] = Light.EXITANCE
-			parameterNode.attrib[Attr.VALUE] = light.exitance.attrs[Color.NAME]
+	SHADING_TABLES = tuple([tableName for (tableName, writerName) in appleseedshaders.TABLES])
 
-			if light.attrs[Light.MODEL] == Light.SPOT_LIGHT:
-				parameterNode = SubElement(lightNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = Light.INNER_ANGLE
-				parameterNode.attrib[Attr.VALUE] = str(light.attrs[Light.INNER_ANGLE].value[0])
+	MATERIAL_PATH = 'shop_materialpath'
 
-				parameterNode = SubElement(lightNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = Light.OUTER_ANGLE
-				parameterNode.attrib[Attr.VALUE] = str(light.attrs[Light.OUTER_ANGLE].value[0])
+	def __init__(self):
+		self.camera = None
+		self.lights = {}
 
-			transformNode = SubElement(lightNode, 'transform')
-			matrixNode = SubElement(transformNode, 'matrix')
-			matrixNode.text = ''
-			for i in xrange(16):
-				matrixNode.text += '%f ' % light.transform.matrix.data[i]
+		# Per object node, its world transform, its material and the object
+		# instances resolved from it.
+		self.instancers = {}
 
-		## Serialize project:scene:assembly:material
-		#
-		for (materialName, material) in project.scene.assembly.materials.iteritems():
-			materialNode = SubElement(assemblyNode, 'material')
+		# Names of the shading entities sent to the renderer, by table.
+		self.shading = {}
 
-			materialNode.attrib[Material.NAME] = material.attrs[Material.NAME]
+	def TrackCamera(self, camera):
+		self.camera = camera
 
-			materialNode.attrib[Material.MODEL] = material.attrs[Material.MODEL]
+	def TrackLight(self, light):
+		self.lights[light.attrs[Light.NAME]] = light
 
-			if material.attrs.has_key(Material.BSDF):
-				parameterNode = parameterNode = SubElement(materialNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = Material.BSDF
-				parameterNode.attrib[Attr.VALUE] = material.attrs[Material.BSDF]
+	##
+	# Records the object instances just resolved from the object node at path.
+	#
+	def TrackInstancer(self, path, project):
+		objectInstances = project.scene.assembly.objectInstances
+		instances = [objectInstances[name] for name in objectInstances.unflushed]
 
-			if material.attrs.has_key(Material.EDF):
-				parameterNode = parameterNode = SubElement(materialNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = Material.EDF
-				parameterNode.attrib[Attr.VALUE] = material.attrs[Material.EDF]
+		node = hou.node(path)
+		self.instancers[path] = (node.worldTransform().asTuple(), node.evalParm(IprScene.MATERIAL_PATH), instances)
 
-			parameterNode = SubElement(materialNode, 'parameter')
-			parameterNode.attrib[Attr.NAME] = Material.SURFACE_SHADER
-			parameterNode.attrib[Attr.VALUE] = material.attrs[Material.SURFACE_SHADER]
+	def TrackShading(self, project):
+		assembly = project.scene.assembly
+		for tableName in IprScene.SHADING_TABLES:
+			self.shading[tableName] = set(getattr(assembly, tableName).keys())
 
-		## Serialize project:scene:assembly:bsdf
-		#
-		for (bsdfName, bsdf) in project.scene.assembly.bsdfs.iteritems():
-			bsdfNode = SubElement(assemblyNode, 'bsdf')
+	##
+	# Returns the nodes to watch as (kind, path).
+	#
+	def Nodes(self):
+		nodes = []
+		if self.camera is not None:
+			nodes.append((IprScene.CAMERA, self.camera.attrs[Camera.NAME]))
+		nodes.extend([(IprScene.LIGHT, path) for path in sorted(self.lights.keys())])
+		nodes.extend([(IprScene.INSTANCER, path) for path in sorted(self.instancers.keys())])
 
-			bsdfNode.attrib[BSDF.NAME] = bsdf.attrs[BSDF.NAME]
-			bsdfNode.attrib[BSDF.MODEL] = bsdf.attrs[BSDF.MODEL]
+		# Light colors are named after no node, they are not found.
+		for tableName in IprScene.SHADING_TABLES:
+			nodes.extend([(IprScene.SHADING, path) for path in sorted(self.shading.get(tableName, ()))])
 
-			model = bsdf.attrs[BSDF.MODEL]
-			if model == BSDF.ASHIKHMIN_BRDF:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.ASHIKHMIN_DIFFUSE_REFLECTANCE[10:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.ASHIKHMIN_DIFFUSE_REFLECTANCE]
-	
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.ASHIKHMIN_GLOSSY_REFLECTANCE[10:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.ASHIKHMIN_GLOSSY_REFLECTANCE]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.ASHIKHMIN_SHININESS_U[10:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.ASHIKHMIN_SHININESS_U].value[0])
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.ASHIKHMIN_SHININESS_V[10:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.ASHIKHMIN_SHININESS_V].value[0])
-			elif model == BSDF.BSDF_MIX:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.BSDF_MIX_BSDF0[9:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.BSDF_MIX_BSDF0]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.BSDF_MIX_WEIGHT0[9:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.BSDF_MIX_WEIGHT0].value[0])
-				
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.BSDF_MIX_BSDF1[9:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.BSDF_MIX_BSDF1]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.BSDF_MIX_WEIGHT1[9:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.BSDF_MIX_WEIGHT1].value[0])
-			elif model == BSDF.KELEMEN_BRDF:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.KELEMEN_MATTE_REFLECTANCE[8:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.KELEMEN_MATTE_REFLECTANCE]
-				
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.KELEMEN_SPECULAR_REFLECTANCE[8:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.KELEMEN_SPECULAR_REFLECTANCE]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.KELEMEN_ROUGHNESS[8:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.KELEMEN_ROUGHNESS].value[0])
-			elif model == BSDF.LAMBERTIAN_BRDF:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.LAMBERTIAN_REFLECTANCE[11:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.LAMBERTIAN_REFLECTANCE]
-			elif model == BSDF.SPECULAR_BRDF:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.SPECULAR_BRDF_REFLECTANCE[14:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.SPECULAR_BRDF_REFLECTANCE]
-			elif model == BSDF.SPECULAR_BTDF:
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.SPECULAR_BTDF_REFLECTANCE[14:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.SPECULAR_BTDF_REFLECTANCE]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.SPECULAR_BTDF_TRANSMITTANCE[14:]
-				parameterNode.attrib[Attr.VALUE] = bsdf.attrs[BSDF.SPECULAR_BTDF_TRANSMITTANCE]
-
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.SPECULAR_BTDF_FROM_IOR[14:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.SPECULAR_BTDF_FROM_IOR])
-				
-				parameterNode = SubElement(bsdfNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = BSDF.SPECULAR_BTDF_TO_IOR[14:]
-				parameterNode.attrib[Attr.VALUE] = str(bsdf.attrs[BSDF.SPECULAR_BTDF_TO_IOR])
-
-		## Serialize project:scene:edf
-		for (edfName, edf) in project.scene.assembly.edfs.iteritems():
-			edfNode = SubElement(assemblyNode, 'edf')
-
-			edfNode.attrib[EDF.NAME] = edf.attrs[EDF.NAME]
-			edfNode.attrib[SurfaceShader.MODEL] = edf.attrs[EDF.MODEL]
-
-			parameterNode = SubElement(edfNode, 'parameter')
-			parameterNode.attrib[Attr.NAME] = EDF.EXITANCE
-			parameterNode.attrib[Attr.VALUE] = edf.attrs[EDF.EXITANCE]
-
-		## Serialize project:scene:assembly:color
-		#
-		for (colorName, color) in project.scene.assembly.colors.iteritems():
-			colorNode = SubElement(assemblyNode, 'color')
+		return nodes
 
-			colorNode.attrib[Color.NAME] = color.attrs[Color.NAME]
-			
-			parameterNode = SubElement(colorNode, 'parameter')
-			parameterNode.attrib[Attr.NAME] = Color.COLOR_SPACE
-			parameterNode.attrib[Attr.VALUE] = color.attrs[Color.COLOR_SPACE]
-
-			if color.attrs.has_key(Color.MULTIPLIER):
-				parameterNode = SubElement(colorNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = Color.MULTIPLIER
-				parameterNode.attrib[Attr.VALUE] = str(color.attrs[Color.MULTIPLIER].value[0])
-
-			valueNode = SubElement(colorNode, Color.VALUES)
-			if color.attrs[Color.COLOR_SPACE] != 'spectral':
-				valueNode.text = '%f %f %f' % tuple(color.attrs[Color.VALUES].value[0])
-			else:
-				valueNode.text = color.attrs[Color.VALUES].value
-
-			if color.attrs.has_key(Color.ALPHA):
-				alphaNode = SubElement(colorNode, Color.ALPHA)
-				alphaNode.text = str(color.attrs[Color.ALPHA].value[0])
-
-		## Serialize project:scene:assembly:surface_shader
-		#
-		for (surfaceShaderName, surfaceShader) in project.scene.assembly.surfaceShaders.iteritems():
-			surfaceShaderNode = SubElement(assemblyNode, 'surface_shader')
-
-			surfaceShaderNode.attrib[SurfaceShader.NAME] = surfaceShader.attrs[SurfaceShader.NAME]
-
-			model = surfaceShader.attrs[SurfaceShader.MODEL]
-			surfaceShaderNode.attrib[SurfaceShader.MODEL] = model
-			if model == SurfaceShader.AO_SURFACE_SHADER:
-				if surfaceShader.attrs.has_key(SurfaceShader.AO_SAMPLING_METHOD):
-					parameterNode = SubElement(surfaceShaderNode, 'parameter')
-					parameterNode.attrib[Attr.NAME] = SurfaceShader.AO_SAMPLING_METHOD[3:]
-					parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.AO_SAMPLING_METHOD]
-				if surfaceShader.attrs.has_key(SurfaceShader.AO_SAMPLES):
-					parameterNode = SubElement(surfaceShaderNode, 'parameter')
-					parameterNode.attrib[Attr.NAME] = SurfaceShader.AO_SAMPLES[3:]
-					parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.AO_SAMPLES].value[0])
-				if surfaceShader.attrs.has_key(SurfaceShader.AO_MAX_DISTANCE):
-					parameterNode = SubElement(surfaceShaderNode, 'parameter')
-					parameterNode.attrib[Attr.NAME] = SurfaceShader.AO_MAX_DISTANCE[3:]
-					parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.AO_MAX_DISTANCE].value[0])
-			
-			elif model == SurfaceShader.CONSTANT_SURFACE_SHADER:
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.CONSTANT_COLOR[9:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.CONSTANT_COLOR].value[0]
-
-			elif model == SurfaceShader.DIAGNOSTIC_SURFACE_SHADER:
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.DIAGNOSTIC_MODE[11:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.DIAGNOSTIC_MODE].value[0]
-				if surfaceShader.attrs[SurfaceShader.DIAGNOSTIC_MODE].value == SurfaceShader.DIAGNOSTIC_AO:
-					if surfaceShader.attrs.has_key(SurfaceShader.DIAGNOSTIC_AO_SAMPLES):
-						parameterNode = SubElement(surfaceShaderNode, 'parameter')
-						parameterNode.attrib[Attr.NAME] = 'ambient_occlusion.samples'
-						parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.DIAGNOSTIC_AO_SAMPLES].value[0])
-					if surfaceShader.attrs.has_key(SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE):
-						parameterNode = SubElement(surfaceShaderNode, 'parameter')
-						parameterNode.attrib[Attr.NAME] = 'ambient_occlusion.max_distance'
-						parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE].value[0])
-			
-			elif model == SurfaceShader.FAST_SSS_SURFACE_SHADER:
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_SCALE[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_SCALE].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_AMBIENT_SSS[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_AMBIENT_SSS].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_VIEW_DEP_SSS[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_VIEW_DEP_SSS].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_DIFFUSE[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_DIFFUSE].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_POWER[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_POWER].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_DISTORTION[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_DISTORTION].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_ALBEDO[9:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.FAST_SSS_ALBEDO]
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_LIGHT_SAMPLES[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_LIGHT_SAMPLES].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.FAST_SSS_OCCLUSION_SAMPLES[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.FAST_SSS_OCCLUSION_SAMPLES].value[0])
-
-			elif model == SurfaceShader.PHYSICAL_SURFACE_SHADER:
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_COLOR_MULTIPLIER[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_COLOR_MULTIPLIER].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_ALPHA_MULTIPLIER].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE[9:]
-				aerialPerspMode = surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE]
-				if aerialPerspMode != SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_NONE:
-					if aerialPerspMode == SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR:
-						parameterNode.attrib[Attr.VALUE] = aerialPerspMode
-					
-						parameterNode = SubElement(surfaceShaderNode, 'parameter')
-						parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_AERIAL_PERSP_SKY_COLOR[9:]
-						parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_SKY_COLOR].value[0])
-				else:
-					parameterNode.attrib[Attr.VALUE] = SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_NONE
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_AERIAL_PERSP_DISTANCE[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_DISTANCE].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.PHYSICAL_AERIAL_PERSP_INTENSITY[9:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_INTENSITY].value[0])
-
-			elif model == SurfaceShader.SMOKE_SURFACE_SHADER:
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_BOUNDING_BOX[6:]
-				parameterNode.attrib[Attr.VALUE] = '%f %f %f %f %f %f' % (surfaceShader.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MIN].value[0]) % (surfaceShader.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MAX].value[0])
-				
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_SHADING_MODE[6:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.SMOKE_SHADING_MODE].value[0]
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_INTERPOLATION_MODE[6:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.SMOKE_INTERPOLATION_MODE].value[0]
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_ISOSURFACE_THRESHOLD[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_ISOSURFACE_THRESHOLD].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_FILENAME[6:]
-				parameterNode.attrib[Attr.VALUE] = surfaceShader.attrs[SurfaceShader.SMOKE_FILENAME].value[0]
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_STEP_SIZE[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_STEP_SIZE].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_DENSITY_CUTOFF[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_DENSITY_CUTOFF].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_DENSITY_SCALE[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_DENSITY_SCALE].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_SMOKE_COLOR[6:]
-				parameterNode.attrib[Attr.VALUE] = '%f %f %f' % tuple(surfaceShader.attrs[SurfaceShader.SMOKE_SMOKE_COLOR].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_FUEL_COLOR[6:]
-				parameterNode.attrib[Attr.VALUE] = '%f %f %f' % tuple(surfaceShader.attrs[SurfaceShader.SMOKE_FUEL_COLOR].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_FUEL_SCALE[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_FUEL_SCALE].value)
-				
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_LIGHT_DIRECTION[6:]
-				parameterNode.attrib[Attr.VALUE] = '%f %f %f' % tuple(surfaceShader.attrs[SurfaceShader.SMOKE_LIGHT_DIRECTION].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_LIGHT_COLOR[6:]
-				parameterNode.attrib[Attr.VALUE] = '%f %f %f' % tuple(surfaceShader.attrs[SurfaceShader.SMOKE_LIGHT_COLOR].value[0])
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_COLOR_SCALE[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_COLOR_SCALE].value)
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_VOLUME_OPACITY[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_VOLUME_OPACITY].value)
-
-				parameterNode = SubElement(surfaceShaderNode, 'parameter')
-				parameterNode.attrib[Attr.NAME] = SurfaceShader.SMOKE_SHADOW_OPACITY[6:]
-				parameterNode.attrib[Attr.VALUE] = str(surfaceShader.attrs[SurfaceShader.SMOKE_SHADOW_OPACITY].value)
-
-		## Serialize project:scene:assembly:object and project:scene:assembly:object_instance
-		#
-		for (objectName, object) in project.scene.assembly.objects.iteritems():
-			objectNode = SubElement(assemblyNode, 'object')
+	##
+	# Returns the entities changed by the node at path as (tag, name, xml).
+	#
+	def Update(self, kind, path):
+		if hou.node(path) is None:
+			return []
+
+		if kind == IprScene.CAMERA:
+			entities = self.UpdateCamera(path)
+		elif kind == IprScene.LIGHT:
+			entities = self.UpdateLight(path)
+		elif kind == IprScene.INSTANCER:
+			entities = self.UpdateInstancer(path)
+		else:
+			entities = self.UpdateShading(path)
+
+		return self.Serialize(entities)
+
+	def UpdateCamera(self, path):
+		camera = Camera()
+		camera.ResolveNode(hou.node(path))
+		self.camera = camera
+		return [('camera', camera)]
+
+	def UpdateLight(self, path):
+		light = Light()
+		light.ResolveNode(hou.node(path))
+
+		self.lights[path] = light
+		return [('colors', light.exitance), ('lights', light)]
+
+	def UpdateInstancer(self, path):
+		node = hou.node(path)
+		(world, materialNodeName, instances) = self.instancers[path]
+
+		newWorld = node.worldTransform()
+		newMaterialNodeName = node.evalParm(IprScene.MATERIAL_PATH)
+		if newWorld.asTuple() == tuple(world) and newMaterialNodeName == materialNodeName:
+			return []
+
+		entities = []
+		if newMaterialNodeName != materialNodeName:
+			entities.extend(self.ResolveMaterials([newMaterialNodeName], ()))
+
+		# Instance matrices are the world transform of the node applied last,
+		# the change moves them all.
+		change = hou.Matrix4(world).inverted() * newWorld
+		for objectInstance in instances:
+			matrix = hou.Matrix4(objectInstance.transform.matrix.data).transposed() * change
+			objectInstance.transform.matrix.data = matrix.transposed().asTuple()
+
+			assignMaterial = objectInstance.assignMaterial
+			if assignMaterial.attrs[AssignMaterial.MATERIAL] == materialNodeName:
+				assignMaterial.attrs[AssignMaterial.MATERIAL] = newMaterialNodeName
+
+			entities.append(('objectInstances', objectInstance))
+
+		self.instancers[path] = (newWorld.asTuple(), newMaterialNodeName, instances)
+		return entities
+
+	##
+	# Resolves the shading node at path again with the materials depending on
+	# it, which bring in the nodes it now refers to.
+	#
+	def UpdateShading(self, path):
+		shadingGraph = appleseedshading.TheGraph()
+		shadingGraph.MarkDirty(path)
+
+		materials = self.shading.get('materials', set())
+		materialNodeNames = [name for name in shadingGraph.Dependents(path) | set([path]) if name in materials]
+		return self.ResolveMaterials(sorted(materialNodeNames), (path,))
+
+	##
+	# Returns the shading entities of materialNodeNames named in changed or
+	# not yet sent.
+	#
+	def ResolveMaterials(self, materialNodeNames, changed):
+		project = Project()
+		moments = [hou.time()]
+		for materialNodeName in materialNodeNames:
+			ProcessMaterial(materialNodeName, project, moments)
+
+		entities = []
+		for tableName in IprScene.SHADING_TABLES:
+			table = getattr(project.scene.assembly, tableName)
+			sent = self.shading.setdefault(tableName, set())
+			for name in table.TakeUnflushed():
+				if name in changed or name not in sent:
+					entities.append((tableName, table[name]))
+					sent.add(name)
+
+		return entities
+
+	##
+	# Forgets the nodes deleted, returns the entities to remove as (tag, name).
+	#
+	def Remove(self, nodes):
+		removed = []
+		for (kind, path) in nodes:
+			if kind == IprScene.LIGHT and self.lights.has_key(path):
+				light = self.lights.pop(path)
+				removed.append(('light', light.attrs[Light.NAME]))
+			elif kind == IprScene.INSTANCER and self.instancers.has_key(path):
+				(world, materialNodeName, instances) = self.instancers.pop(path)
+				removed.extend([('object_instance', objectInstance.attrs[ObjectInstance.NAME]) for objectInstance in instances])
+		return removed
+
+	def Serialize(self, entities):
+		serialized = []
+		for (tableName, entity) in entities:
+			(tag, writerName) = IprScene.ENTITIES[tableName]
+			stream = cStringIO.StringIO()
+			getattr(XmlSerializer(stream), writerName)(entity)
+			serialized.append((tag, entity.attrs['name'], stream.getvalue()))
+		return serialized
+
+
+##
+# Writes the project as XML while it is being resolved.
+#
+# Begin() writes everything up to the assembly, Flush() writes the entities
+# added to the assembly since the last call and drops them, End() closes the
+# assembly, refers to the assembly files and writes the rest of the project.
+# An assembly file is written the same way between BeginArchive() and
+# EndArchive().
+#
+class XmlSerializer(appleseedshaders.XmlWriter):
+
+	##
+	# Assembly entity tables and their writers, in the order they are written.
+	ASSEMBLY_ENTITIES = appleseedshaders.TABLES + (
+		('lights',          'WriteLight'),
+		('objects',         'WriteObject'),
+		('objectInstances', 'WriteObjectInstance'),
+	)
+
+	##
+	# Assembly entity tables merged or referring to merged entities.
+	DEDUPLICATED_ENTITIES = [tableName for (tableName, writerName) in appleseedshaders.TABLES] + ['lights']
 
-			objectNode.attrib[Object.NAME] = object.attrs[Object.NAME]
+	def __init__(self, stream = None, deduplicator = None):
+		if stream is None:
+			stream = sys.stdout
 
-			objectNode.attrib[Object.MODEL] = object.attrs[Object.MODEL]
+		super(XmlSerializer, self).__init__(stream)
 
-			parameterNode = SubElement(objectNode, 'parameter')
-			parameterNode.attrib[Attr.NAME]  = Object.FILENAME
-			parameterNode.attrib[Attr.VALUE] = object.attrs[Object.FILENAME]
+		# Shading entities left out as nothing exported refers to them.
+		self.pruned = 0
 
-		## Serialize project:scene:assembly:object_instance
+		# Merges the shading entities of equal contents if any, see
+		# appleseedshaders.Deduplicator.
+		self.deduplicator = deduplicator
+
+	##
+	# Entities.
+	#
+	def WriteCamera(self, camera):
+		self.WriteEntity('camera', camera, camera.transform)
+
+	def WriteLight(self, light):
+		self.WriteEntity('light', light, light.transform)
+
+	def WriteObject(self, object):
+		self.WriteEntity('object', object)
+
+	def WriteObjectInstance(self, objectInstance):
+		self.Open('object_instance', ((ObjectInstance.NAME, objectInstance.attrs[ObjectInstance.NAME]), (ObjectInstance.OBJECT, objectInstance.attrs[ObjectInstance.OBJECT])))
+
+		self.WriteTransform(objectInstance.transform)
+
+		# We assign both front and back with the material.
+		slot = str(objectInstance.assignMaterial.attrs[AssignMaterial.SLOT])
+		material = objectInstance.assignMaterial.attrs[AssignMaterial.MATERIAL]
+		for side in ('front', 'back'):
+			self.Empty('assign_material', ((AssignMaterial.SLOT, slot), (AssignMaterial.SIDE, side), (AssignMaterial.MATERIAL, material)))
+
+		self.Close('object_instance')
+
+	def WriteAssemblyInstance(self, assemblyInstance):
+		self.Open('assembly_instance', ((AssemblyInstance.NAME, assemblyInstance.attrs[AssemblyInstance.NAME]), (AssemblyInstance.ASSEMBLY, assemblyInstance.attrs[AssemblyInstance.ASSEMBLY])))
+		self.WriteTransform(assemblyInstance.transform)
+		self.Close('assembly_instance')
+
+	##
+	# Project.
+	#
+	def Begin(self, project):
+		self.stream.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+		self.Open('project')
+		self.Open('scene')
+
+		## Serialize project:scene:camera.
 		#
-		for (objectInstanceName, objectInstance) in project.scene.assembly.objectInstances.iteritems():
-			objectInstanceNode = SubElement(assemblyNode, 'object_instance')
-
-			objectInstanceNode.attrib[ObjectInstance.NAME]   = objectInstance.attrs[ObjectInstance.NAME]
-			objectInstanceNode.attrib[ObjectInstance.OBJECT] = objectInstance.attrs[ObjectInstance.OBJECT]
-
-			transformNode = SubElement(objectInstanceNode, 'transform')
-			matrixNode = SubElement(transformNode, 'matrix')
-			matrixNode.text = ''
-			for i in xrange(16):
-				matrixNode.text += '%f ' % objectInstance.transform.matrix.data[i]
-
-			# We assign both front and back with the material.
-			assignMaterialNode = SubElement(objectInstanceNode, 'assign_material')
-			assignMaterialNode.attrib[AssignMaterial.SLOT] = str(objectInstance.assignMaterial.attrs[AssignMaterial.SLOT])
-			assignMaterialNode.attrib[AssignMaterial.SIDE] = 'front'
-			assignMaterialNode.attrib[AssignMaterial.MATERIAL] = objectInstance.assignMaterial.attrs[AssignMaterial.MATERIAL]
-
-			assignMaterialNode = SubElement(objectInstanceNode, 'assign_material')
-			assignMaterialNode.attrib[AssignMaterial.SLOT] = str(objectInstance.assignMaterial.attrs[AssignMaterial.SLOT])
-			assignMaterialNode.attrib[AssignMaterial.SIDE] = 'back'
-			assignMaterialNode.attrib[AssignMaterial.MATERIAL] = objectInstance.assignMaterial.attrs[AssignMaterial.MATERIAL]
-			
+		self.WriteCamera(project.scene.camera)
+
+		## Serialize project:scene:assembly
+		#
+		self.Open('assembly', ((Assembly.NAME, project.scene.assemblyInstance.attrs[AssemblyInstance.ASSEMBLY]),))
+
+	def Flush(self, project):
+		assembly = project.scene.assembly
+		self.pruned += appleseedshaders.PruneUnreferenced(assembly, [assembly.lights[name] for name in assembly.lights.unflushed])
+
+		for (tableName, writerName) in XmlSerializer.ASSEMBLY_ENTITIES:
+			table = getattr(assembly, tableName)
+			write = getattr(self, writerName)
+			for name in table.TakeUnflushed():
+				entity = table[name]
+				if self.deduplicator is not None and tableName in XmlSerializer.DEDUPLICATED_ENTITIES:
+					entity = self.deduplicator.Resolve(assembly, entity)
+				if entity is not None:
+					write(entity)
+				table.Drop(name)
+
+	def EndAssembly(self, project):
+		self.Flush(project)
+		self.Close('assembly')
 
 		## Serialize project:scene:assembly_instance
 		#
-		assemblyInstanceNode = SubElement(sceneNode, 'assembly_instance')
-		assemblyInstanceNode.attrib[AssemblyInstance.NAME]     = project.scene.assemblyInstance.attrs[AssemblyInstance.NAME]
-		assemblyInstanceNode.attrib[AssemblyInstance.ASSEMBLY] = project.scene.assemblyInstance.attrs[AssemblyInstance.ASSEMBLY]
-		transformNode = SubElement(assemblyInstanceNode, 'transform')
-		matrixNode = SubElement(transformNode, 'matrix')
-		matrixNode.text = ''
-		for i in xrange(16):
-			matrixNode.text += '%f ' % project.scene.assemblyInstance.transform.matrix.data[i]
+		self.WriteAssemblyInstance(project.scene.assemblyInstance)
 
-		## Serialize project:output
+	def End(self, project):
+		self.EndAssembly(project)
+
+		## Serialize the assemblies read from assembly files.
 		#
-		outputNode = SubElement(projectNode, 'output')
-		for (frameName, frame) in project.output.frames.iteritems():
-			frameNode = SubElement(outputNode, 'frame')
-			frameNode.attrib[Frame.NAME] = frame.attrs[Frame.NAME]
+		for (archiveAssembly, assemblyInstance) in project.scene.archiveAssemblies:
+			self.WriteEntity('assembly', archiveAssembly)
+			self.WriteAssemblyInstance(assemblyInstance)
 
-			parameterNode = SubElement(frameNode, 'parameter')
-			parameterNode.attrib[Attr.NAME] = Frame.CAMERA
-			parameterNode.attrib[Attr.VALUE] = frame.attrs[Frame.CAMERA]
+		self.Close('scene')
 
-			parameterNode = SubElement(frameNode, 'parameter')
-			parameterNode.attrib[Attr.NAME]  = Frame.RESOLUTION
-			parameterNode.attrib[Attr.VALUE] = '%d %d' % frame.attrs[Frame.RESOLUTION]
+		## Serialize project:output
+		#
+		self.Open('output')
+		for frameName in sorted(project.output.frames.keys()):
+			self.WriteEntity('frame', project.output.frames[frameName])
+		self.Close('output')
 
 		## Serialize project:configurations
 		#
-		configurationsNode = SubElement(projectNode, 'configurations')
-
-		bfConfigurationsNode = SubElement(configurationsNode, 'configuration')
-		bfConfigurationsNode.attrib[Configurations.NAME] = 'final'
-		bfConfigurationsNode.attrib[Configurations.BASE] = Configurations.BASE_FINAL
-
-		biConfigurationsNode = SubElement(configurationsNode, 'configuration')
-		biConfigurationsNode.attrib[Configurations.NAME] = 'interactive'
-		biConfigurationsNode.attrib[Configurations.BASE] = Configurations.BASE_INTERACTIVE
-
-		for (k, attr) in project.configurations.attrs.iteritems():
-			if k.find('bf_') == 0:
-				parameterNode = SubElement(bfConfigurationsNode, 'parameter')
-				parameterNode.attrib[Attr.NAME]  = k[3:]
-				parameterNode.attrib[Attr.VALUE] = '%d' % attr.value
-			elif k.find('bi_') == 0:
-				parameterNode = SubElement(biConfigurationsNode, 'parameter')
-				parameterNode.attrib[Attr.NAME]  = k[3:]
-				parameterNode.attrib[Attr.VALUE] = '%d' % attr.value		
-
-		## Output the XML file.
-		#
-		ElementTree(projectNode).write(sys.stdout, encoding = 'UTF-8')
+		self.Open('configurations')
+		for (name, base, prefix) in (('final', Configurations.BASE_FINAL, 'bf_'), ('interactive', Configurations.BASE_INTERACTIVE, 'bi_')):
+			self.Open('configuration', ((Configurations.NAME, name), (Configurations.BASE, base)))
+			for key in sorted(project.configurations.attrs.keys()):
+				if key.find(prefix) == 0:
+					self.Empty('parameter', ((Attr.NAME, key[3:]), (Attr.VALUE, FormatValue(project.configurations.attrs[key]))))
+			self.Close('configuration')
+		self.Close('configurations')
+
+		self.Close('project')
+		self.stream.flush()
+
+	def Serialize(self, project):
+		self.Begin(project)
+		self.End(project)
+
+	##
+	# Assembly file, a project whose scene holds the assembly alone.
+	#
+	def BeginArchive(self, project):
+		self.stream.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+		self.Open('project')
+		self.Open('scene')
+		self.Open('assembly', ((Assembly.NAME, project.scene.assemblyInstance.attrs[AssemblyInstance.ASSEMBLY]),))
+
+	def EndArchive(self, project):
+		self.EndAssembly(project)
+		self.Close('scene')
+		self.Close('project')
+		self.stream.flush()
+
+
+##
+# Writes the objects of a group and the shading entities they refer to into
+# an assembly file, which the project refers to as an archive assembly, see
+# Settings.ASSEMBLIES.
+#
+# The file is named after what the group is resolved from rather than after
+# its contents: the group key, see GroupKey(), and the parameters of the
+# nodes the group turned out to depend on, the SOPs and prototypes of its
+# objects and its shading nodes, see NodesDigest(). Without the geometry
+# cache the mesh files are named after their SOP, so the contents would not
+# tell that the geometry changed.
+#
+# These nodes and the files the group read or wrote are stored along under
+# the group key. A group whose nodes and files are unchanged reuses its file
+# without being resolved again, so that neither its SOPs are cooked nor the
+# render cache and appleseedfarm read or hash the file again.
+#
+class ArchiveFile(object):
+
+	TEMPORARY_FILE_NAME         = 'writing'
+	DEPENDENCIES_FILE_EXTENSION = '.json'
+
+	##
+	# Keys of the dependencies of a group.
+	NODES = 'nodes'
+	FILES = 'files'
+	KEY   = 'key'
+	EMPTY = 'empty'
+
+	##
+	# Settings changing the assembly file of a group.
+	KEY_SETTINGS = (
+		Settings.GEOMETRY_FORMAT,
+		Settings.GEOMETRY_CACHE,
+		Settings.GEOMETRY_CACHE_DIR,
+		Settings.GEOMETRY_COMPRESSION,
+		Settings.GEOMETRY_COMPRESSION_LEVEL,
+		Settings.UV_WELD_TOLERANCE,
+		Settings.POSITION_PRECISION,
+		Settings.UV_PRECISION,
+		Settings.TRANSFORM_PRECISION,
+		Settings.SEQUENCE,
+		Settings.DEDUPLICATE_SHADING,
+		Settings.CULL,
+		Settings.CULL_PADDING,
+		Settings.CULL_DISTANCE,
+	)
+
+	def __init__(self, name, groupKey, moments):
+		self.name = name
+		self.groupKey = groupKey
+		self.moments = moments
+
+		# Paths of the nodes and of the files the group depends on.
+		self.nodePaths = set()
+		self.filePaths = set()
+
+		# Archive assembly and its instance, None if the group has no object
+		# instance, every object being culled.
+		self.archive = None
+
+		self.project = None
+		self.serializer = None
+
+	def DependOnNode(self, path):
+		self.nodePaths.add(path)
+
+	def DependOnFile(self, filePath):
+		self.filePaths.add(os.path.abspath(filePath))
+
+	##
+	# Returns the name of the file of the group depending on the nodes at
+	# nodePaths.
+	#
+	def Key(self, nodePaths):
+		digest = hashlib.sha1('%s %s' % (self.groupKey, NodesDigest(sorted(nodePaths), self.moments)))
+		return digest.hexdigest() + appleseedlauncher.ASSEMBLY_FILE_EXTENSION
+
+	##
+	# Returns the dependencies of the group resolved by this export or stored
+	# by a former one, None if there are none or a file changed since. A file
+	# written again alike, a mesh of the SOP of an object of no group for
+	# instance, is only hashed again.
+	#
+	def Dependencies(self):
+		if theArchiveDependencies.has_key(self.groupKey):
+			return theArchiveDependencies[self.groupKey]
+
+		filePath = theAssemblyCache.Lookup(self.groupKey + ArchiveFile.DEPENDENCIES_FILE_EXTENSION)
+		if filePath is None:
+			return None
+
+		try:
+			file = open(filePath, 'r')
+			try:
+				dependencies = json.load(file)
+			finally:
+				file.close()
+		except (IOError, ValueError):
+			return None
+
+		for (filePath, size, modificationTime, digest) in dependencies[ArchiveFile.FILES]:
+			stamp = FileStamp(filePath)
+			if stamp is None:
+				return None
+			if stamp != [size, modificationTime] and appleseedcache.FileDigest(filePath) != digest:
+				return None
+
+		return dependencies
+
+	##
+	# Takes the file of the group as it was written, unless the group depends
+	# on something changed since. Returns True if the group needs not be
+	# resolved.
+	#
+	def Reuse(self):
+		dependencies = self.Dependencies()
+		if dependencies is None:
+			return False
+
+		key = self.Key(dependencies[ArchiveFile.NODES])
+		if key != dependencies[ArchiveFile.KEY]:
+			return False
+
+		if not dependencies[ArchiveFile.EMPTY]:
+			if theAssemblyCache.Lookup(key) is None:
+				return False
+			self.archive = self.Archive(key)
+
+		return True
+
+	def Open(self, deduplicator):
+		self.project = Project()
+
+		self.temporaryFilePath = theAssemblyCache.FilePath('%s.%d' % (ArchiveFile.TEMPORARY_FILE_NAME, os.getpid()))
+		self.file = open(self.temporaryFilePath, 'w')
+
+		self.serializer = XmlSerializer(theProfiler.Stream(self.file), deduplicator)
+		self.serializer.BeginArchive(self.project)
+
+	##
+	# Closes the file and stores it under its key, in place of a file of the
+	# same key resolved from the same nodes. Records what the group depends
+	# on, its shading nodes included.
+	#
+	def Close(self):
+		try:
+			self.serializer.EndArchive(self.project)
+		finally:
+			self.file.close()
+
+		assembly = self.project.scene.assembly
+		for (tableName, writerName) in appleseedshaders.TABLES:
+			self.nodePaths.update(getattr(assembly, tableName).keys())
+
+		key = self.Key(self.nodePaths)
+		empty = not assembly.objectInstances
+		theArchiveDependencies[self.groupKey] = {
+			ArchiveFile.NODES : sorted(self.nodePaths),
+			ArchiveFile.FILES : sorted(self.filePaths),
+			ArchiveFile.KEY   : key,
+			ArchiveFile.EMPTY : empty,
+		}
+
+		if empty:
+			os.remove(self.temporaryFilePath)
+			return
+
+		filePath = theAssemblyCache.FilePath(key)
+		if os.name == 'nt' and os.path.exists(filePath):
+			os.remove(filePath)
+		os.rename(self.temporaryFilePath, filePath)
+		theAssemblyCache.Insert(key)
+
+		self.archive = self.Archive(key)
+
+	##
+	# Returns the archive assembly of the file of key and its instance.
+	#
+	def Archive(self, key):
+		archiveAssembly = ArchiveAssembly()
+		archiveAssembly.attrs[ArchiveAssembly.NAME] = self.name
+		archiveAssembly.attrs[ArchiveAssembly.FILENAME] = os.path.join('.', os.path.basename(CompanionDir()), Settings.ASSEMBLY_CACHE_DIR_DEFAULT, key)
+
+		assemblyInstance = AssemblyInstance()
+		assemblyInstance.attrs[AssemblyInstance.NAME]     = self.name + '_inst'
+		assemblyInstance.attrs[AssemblyInstance.ASSEMBLY] = self.name
+
+		return (archiveAssembly, assemblyInstance)
 
 if __name__ == '__builtin__':
 
+	initializeStartTime = time.time()
+
 	moments = soho.getDefaultedFloat('state:time', [0.0])
 	cameras = soho.getDefaultedString('camera', ['/obj/cam1'])
 
+	theSettings = Settings()
+	theSettings.Resolve(None, moments)
+
 	if soho.initialize(moments[0], cameras[0]):
-		if soho.addObjects(moments[0], '*', '*', '*'):
+		if soho.addObjects(moments[0], theSettings.attrs[Settings.OBJECT_PATTERN], theSettings.attrs[Settings.LIGHT_PATTERN], '*'):
 			pass
 		else:
 			soho.error('Unable to add objects.')
+
+		bundle = '@' + theSettings.attrs[Settings.BUNDLE]
+		if bundle != '@' and not soho.addObjects(moments[0], bundle, bundle, '', False):
+			soho.error('Unable to add the objects of %s.' % bundle)
 	else:
 		soho.error('Unable to initialize.')
 
 	soho.lockObjects(moments[0])
 
-	theProject = Project()
+	appleseedshading.TheGraph().ResetStatistics()
 
-	for sohoCamera in soho.objectList('objlist:camera'):
-		camera = Camera()
-		camera.Resolve(sohoCamera, moments)
-		theProject.scene.camera = camera
-		break
+	if theSettings.attrs[Settings.PROFILE]:
+		theProfiler = appleseedprofile.Profiler(True, {
+			'parm_evaluations' : lambda: appleseedshading.TheGraph().evaluations,
+			'project_bytes'    : lambda: theProfiler.StreamBytes(),
+			'mesh_bytes'       : lambda: theGeometryWriter.compressedBytes,
+			'mesh_files'       : lambda: theGeometryWriter.fileCount,
+		})
+		theProfiler.Record('initialize', time.time() - initializeStartTime)
 
-	# Export light.
-	# TODO: Not use wrangler now
-	#
-	for sohoLight in soho.objectList('objlist:light'):
-		sohoLightName = sohoLight.getDefaultedString('object:name', sohoLight, [''])[0]
-		if not theProject.scene.assembly.lights.has_key(sohoLightName):
-			light = Light()
-			light.Resolve(sohoLight, moments)
-			theProject.scene.assembly.lights[sohoLightName] = light
+	appleseedshaders.SetFloatFormat(appleseedgeo.FloatFormat(theSettings.attrs[Settings.TRANSFORM_PRECISION], appleseedgeo.FLOAT64_ROUND_TRIP_FORMAT))
 
-			exitanceName = light.exitance.attrs[Color.NAME]
-			if not theProject.scene.assembly.colors.has_key(exitanceName):
-				theProject.scene.assembly.colors[exitanceName] = light.exitance
+	theGeometryCache = OpenGeometryCache(theSettings)
+	theGeometryWriter = GeometryWriter(theSettings.attrs[Settings.EXPORT_PROCESSES])
 
-	# Export geometry data.
+	if theSettings.attrs[Settings.IPR]:
+		if theSettings.attrs[Settings.SEQUENCE]:
+			Log('ipr is not available when exporting a sequence')
+		else:
+			theIprScene = IprScene()
+
+	# The IPR session updates the entities of the project alone.
+	if theIprScene is None:
+		theAssemblyCache = OpenAssemblyCache(theSettings)
+	elif theSettings.attrs[Settings.ASSEMBLIES] != Settings.ASSEMBLIES_SINGLE:
+		Log('ipr exports the objects to a single assembly')
+
+	# A sequence is exported at once so that the entities not depending on
+	# time are resolved and written once. The project of the current frame
+	# goes to the disk file, the others next to it. The disk file holds the
+	# current frame even when it is out of the sequence.
 	#
-	for sohoObjectInstance in soho.objectList('objlist:instance'):
-		object = Object()
-		object.Resolve(sohoObjectInstance, moments)
-		objectName = object.attrs[Object.NAME]
-		if not theProject.scene.assembly.objects.has_key(objectName):
-			theProject.scene.assembly.objects[objectName] = object
+	if theSettings.attrs[Settings.SEQUENCE]:
+		theResolvedEntities = {}
+
+		currentFrameNumber = FrameNumber(moments[0])
+		frameNumbers = theSettings.SequenceFrames()
+		if currentFrameNumber not in frameNumbers:
+			Log('frame %d is out of the sequence, exported to the disk file alone' % currentFrameNumber)
+			ExportFrame(moments, sys.stdout)
+
+		for frameNumber in frameNumbers:
+			frameMoments = [hou.frameToTime(frameNumber)]
+			if frameNumber == currentFrameNumber:
+				ExportFrame(frameMoments, sys.stdout)
+				continue
+
+			sequenceFilePath = SequenceFilePath(frameNumber)
+			file = open(sequenceFilePath, 'w')
+			try:
+				ExportFrame(frameMoments, file)
+			finally:
+				file.close()
+			Log('wrote %s' % sequenceFilePath)
+	else:
+		ExportFrame(moments, sys.stdout)
 
-		objectSopNode = hou.node(sohoObjectInstance.getName())
+	theGeometryWriter.Close()
 
-		materialNodePath = objectSopNode.evalParm('shop_materialpath')
-		materialNodeName = materialNodePath
-		ProcessMaterial(materialNodeName, theProject, moments)
-		
-		if not theProject.scene.assembly.objectInstances.has_key(objectName):
-			objectInstance = ObjectInstance()
-			objectInstance.Resolve(sohoObjectInstance, moments)
-			objectInstance.assignMaterial.attrs[AssignMaterial.MATERIAL] = materialNodeName
-			theProject.scene.assembly.objectInstances[objectName] = objectInstance
+	if theSettings.attrs[Settings.PROFILE]:
+		theProfiler.Finish(os.path.splitext(soho.getDefaultedString('soho_diskfile', ['appleseed'])[0])[0] + Settings.PROFILE_SUFFIX, theSettings.attrs[Settings.PROFILE_LOG])
 
-	frame = Frame()
-	frame.Resolve(None, moments)
-	theProject.output.frames[frame.attrs[Frame.NAME]] = frame
+	if theIprScene is not None:
+		appleseedipr.Start(theSettings.attrs[Settings.IPR_ADDRESS], theIprScene, soho.getDefaultedString('soho_diskfile', [''])[0])
 
-	theProject.configurations.Resolve(None, moments)
+	Log('shading graph: %s' % appleseedshading.TheGraph().Statistics())
+
+	if theGeometryCache is not None:
+		theGeometryCache.Save()
+		Log('geometry cache: %s' % theGeometryCache.Statistics())
+
+	if theAssemblyCache is not None:
+		SaveArchiveDependencies()
+		theAssemblyCache.Save()
+		Log('assembly cache: %s' % theAssemblyCache.Statistics())
 
-	serializer = XmlSerializer()
-	serializer.Serialize(theProject)
+	if theSettings.attrs[Settings.RENDER]:
+		RenderProject(theSettings, moments)
 	
 	theProject = None
+	theSettings = None
+	theGeometryCache = None
+	theGeometryWriter = None
+	theResolvedEntities = None
+	theIprScene = None
+	theAssemblyCache = None
+	theArchiveFile = None
+	theArchiveDependencies = {}
+	theProfiler = appleseedprofile.Profiler(False)
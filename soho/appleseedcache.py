@@ -0,0 +1,224 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Content addressed file store with a size cap and LRU eviction.
+#
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+
+##
+# Global variables.
+#
+
+# Digests of the files read, by path, with the size and the modification
+# time they had then.
+theFileDigests = {}
+
+##
+# Global functions.
+#
+##
+# Creates a directory and its parents unless they exist. Exports running at
+# once may create it meanwhile, that is not an error.
+#
+def EnsureDirectory(directory):
+	if os.path.isdir(directory):
+		return
+
+	try:
+		os.makedirs(directory)
+	except OSError, e:
+		if e.errno != errno.EEXIST or not os.path.isdir(directory):
+			raise
+
+##
+# Returns the SHA-1 of the content of a file, read again only once its size
+# or modification time changed.
+#
+def FileDigest(filePath):
+	stat = os.stat(filePath)
+	stamp = (stat.st_size, stat.st_mtime)
+
+	entry = theFileDigests.get(filePath)
+	if entry is not None and entry[0] == stamp:
+		return entry[1]
+
+	digest = hashlib.sha1()
+	file = open(filePath, 'rb')
+	try:
+		for data in iter(lambda: file.read(1 << 20), ''):
+			digest.update(data)
+	finally:
+		file.close()
+
+	theFileDigests[filePath] = (stamp, digest.hexdigest())
+	return digest.hexdigest()
+
+##
+# Makes targetPath the file at sourcePath, hard linked if possible and copied
+# otherwise. targetPath is replaced at once, it is never seen partly written.
+#
+def LinkFile(sourcePath, targetPath):
+	if os.path.exists(targetPath) and os.path.samefile(sourcePath, targetPath):
+		return
+
+	temporaryFilePath = '%s.%d' % (targetPath, os.getpid())
+	if os.path.exists(temporaryFilePath):
+		os.remove(temporaryFilePath)
+
+	try:
+		os.link(sourcePath, temporaryFilePath)
+	except (AttributeError, OSError):
+		shutil.copyfile(sourcePath, temporaryFilePath)
+
+	if os.name == 'nt' and os.path.exists(targetPath):
+		os.remove(targetPath)
+	os.rename(temporaryFilePath, targetPath)
+
+
+##
+# Files are named by the key of their content, the index remembers the size
+# and the last use of every file.
+#
+# Files used since the store was opened are never evicted, so that a project
+# being exported does not lose the files it refers to.
+#
+class ContentStore(object):
+
+	INDEX_FILE_NAME = 'index.json'
+
+	SIZE      = 0
+	LAST_USED = 1
+
+	def __init__(self, directory, maxBytes):
+		self.directory = directory
+		self.maxBytes = maxBytes
+
+		self.entries = {}
+		self.pinned = set()
+
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.evictedBytes = 0
+
+		self.Load()
+
+	def FilePath(self, key):
+		return os.path.join(self.directory, key)
+
+	def IndexFilePath(self):
+		return os.path.join(self.directory, ContentStore.INDEX_FILE_NAME)
+
+	def Load(self):
+		EnsureDirectory(self.directory)
+
+		self.entries = {}
+		try:
+			file = open(self.IndexFilePath(), 'r')
+			try:
+				self.entries = json.load(file)
+			finally:
+				file.close()
+		except (IOError, ValueError):
+			pass
+
+	def Save(self):
+		indexFilePath = self.IndexFilePath()
+		temporaryFilePath = '%s.%d' % (indexFilePath, os.getpid())
+
+		file = open(temporaryFilePath, 'w')
+		try:
+			json.dump(self.entries, file)
+		finally:
+			file.close()
+
+		if os.name == 'nt' and os.path.exists(indexFilePath):
+			os.remove(indexFilePath)
+		os.rename(temporaryFilePath, indexFilePath)
+
+	##
+	# Returns the path of the file stored under key, None on a miss.
+	#
+	def Lookup(self, key):
+		entry = self.entries.get(key)
+		filePath = self.FilePath(key)
+		if entry is None or not os.path.exists(filePath):
+			if entry is not None:
+				del self.entries[key]
+			self.misses += 1
+			return None
+
+		entry[ContentStore.LAST_USED] = time.time()
+		self.pinned.add(key)
+		self.hits += 1
+		return filePath
+
+	##
+	# Records the file written to FilePath(key).
+	#
+	def Insert(self, key):
+		size = os.path.getsize(self.FilePath(key))
+		self.entries[key] = [size, time.time()]
+		self.pinned.add(key)
+		self.Evict()
+
+	def TotalBytes(self):
+		total = 0
+		for entry in self.entries.itervalues():
+			total += entry[ContentStore.SIZE]
+		return total
+
+	def Evict(self):
+		if self.maxBytes <= 0:
+			return
+
+		totalBytes = self.TotalBytes()
+		if totalBytes <= self.maxBytes:
+			return
+
+		candidates = [(entry[ContentStore.LAST_USED], key) for (key, entry) in self.entries.iteritems() if key not in self.pinned]
+		candidates.sort()
+		for (lastUsed, key) in candidates:
+			size = self.entries.pop(key)[ContentStore.SIZE]
+			try:
+				os.remove(self.FilePath(key))
+			except OSError:
+				pass
+
+			totalBytes -= size
+			self.evictions += 1
+			self.evictedBytes += size
+			if totalBytes <= self.maxBytes:
+				break
+
+	def Statistics(self):
+		lookups = self.hits + self.misses
+		hitRate = 0.0
+		if lookups:
+			hitRate = 100.0 * self.hits / lookups
+
+		return '%d hits, %d misses (%.1f%% hit rate), %d evicted (%d bytes), %d bytes stored' % (self.hits, self.misses, hitRate, self.evictions, self.evictedBytes, self.TotalBytes())
@@ -0,0 +1,183 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Culling of the objects the camera can not see.
+#
+# An object is tested by the sphere around the box of its geometry, as (xmin,
+# ymin, zmin, xmax, ymax, zmax), moved by its world transform. It is culled
+# when the sphere is entirely on the outer side of one of the planes of the
+# camera frustum, or farther than the maximum distance. The test is
+# conservative, a sphere is a little larger than its box and one crossing the
+# corner of two planes is kept; it takes two point transforms per object.
+#
+# Like appleseedgeo, it does not depend on hou, soho or sohog.
+#
+
+import appleseedgeo
+
+# Depth in front of the camera under which objects are behind it.
+NEAR_DEPTH = 1e-6
+
+##
+# Global functions.
+#
+
+##
+# Returns the center and the radius of a sphere holding the box bounds moved
+# by matrix, the radius being scaled by the largest scale of matrix.
+#
+def BoundingSphere(bounds, matrix):
+	(x0, y0, z0, x1, y1, z1) = bounds
+	center = appleseedgeo.TransformPoint(((x0 + x1) * 0.5, (y0 + y1) * 0.5, (z0 + z1) * 0.5), matrix)
+
+	scale = max([matrix[row] * matrix[row] + matrix[row + 1] * matrix[row + 1] + matrix[row + 2] * matrix[row + 2] for row in (0, 4, 8)]) ** 0.5
+	radius = 0.5 * ((x1 - x0) ** 2 + (y1 - y0) ** 2 + (z1 - z0) ** 2) ** 0.5 * scale
+
+	return (center, radius)
+
+def FormatCount(count):
+	if count >= 1000000:
+		return '%.1fM' % (count / 1e6)
+	if count >= 1000:
+		return '%.1fk' % (count / 1e3)
+	return '%d' % count
+
+
+##
+# Culls objects out of the frustum of a pinhole camera looking down -Z, and
+# farther than maxDistance if not 0.
+#
+# The frustum is widened by padding, a fraction of its width and height, so
+# that objects just out of frame still cast their shadows and reflections.
+#
+# What is culled and kept is counted by kind, OBJECTS whose size is their
+# points and primitives or INSTANCES of size 1, the time saved being
+# estimated from the rate at which the kept ones of each kind were exported.
+#
+class Culler(object):
+
+	FRUSTUM  = 'frustum'
+	DISTANCE = 'distance'
+
+	OBJECTS   = 'objects'
+	INSTANCES = 'instances'
+
+	##
+	# cameraWorld is the world transform of the camera, filmDimensions and
+	# focalLength are in the same unit.
+	#
+	def __init__(self, cameraWorld, filmDimensions, focalLength, padding = 0.0, maxDistance = 0.0):
+		self.toCamera = appleseedgeo.InvertMatrix(cameraWorld)
+		self.cameraPosition = tuple(cameraWorld[12:15])
+
+		scale = (1.0 + padding) * 0.5 / focalLength
+		self.slopeX = filmDimensions[0] * scale
+		self.slopeY = filmDimensions[1] * scale
+		self.normX = 1.0 / (1.0 + self.slopeX * self.slopeX) ** 0.5
+		self.normY = 1.0 / (1.0 + self.slopeY * self.slopeY) ** 0.5
+		self.maxDistance = maxDistance
+
+		# Count culled by reason and kind, and count, size and seconds of the
+		# culled and kept by kind.
+		self.reasons = {}
+		self.culled = {}
+		self.kept = {}
+		for kind in (Culler.OBJECTS, Culler.INSTANCES):
+			self.culled[kind] = [0, 0]
+			self.kept[kind] = [0, 0, 0.0]
+
+	##
+	# Returns why the box bounds moved by matrix is culled, None if it is not.
+	#
+	def Test(self, bounds, matrix):
+		(center, radius) = BoundingSphere(bounds, matrix)
+
+		if self.maxDistance > 0.0:
+			offset = [center[axis] - self.cameraPosition[axis] for axis in xrange(3)]
+			if (offset[0] * offset[0] + offset[1] * offset[1] + offset[2] * offset[2]) ** 0.5 - radius > self.maxDistance:
+				return Culler.DISTANCE
+
+		if self.toCamera is None:
+			return None
+
+		# The sphere is out when it is entirely behind the camera or on the
+		# outer side of one of the planes through the camera and the edges
+		# of the frame.
+		(x, y, z) = appleseedgeo.TransformPoint(center, self.toCamera)
+		if z > radius:
+			return Culler.FRUSTUM
+		if (abs(x) + self.slopeX * z) * self.normX > radius:
+			return Culler.FRUSTUM
+		if (abs(y) + self.slopeY * z) * self.normY > radius:
+			return Culler.FRUSTUM
+
+		return None
+
+	##
+	# Returns True if the box bounds moved by matrix is culled, and counts it
+	# as of kind and size. Nothing is culled without bounds.
+	#
+	def Cull(self, bounds, matrix, kind, size = 1):
+		if bounds is None:
+			return False
+
+		reason = self.Test(bounds, matrix)
+		if reason is None:
+			return False
+
+		self.reasons[(reason, kind)] = self.reasons.get((reason, kind), 0) + 1
+		self.culled[kind][0] += 1
+		self.culled[kind][1] += size
+		return True
+
+	##
+	# Counts what was kept, of kind and size, exported in seconds.
+	#
+	def Keep(self, kind, seconds, size = 1):
+		kept = self.kept[kind]
+		kept[0] += 1
+		kept[1] += size
+		kept[2] += seconds
+
+	##
+	# Returns the time the culled objects would have taken, at the rate the
+	# kept ones were exported.
+	#
+	def SavedSeconds(self):
+		seconds = 0.0
+		for (kind, (count, size)) in self.culled.iteritems():
+			keptSize = self.kept[kind][1]
+			if keptSize:
+				seconds += size * self.kept[kind][2] / keptSize
+		return seconds
+
+	def Statistics(self):
+		kinds = []
+		for kind in (Culler.OBJECTS, Culler.INSTANCES):
+			(count, size) = self.culled[kind]
+			total = count + self.kept[kind][0]
+			if total == 0:
+				continue
+			kinds.append('%d of %d %s (%d out of frame, %d too far)' % (count, total, kind,
+				self.reasons.get((Culler.FRUSTUM, kind), 0), self.reasons.get((Culler.DISTANCE, kind), 0)))
+
+		(count, size) = self.culled[Culler.OBJECTS]
+		return '%s skipped, %s points and primitives, about %.2f s saved' % (', '.join(kinds) or 'nothing', FormatCount(size), self.SavedSeconds())
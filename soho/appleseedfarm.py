@@ -0,0 +1,357 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Local render farm, renders the projects of a frame range with a pool of
+# appleseed.cli processes.
+#
+# Every frame is a job. Jobs run a few at a time, as many as the memory holds
+# and no more than the cores, the cores being shared among them. A failed job
+# is tried again later, and the output of every attempt is appended to a log
+# next to its image. Exported sequences can also be rendered from the command
+# line:
+#
+#   python soho/appleseedfarm.py --cli appleseed.cli scene.0001.appleseed ...
+#
+# With a render cache, a frame whose project, meshes and renderer are those
+# of a frame rendered before is not rendered again, the image rendered then
+# is linked in place, see RenderKey().
+#
+
+import hashlib
+import multiprocessing
+import optparse
+import os
+import re
+import sys
+import time
+
+import appleseedcache
+import appleseedgeo
+import appleseedlauncher
+
+##
+# Memory a render is expected to take, in MiB.
+#
+DEFAULT_JOB_MEMORY = 4096
+
+DEFAULT_RETRIES = 1
+
+# Size of the render cache in MiB.
+DEFAULT_CACHE_SIZE = 4096
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('appleseed: farm: %s\n' % message)
+
+##
+# Returns the physical memory in bytes, None if unknown.
+#
+def PhysicalMemory():
+	try:
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+	except (AttributeError, ValueError, OSError):
+		return None
+
+##
+# Returns the number of renders to run at once for jobCount jobs. Unless
+# given, it is the number of renders of jobMemory MiB the memory holds,
+# within the number of cores.
+#
+def WorkerCount(jobCount, workers = 0, jobMemory = DEFAULT_JOB_MEMORY):
+	if workers <= 0:
+		workers = multiprocessing.cpu_count()
+		memory = PhysicalMemory()
+		if memory is not None and jobMemory > 0:
+			workers = min(workers, memory / (jobMemory << 20))
+
+	return max(1, min(workers, jobCount))
+
+##
+# Returns the key of the image of projectFilePath rendered with extension by
+# the renderer configured by configuration, a list of strings: the digest of
+# the project, of the meshes it refers to and of configuration, the
+# extension appended. None if a mesh is missing, the render is not cached.
+#
+def RenderKey(projectFilePath, extension, configuration):
+	digest = hashlib.sha1()
+	for item in configuration:
+		digest.update(item + '\0')
+	digest.update(appleseedcache.FileDigest(projectFilePath))
+
+	# A compressed mesh is the one exported, the plain file next to it is
+	# expanded from it by appleseedlauncher before rendering.
+	projectDir = os.path.dirname(os.path.abspath(projectFilePath))
+	for filePath in appleseedlauncher.ProjectMeshFiles(projectFilePath):
+		candidates = [filePath + suffix for suffix in sorted(appleseedgeo.COMPRESSED_SUFFIXES.itervalues())] + [filePath]
+		existing = [candidate for candidate in candidates if os.path.exists(candidate)]
+		if not existing:
+			return None
+
+		digest.update(os.path.relpath(existing[0], projectDir) + '\0' + appleseedcache.FileDigest(existing[0]))
+
+	return digest.hexdigest() + extension.lower()
+
+
+##
+# A frame to render, tried until it renders or it runs out of attempts.
+#
+class Job(object):
+
+	WAITING = 'waiting'
+	RUNNING = 'running'
+	DONE    = 'done'
+	FAILED  = 'failed'
+
+	def __init__(self, projectFilePath, outputFilePath, frameNumber = None):
+		self.projectFilePath = projectFilePath
+		self.outputFilePath = outputFilePath
+		self.logFilePath = os.path.splitext(outputFilePath)[0] + '.log'
+		self.frameNumber = frameNumber
+
+		self.state = Job.WAITING
+		self.attempts = 0
+		self.render = None
+
+		# Key of the image in the render cache, None if not cached.
+		self.cacheKey = None
+		self.cached = False
+
+	def Name(self):
+		if self.frameNumber is not None:
+			return 'frame %d' % self.frameNumber
+		return os.path.basename(self.projectFilePath)
+
+
+##
+# Runs jobs with a pool of renders. It is driven by Poll, from a loop or the
+# event loop of Houdini, so that it never blocks the caller.
+#
+# The images are looked up in cache, an appleseedcache.ContentStore, before
+# rendering and stored there once rendered.
+#
+class Farm(object):
+
+	def __init__(self, cli, jobs, workers = 0, retries = DEFAULT_RETRIES, jobMemory = DEFAULT_JOB_MEMORY, arguments = (), cache = None):
+		self.cli = cli
+		self.jobs = list(jobs)
+		self.retries = retries
+		self.workers = WorkerCount(len(self.jobs), workers, jobMemory)
+
+		# The threads given to the renderer do not change the image, the
+		# renderer itself does.
+		self.cache = cache
+		self.configuration = [cli] + list(arguments)
+		if os.path.isfile(cli):
+			self.configuration.append('%d:%d' % (os.path.getsize(cli), os.path.getmtime(cli)))
+
+		# The cores are shared among the renders, unless told otherwise.
+		self.arguments = list(arguments)
+		if '--threads' not in self.arguments and '-t' not in self.arguments:
+			self.arguments += ['--threads', str(max(1, multiprocessing.cpu_count() / self.workers))]
+
+		self.waiting = list(self.jobs)
+		self.running = []
+		self.startTime = time.time()
+		self.endTime = None
+		self.cancelled = False
+
+	def Start(self, job):
+		if self.cache is not None and job.attempts == 0 and self.Restore(job):
+			return
+
+		job.attempts += 1
+		try:
+			job.render = appleseedlauncher.Launch(self.cli, job.projectFilePath, job.outputFilePath, self.arguments, job.logFilePath)
+		except (OSError, IOError), e:
+			Log('%s: can not run %s: %s' % (job.Name(), self.cli, e))
+			job.state = Job.FAILED
+			return
+
+		job.state = Job.RUNNING
+		self.running.append(job)
+
+	##
+	# Collects the renders over and starts the waiting jobs. A render failing
+	# or leaving no image sends its job back to the end of the queue until it
+	# has been tried retries more times. Returns the number of failed jobs
+	# once all are over, None until then.
+	#
+	def Poll(self):
+		for job in list(self.running):
+			returnCode = job.render.Poll()
+			if returnCode is None:
+				continue
+
+			self.running.remove(job)
+			if returnCode == 0 and os.path.exists(job.outputFilePath):
+				job.state = Job.DONE
+				self.Store(job)
+			elif self.cancelled or job.attempts > self.retries:
+				Log('%s: %s, see %s' % (job.Name(), job.render.Status(), job.logFilePath))
+				job.state = Job.FAILED
+			else:
+				Log('%s: %s, trying again' % (job.Name(), job.render.Status()))
+				job.state = Job.WAITING
+				self.waiting.append(job)
+
+		while self.waiting and len(self.running) < self.workers and not self.cancelled:
+			self.Start(self.waiting.pop(0))
+
+		if self.running or (self.waiting and not self.cancelled):
+			return None
+
+		if self.endTime is None:
+			self.endTime = time.time()
+			if self.cache is not None:
+				self.cache.Save()
+				Log('render cache: %s' % self.cache.Statistics())
+		return len(self.Jobs(Job.FAILED))
+
+	##
+	# Links the image of job from the cache, returns True on a hit. On a miss
+	# the image left by a previous render is removed, it may be linked to the
+	# cache and the renderer would write into it.
+	#
+	def Restore(self, job):
+		job.cacheKey = RenderKey(job.projectFilePath, os.path.splitext(job.outputFilePath)[1], self.configuration)
+		if job.cacheKey is None:
+			return False
+
+		try:
+			cachedFilePath = self.cache.Lookup(job.cacheKey)
+			if cachedFilePath is not None:
+				appleseedcache.LinkFile(cachedFilePath, job.outputFilePath)
+				job.state = Job.DONE
+				job.cached = True
+				return True
+
+			if os.path.exists(job.outputFilePath):
+				os.remove(job.outputFilePath)
+		except (OSError, IOError), e:
+			Log('%s: render cache: %s' % (job.Name(), e))
+		return False
+
+	def Store(self, job):
+		if self.cache is None or job.cacheKey is None:
+			return
+
+		try:
+			appleseedcache.LinkFile(job.outputFilePath, self.cache.FilePath(job.cacheKey))
+			self.cache.Insert(job.cacheKey)
+		except (OSError, IOError), e:
+			Log('%s: render cache: %s' % (job.Name(), e))
+
+	def Wait(self, timeout = None):
+		deadline = timeout is not None and time.time() + timeout
+		while True:
+			failed = self.Poll()
+			if failed is not None:
+				return failed
+			if deadline and time.time() >= deadline:
+				return None
+			time.sleep(0.1)
+
+	def Cancel(self):
+		self.cancelled = True
+		for job in self.waiting:
+			job.state = Job.FAILED
+		self.waiting = []
+
+		for job in list(self.running):
+			job.render.Cancel()
+		self.Poll()
+
+	def Jobs(self, state):
+		return [job for job in self.jobs if job.state == state]
+
+	def Elapsed(self):
+		return (self.endTime or time.time()) - self.startTime
+
+	##
+	# Returns the seconds left estimated from the frames done and the progress
+	# of the running ones, None until there is some.
+	#
+	def Eta(self):
+		done = len(self.Jobs(Job.DONE)) + sum([job.render.percent / 100.0 for job in self.running])
+		if done <= 0.0:
+			return None
+		return self.Elapsed() * (len(self.jobs) - len(self.Jobs(Job.FAILED)) - done) / done
+
+	def Status(self, noun = 'frames'):
+		over = self.Poll() is not None
+
+		status = '%d/%d %s done' % (len(self.Jobs(Job.DONE)), len(self.jobs), noun)
+		cached = len([job for job in self.jobs if job.cached])
+		if cached:
+			status += ', %d from the cache' % cached
+		if self.running:
+			status += ', %d running' % len(self.running)
+		failed = len(self.Jobs(Job.FAILED))
+		if failed:
+			status += ', %d failed' % failed
+
+		if over:
+			return status + ' in %s' % appleseedlauncher.FormatDuration(self.Elapsed())
+
+		eta = self.Eta()
+		if eta is not None:
+			status += ', %s left' % appleseedlauncher.FormatDuration(max(eta, 0.0))
+		return status
+
+
+def Main(arguments):
+	parser = optparse.OptionParser(usage = '%prog [options] project...')
+	parser.add_option('--cli', default = 'appleseed.cli', help = 'path of appleseed.cli')
+	parser.add_option('--workers', type = 'int', default = 0, help = 'renders at once, from the cores and the memory by default')
+	parser.add_option('--retries', type = 'int', default = DEFAULT_RETRIES, help = 'attempts after a failed render')
+	parser.add_option('--job-memory', type = 'int', default = DEFAULT_JOB_MEMORY, help = 'memory of a render in MiB')
+	parser.add_option('--interval', type = 'float', default = 10.0, help = 'seconds between progress reports')
+	parser.add_option('--cache', metavar = 'DIR', help = 'reuses the images of the projects rendered before, stored in DIR')
+	parser.add_option('--cache-size', type = 'int', default = DEFAULT_CACHE_SIZE, help = 'size of the render cache in MiB')
+	(options, projectFilePaths) = parser.parse_args(arguments)
+	if not projectFilePaths:
+		parser.error('expected project files')
+
+	jobs = []
+	for projectFilePath in projectFilePaths:
+		root = os.path.splitext(projectFilePath)[0]
+		match = re.search(r'\d+$', root)
+		jobs.append(Job(projectFilePath, root + '.png', match and int(match.group())))
+
+	cache = None
+	if options.cache:
+		cache = appleseedcache.ContentStore(options.cache, options.cache_size << 20)
+
+	farm = Farm(options.cli, jobs, options.workers, options.retries, options.job_memory, (), cache)
+	Log('rendering %d frames, %d at once' % (len(jobs), farm.workers))
+	try:
+		while farm.Wait(options.interval) is None:
+			Log(farm.Status())
+	except KeyboardInterrupt:
+		farm.Cancel()
+	Log(farm.Status())
+
+	return farm.Wait() and 1 or 0
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,878 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Geometry extraction and mesh file writers.
+#
+# This module does not depend on hou, soho or sohog so that it could be
+# imported from worker processes and from tools running outside Houdini.
+#
+
+import array
+import gzip
+import hashlib
+import multiprocessing.pool
+import os
+import struct
+import sys
+import time
+import zlib
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+##
+# Global variables.
+#
+
+# Number of elements formatted by one string operation.
+CHUNK_SIZE = 16384
+
+# Size of the file buffer, the data hits the disk once it is full.
+BUFFER_SIZE = 1 << 20
+
+# Precision of the floats written as text: the number of decimals, or
+# ROUND_TRIP_PRECISION for the fewest digits reading back as the same float.
+ROUND_TRIP_PRECISION = -1
+
+# Formats reading back as the same 32 bit float, as the geometry attributes of
+# Houdini, and as the same 64 bit float. repr() is the shortest one since
+# Python 2.7, the shortest 32 bit one would take a search per value.
+FLOAT32_ROUND_TRIP_FORMAT = '%.9g'
+FLOAT64_ROUND_TRIP_FORMAT = '%r'
+
+# Compressions of the mesh files and the suffix of their names.
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+COMPRESSED_SUFFIXES = {
+	GZIP : '.gz',
+	ZSTD : '.zst',
+}
+
+# Size of the blocks compressed in parallel.
+COMPRESSED_BLOCK_SIZE = 1 << 20
+
+# Point attributes PointInstanceMatrix() reads.
+POINT_INSTANCE_ATTRIBS = ('P', 'N', 'v', 'up', 'orient', 'rot', 'scale', 'pscale', 'trans', 'pivot', 'transform')
+
+##
+# Global functions.
+#
+def ReadMesh(sohoGeometry, uvTolerance = 0.0):
+	mesh = MeshData()
+
+	mesh.pointCount = sohoGeometry.globalValue('geo:pointcount')[0]
+	mesh.primCount = sohoGeometry.globalValue('geo:primcount')[0]
+
+	value = sohoGeometry.value
+	vertex = sohoGeometry.vertex
+
+	# P
+	geoPointP = sohoGeometry.attribute('geo:point', 'P')
+	extend = mesh.positions.extend
+	for i in xrange(mesh.pointCount):
+		extend(value(geoPointP, i)[:3])
+
+	# Vertex count and point reference of each primitive.
+	geoPrimVertexCount = sohoGeometry.attribute('geo:prim', 'geo:vertexcount')
+	geoVertexPointRef = sohoGeometry.attribute('geo:vertex', 'geo:pointref')
+	appendCount = mesh.vertexCounts.append
+	appendRef = mesh.pointRefs.append
+	for i in xrange(mesh.primCount):
+		vertexCount = value(geoPrimVertexCount, i)[0]
+		appendCount(vertexCount)
+		for j in xrange(vertexCount):
+			appendRef(vertex(geoVertexPointRef, i, j)[0])
+
+	# uv, of the vertices or of the points.
+	geoVertexAttribs = sohoGeometry.globalValue('geo:vertexattribs')
+	geoPointAttribs = sohoGeometry.globalValue('geo:pointattribs')
+	if geoVertexAttribs and 'uv' in geoVertexAttribs:
+		uvs = array.array('d')
+		geoVertexUV = sohoGeometry.attribute('geo:vertex', 'uv')
+		extend = uvs.extend
+		i = 0
+		for vertexCount in mesh.vertexCounts:
+			for j in xrange(vertexCount):
+				extend(vertex(geoVertexUV, i, j)[:2])
+			i += 1
+		(mesh.uvs, mesh.uvIndices) = WeldUVs(uvs, uvTolerance)
+
+	elif geoPointAttribs and 'uv' in geoPointAttribs:
+		mesh.uvs = array.array('d')
+		geoPointUV = sohoGeometry.attribute('geo:point', 'uv')
+		extend = mesh.uvs.extend
+		for i in xrange(mesh.pointCount):
+			extend(value(geoPointUV, i)[:2])
+		mesh.uvIndices = mesh.pointRefs
+
+	return mesh
+
+##
+# Reads a hou.Geometry, e.g. the geometry embedded in a packed primitive, the
+# same way as ReadMesh() reads a SOP through sohog.
+#
+def ReadHouGeometry(geometry, uvTolerance = 0.0):
+	mesh = MeshData()
+
+	mesh.positions.extend(geometry.pointFloatAttribValues('P'))
+	mesh.pointCount = len(mesh.positions) // 3
+
+	uvs = None
+	uvAttrib = geometry.findVertexAttrib('uv')
+	if uvAttrib is not None:
+		uvs = array.array('d')
+
+	appendCount = mesh.vertexCounts.append
+	appendRef = mesh.pointRefs.append
+	for prim in geometry.prims():
+		vertices = prim.vertices()
+		appendCount(len(vertices))
+		for vertex in vertices:
+			appendRef(vertex.point().number())
+			if uvAttrib is not None:
+				uvs.extend(vertex.attribValue(uvAttrib)[:2])
+		mesh.primCount += 1
+
+	if uvs is not None:
+		(mesh.uvs, mesh.uvIndices) = WeldUVs(uvs, uvTolerance)
+	elif geometry.findPointAttrib('uv') is not None:
+		pointUVs = geometry.pointFloatAttribValues('uv')
+		mesh.uvs = array.array('d')
+		for i in xrange(0, len(pointUVs), 3):
+			mesh.uvs.extend(pointUVs[i:i + 2])
+		mesh.uvIndices = mesh.pointRefs
+
+	return mesh
+
+##
+# Merges the u v pairs of uvs closer than tolerance, exactly equal ones when
+# tolerance is 0. Pairs are hashed on a grid of cells of size tolerance, a
+# pair takes the value of the first one of its cell.
+#
+# Returns the merged pairs, in the order of their first use, and the index of
+# the merged pair of each pair.
+#
+def WeldUVs(uvs, tolerance):
+	if numpy is not None:
+		values = NumpyArray(uvs).reshape(-1, 2)
+		keys = values
+		if tolerance > 0.0:
+			keys = numpy.round(values / tolerance)
+		# Adding 0 turns -0 into 0, pairs are then compared as 16 bytes.
+		keys = numpy.ascontiguousarray(keys + 0.0).view(numpy.dtype((numpy.void, 16))).ravel()
+		(unique, first, inverse) = numpy.unique(keys, return_index = True, return_inverse = True)
+
+		# numpy.unique() sorts, renumber the pairs by first use.
+		order = numpy.argsort(first)
+		rank = numpy.empty(len(order), dtype = numpy.int32)
+		rank[order] = numpy.arange(len(order), dtype = numpy.int32)
+
+		welded = array.array('d')
+		welded.fromstring(numpy.ascontiguousarray(values[first[order]], dtype = numpy.float64).tostring())
+		indices = array.array('i')
+		indices.fromstring(rank[inverse.ravel()].astype(numpy.int32).tostring())
+		return (welded, indices)
+
+	us = uvs[0::2]
+	vs = uvs[1::2]
+	if tolerance > 0.0:
+		scale = 1.0 / tolerance
+		keys = zip([int(round(u * scale)) for u in us], [int(round(v * scale)) for v in vs])
+	else:
+		keys = zip(us, vs)
+
+	welded = array.array('d')
+	indices = array.array('i')
+	firstIndices = {}
+	get = firstIndices.get
+	append = indices.append
+	for (i, key) in enumerate(keys):
+		index = get(key)
+		if index is None:
+			index = len(firstIndices)
+			firstIndices[key] = index
+			welded.append(us[i])
+			welded.append(vs[i])
+		append(index)
+
+	return (welded, indices)
+
+##
+# Returns the format of a float written with precision, see
+# ROUND_TRIP_PRECISION.
+#
+def FloatFormat(precision, roundTripFormat = FLOAT32_ROUND_TRIP_FORMAT):
+	if precision < 0:
+		return roundTripFormat
+	return '%%.%df' % precision
+
+##
+# Writes mesh with writer, this is the entry point of the export processes.
+#
+# Returns the number of bytes of the mesh, the number of bytes of the file and
+# the time it took.
+#
+def WriteMesh(writer, filePath, sopPath, mesh):
+	startTime = time.time()
+	bytesWritten = writer.Write(filePath, sopPath, mesh)
+	return (bytesWritten, writer.compressedBytes, time.time() - startTime)
+
+##
+# Returns an object compressing a stream with compress() and flush().
+#
+def StreamCompressor(codec, level):
+	if codec == ZSTD:
+		return zstandard.ZstdCompressor(level = level).compressobj()
+	return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+##
+# Returns block compressed on its own. Such blocks put one after the other
+# are read back as a single gzip or zstd stream.
+#
+def CompressBlock(codec, level, block):
+	if codec == ZSTD:
+		return zstandard.ZstdCompressor(level = level).compress(block)
+
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return compressor.compress(block) + compressor.flush()
+
+##
+# Decompresses a file written through a CompressedFile next to it, under its
+# name without the compression suffix. appleseed does not read compressed
+# meshes, this has to be done before rendering.
+#
+# Returns the path of the decompressed file.
+#
+def ExpandFile(filePath):
+	for (codec, suffix) in COMPRESSED_SUFFIXES.iteritems():
+		if filePath.endswith(suffix):
+			break
+	else:
+		return filePath
+
+	# The file is expanded under a temporary name then renamed, so that a
+	# renderer started meanwhile never reads it partly written.
+	expandedFilePath = filePath[:-len(suffix)]
+	temporaryFilePath = '%s.%d' % (expandedFilePath, os.getpid())
+	source = open(filePath, 'rb')
+	try:
+		if codec == ZSTD:
+			reader = zstandard.ZstdDecompressor().stream_reader(source, read_across_frames = True)
+		else:
+			reader = gzip.GzipFile(fileobj = source, mode = 'rb')
+
+		output = open(temporaryFilePath, 'wb', BUFFER_SIZE)
+		try:
+			while True:
+				data = reader.read(BUFFER_SIZE)
+				if not data:
+					break
+				output.write(data)
+		finally:
+			output.close()
+	finally:
+		source.close()
+
+	if os.name == 'nt' and os.path.exists(expandedFilePath):
+		os.remove(expandedFilePath)
+	os.rename(temporaryFilePath, expandedFilePath)
+
+	return expandedFilePath
+
+##
+# Returns the index of every vertex in the written order, that is with the
+# winding of each face reversed.
+#
+def ReversedVertexOrder(mesh):
+	if numpy is not None:
+		counts = NumpyArray(mesh.vertexCounts).astype(numpy.int64)
+		starts = numpy.cumsum(counts) - counts
+		return numpy.repeat(2 * starts + counts - 1, counts) - numpy.arange(mesh.VertexCount(), dtype = numpy.int64)
+
+	order = array.array('i')
+	extend = order.extend
+	start = 0
+	for vertexCount in mesh.vertexCounts:
+		end = start + vertexCount
+		extend(xrange(end - 1, start - 1, -1))
+		start = end
+
+	return order
+
+##
+# Returns the point references of all faces with the winding reversed, the
+# first point being numbered base. refs gives other per vertex indices to
+# reverse, e.g. the uv indices.
+#
+def ReversedFaceIndices(mesh, base = 1, refs = None):
+	if refs is None:
+		refs = mesh.pointRefs
+
+	if numpy is not None:
+		return NumpyArray(refs)[ReversedVertexOrder(mesh)] + base
+
+	indices = array.array('i')
+	extend = indices.extend
+	start = 0
+	for vertexCount in mesh.vertexCounts:
+		end = start + vertexCount
+		face = refs[start:end]
+		face.reverse()
+		extend(face)
+		start = end
+
+	if base != 0:
+		for i in xrange(len(indices)):
+			indices[i] += base
+
+	return indices
+
+##
+# Wraps an array.array into a NumPy array without copying it.
+#
+def NumpyArray(values):
+	return numpy.frombuffer(values, dtype = values.typecode)
+
+##
+# Returns the little endian bytes of an array.array.
+#
+def LittleEndianBytes(values):
+	if sys.byteorder != 'little':
+		values = array.array(values.typecode, values)
+		values.byteswap()
+	return values.tostring()
+
+
+##
+# Instance transforms. Matrices are 16 values in the row vector convention of
+# Houdini, rotations are 3x3 matrices given as 3 rows.
+#
+def MultiplyMatrices(a, b):
+	return tuple([sum([a[row * 4 + k] * b[k * 4 + column] for k in xrange(4)]) for row in xrange(4) for column in xrange(4)])
+
+##
+# Returns the inverse of a matrix, None if it has none.
+#
+def InvertMatrix(m):
+	rows = [list(m[row * 4:row * 4 + 4]) + [float(row == column) for column in xrange(4)] for row in xrange(4)]
+	for column in xrange(4):
+		pivot = max(xrange(column, 4), key = lambda row: abs(rows[row][column]))
+		if rows[pivot][column] == 0.0:
+			return None
+		(rows[column], rows[pivot]) = (rows[pivot], rows[column])
+
+		scale = float(rows[column][column])
+		rows[column] = [value / scale for value in rows[column]]
+		for row in xrange(4):
+			factor = rows[row][column]
+			if row != column and factor != 0.0:
+				rows[row] = [value - factor * pivotValue for (value, pivotValue) in zip(rows[row], rows[column])]
+
+	return tuple([value for row in rows for value in row[4:]])
+
+def TransformPoint(p, m):
+	return tuple([p[0] * m[column] + p[1] * m[4 + column] + p[2] * m[8 + column] + m[12 + column] for column in xrange(3)])
+
+def MultiplyRotations(a, b):
+	return [[sum([a[row][k] * b[k][column] for k in xrange(3)]) for column in xrange(3)] for row in xrange(3)]
+
+def Normalized(v):
+	length = (v[0] * v[0] + v[1] * v[1] + v[2] * v[2]) ** 0.5
+	if length == 0.0:
+		return None
+	return (v[0] / length, v[1] / length, v[2] / length)
+
+def Cross(a, b):
+	return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+##
+# Returns the rotation of the quaternion x y z w.
+#
+def QuaternionRotation(q):
+	(x, y, z, w) = q[:4]
+	return [
+		[1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y + w * z), 2.0 * (x * z - w * y)],
+		[2.0 * (x * y - w * z), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z + w * x)],
+		[2.0 * (x * z + w * y), 2.0 * (y * z - w * x), 1.0 - 2.0 * (x * x + y * y)],
+	]
+
+##
+# Returns the rotation turning +Z towards direction with +Y towards up.
+#
+def LookAtRotation(direction, up):
+	z = Normalized(direction)
+	if z is None:
+		return None
+
+	x = Normalized(Cross(up, z))
+	if x is None:
+		x = Normalized(Cross((1.0, 0.0, 0.0), z)) or Normalized(Cross((0.0, 0.0, 1.0), z))
+	y = Cross(z, x)
+
+	return [list(x), list(y), list(z)]
+
+##
+# Returns the transform of an instance copied on a point from the point
+# attributes in values, following the Houdini instancing rules:
+#
+#   T(-pivot) * S(scale * pscale) * R(rot) * R(orient, or N and up, or v) * T(P + trans)
+#
+# A transform attribute replaces the scale and the rotations.
+#
+def PointInstanceMatrix(values):
+	translate = [0.0, 0.0, 0.0]
+	for name in ('P', 'trans'):
+		if values.has_key(name):
+			for i in xrange(3):
+				translate[i] += values[name][i]
+
+	transform = values.get('transform')
+	if transform is not None and len(transform) == 16:
+		rotation = [list(transform[0:3]), list(transform[4:7]), list(transform[8:11])]
+		for i in xrange(3):
+			translate[i] += transform[12 + i]
+	elif transform is not None and len(transform) == 9:
+		rotation = [list(transform[0:3]), list(transform[3:6]), list(transform[6:9])]
+	else:
+		scale = [1.0, 1.0, 1.0]
+		if values.has_key('scale'):
+			scale = list(values['scale'][:3])
+		if values.has_key('pscale'):
+			scale = [s * values['pscale'][0] for s in scale]
+		rotation = [[scale[0], 0.0, 0.0], [0.0, scale[1], 0.0], [0.0, 0.0, scale[2]]]
+
+		if values.has_key('rot'):
+			rotation = MultiplyRotations(rotation, QuaternionRotation(values['rot']))
+
+		orientation = None
+		if values.has_key('orient'):
+			orientation = QuaternionRotation(values['orient'])
+		elif values.has_key('N'):
+			orientation = LookAtRotation(values['N'], values.get('up', (0.0, 1.0, 0.0)))
+		elif values.has_key('v'):
+			orientation = LookAtRotation(values['v'], values.get('up', (0.0, 1.0, 0.0)))
+		if orientation is not None:
+			rotation = MultiplyRotations(rotation, orientation)
+
+	if values.has_key('pivot'):
+		pivot = values['pivot']
+		for i in xrange(3):
+			translate[i] -= sum([pivot[k] * rotation[k][i] for k in xrange(3)])
+
+	return tuple(rotation[0] + [0.0] + rotation[1] + [0.0] + rotation[2] + [0.0] + translate + [1.0])
+
+
+##
+# Holds the flat attribute arrays of one polygon mesh.
+#
+class MeshData(object):
+
+	def __init__(self):
+		self.pointCount = 0
+		self.primCount = 0
+
+		# x y z of each point.
+		self.positions = array.array('d')
+
+		# Number of vertices of each primitive, and the point each vertex refers to.
+		self.vertexCounts = array.array('i')
+		self.pointRefs = array.array('i')
+
+		# Distinct u v pairs and the pair of each vertex, None if the geometry
+		# has no uv. The indices are the point references for point uvs.
+		self.uvs = None
+		self.uvIndices = None
+
+	def VertexCount(self):
+		return len(self.pointRefs)
+
+	##
+	# Returns a hash of the topology and the attributes, name is the name the
+	# mesh is written with and writerKey what else its file depends on, see
+	# MeshWriter.CacheKey().
+	#
+	def Digest(self, name, writerKey = ''):
+		sha = hashlib.sha1()
+		sha.update(struct.pack('<H', len(name)) + name)
+		if writerKey:
+			sha.update(struct.pack('<H', len(writerKey)) + writerKey)
+		sha.update(struct.pack('<IIIB', self.pointCount, self.primCount, self.VertexCount(), self.uvs is not None))
+		sha.update(LittleEndianBytes(self.positions))
+		sha.update(LittleEndianBytes(self.vertexCounts))
+		sha.update(LittleEndianBytes(self.pointRefs))
+		if self.uvs is not None:
+			sha.update(LittleEndianBytes(self.uvs))
+			sha.update(LittleEndianBytes(self.uvIndices))
+		return sha.hexdigest()
+
+
+##
+# File object compressing what is written to it as gzip or zstd.
+#
+# With several threads the data is cut into COMPRESSED_BLOCK_SIZE blocks which
+# are compressed in parallel and written in order, zlib and zstd release the
+# GIL while compressing.
+#
+class CompressedFile(object):
+
+	def __init__(self, filePath, codec, level, threads):
+		self.codec = codec
+		self.level = level
+
+		self.bytesIn = 0
+		self.bytesOut = 0
+
+		self.blocks = []
+		self.blockBytes = 0
+
+		self.compressor = None
+		self.pool = None
+		self.pending = []
+		if threads > 1:
+			self.pool = multiprocessing.pool.ThreadPool(threads)
+			self.maxPending = 2 * threads
+		else:
+			self.compressor = StreamCompressor(codec, level)
+
+		self.file = open(filePath, 'wb', BUFFER_SIZE)
+
+	def write(self, s):
+		self.bytesIn += len(s)
+
+		if self.pool is None:
+			self.Output(self.compressor.compress(s))
+			return
+
+		self.blocks.append(s)
+		self.blockBytes += len(s)
+		if self.blockBytes >= COMPRESSED_BLOCK_SIZE:
+			self.SubmitBlock()
+
+	def close(self):
+		try:
+			if self.pool is None:
+				self.Output(self.compressor.flush())
+			else:
+				if self.blocks:
+					self.SubmitBlock()
+				while self.pending:
+					self.Output(self.pending.pop(0).get())
+		finally:
+			if self.pool is not None:
+				self.pool.close()
+				self.pool.join()
+				self.pool = None
+			self.file.close()
+
+	def SubmitBlock(self):
+		block = ''.join(self.blocks)
+		self.blocks = []
+		self.blockBytes = 0
+
+		while len(self.pending) >= self.maxPending:
+			self.Output(self.pending.pop(0).get())
+		self.pending.append(self.pool.apply_async(CompressBlock, (self.codec, self.level, block)))
+
+	def Output(self, data):
+		self.file.write(data)
+		self.bytesOut += len(data)
+
+
+##
+# Base of the mesh writers, compression is None or a (codec, level, threads)
+# tuple giving how the files are compressed.
+#
+class MeshWriter(object):
+
+	def __init__(self, compression = None):
+		self.compression = compression
+
+		self.bytesWritten = 0
+		self.compressedBytes = 0
+
+	##
+	# Returns the suffix added to the name of the written files.
+	#
+	def FileSuffix(self):
+		if self.compression is None:
+			return ''
+		return COMPRESSED_SUFFIXES[self.compression[0]]
+
+	##
+	# Returns what the written files depend on besides the mesh, so that a
+	# file written another way is not taken from the geometry cache.
+	#
+	def CacheKey(self):
+		codec = None
+		if self.compression is not None:
+			codec = self.compression[0]
+		return '%s %s' % (self.__class__.__name__, codec)
+
+	def Open(self, filePath, mode):
+		self.bytesWritten = 0
+		self.compressedBytes = 0
+
+		if self.compression is None:
+			return open(filePath, mode, BUFFER_SIZE)
+		return CompressedFile(filePath, *self.compression)
+
+	def Close(self, file):
+		file.close()
+
+		if self.compression is None:
+			self.compressedBytes = self.bytesWritten
+		else:
+			self.compressedBytes = file.bytesOut
+
+
+##
+# Writes a MeshData as Wavefront OBJ.
+#
+# Lines are formatted CHUNK_SIZE at a time through one repeated format string
+# and go to the disk through a BUFFER_SIZE buffer.
+#
+class WavefrontObjWriter(MeshWriter):
+
+	def __init__(self, compression = None, positionPrecision = 10, uvPrecision = 10):
+		super(WavefrontObjWriter, self).__init__(compression)
+
+		# Record formats, e.g. 'v %.10f %.10f %.10f\n'.
+		self.positionFormat = 'v %s %s %s\n' % ((FloatFormat(positionPrecision),) * 3)
+		self.uvFormat = 'vt %s %s\n' % ((FloatFormat(uvPrecision),) * 2)
+
+	def CacheKey(self):
+		return '%s %r %r' % (super(WavefrontObjWriter, self).CacheKey(), self.positionFormat, self.uvFormat)
+
+	def Write(self, objFilePath, sopPath, mesh):
+		file = self.Open(objFilePath, 'w')
+		try:
+			formattedSopPath = sopPath.replace('/', '__')
+			self.WriteString(file, '# %s\n' % sopPath)
+			self.WriteString(file, 'g %s\n' % formattedSopPath)
+			self.WriteString(file, '# %d vertices, %d primitives.\n' % (mesh.pointCount, mesh.primCount))
+
+			# v
+			self.WriteRecords(file, self.positionFormat, 3, mesh.positions)
+
+			# vt
+			if mesh.uvs is not None:
+				self.WriteRecords(file, self.uvFormat, 2, mesh.uvs)
+
+			# f
+			self.WriteFaces(file, mesh)
+		finally:
+			self.Close(file)
+
+		return self.bytesWritten
+
+	def WriteString(self, file, s):
+		file.write(s)
+		self.bytesWritten += len(s)
+
+	def WriteRecords(self, file, recordFormat, width, values):
+		recordCount = len(values) // width
+		chunkFormat = recordFormat * CHUNK_SIZE
+		for start in xrange(0, recordCount, CHUNK_SIZE):
+			count = min(CHUNK_SIZE, recordCount - start)
+			if count != CHUNK_SIZE:
+				chunkFormat = recordFormat * count
+			self.WriteString(file, chunkFormat % tuple(values[start * width:(start + count) * width]))
+
+	def WriteFaces(self, file, mesh):
+		indices = ReversedFaceIndices(mesh)
+		hasUV = mesh.uvs is not None
+		if hasUV:
+			uvIndices = ReversedFaceIndices(mesh, 1, mesh.uvIndices)
+
+		# One format per face size, e.g. 'f %d/%d %d/%d %d/%d\n'.
+		faceFormats = {}
+		vertexFormat = hasUV and ' %d/%d' or ' %d'
+
+		vertexCounts = mesh.vertexCounts
+		vertexStart = 0
+		for primStart in xrange(0, mesh.primCount, CHUNK_SIZE):
+			chunkCounts = vertexCounts[primStart:primStart + CHUNK_SIZE]
+
+			formats = []
+			for vertexCount in chunkCounts:
+				faceFormat = faceFormats.get(vertexCount)
+				if faceFormat is None:
+					faceFormat = 'f' + vertexFormat * vertexCount + '\n'
+					faceFormats[vertexCount] = faceFormat
+				formats.append(faceFormat)
+
+			vertexEnd = vertexStart + sum(chunkCounts)
+			refs = indices[vertexStart:vertexEnd].tolist()
+
+			if hasUV:
+				values = [0] * (2 * len(refs))
+				values[0::2] = refs
+				values[1::2] = uvIndices[vertexStart:vertexEnd].tolist()
+			else:
+				values = refs
+
+			self.WriteString(file, ''.join(formats) % tuple(values))
+			vertexStart = vertexEnd
+
+
+##
+# Writes a MeshData in the native binary mesh format of appleseed, version 1
+# which is not compressed.
+#
+# Faces are written with the same reversed winding as the OBJ files. Every
+# face refers to the single material slot, the vertex normals are left out.
+#
+class BinaryMeshWriter(MeshWriter):
+
+	SIGNATURE = 'BINARYMESH'
+	VERSION   = 1
+
+	MATERIAL_SLOT = 'default'
+
+	def __init__(self, compression = None):
+		super(BinaryMeshWriter, self).__init__(compression)
+
+	def Write(self, binaryMeshFilePath, sopPath, mesh):
+		file = self.Open(binaryMeshFilePath, 'wb')
+		try:
+			self.WriteBytes(file, BinaryMeshWriter.SIGNATURE)
+			self.WriteBytes(file, struct.pack('<H', BinaryMeshWriter.VERSION))
+
+			# The name of the mesh, objects refer to it as <object name>.<mesh name>.
+			self.WriteString(file, sopPath.replace('/', '__'))
+
+			# Vertices.
+			self.WriteBytes(file, struct.pack('<I', mesh.pointCount))
+			self.WriteBytes(file, LittleEndianBytes(mesh.positions))
+
+			# Vertex normals.
+			self.WriteBytes(file, struct.pack('<I', 0))
+
+			# Texture coordinates.
+			if mesh.uvs is not None:
+				self.WriteBytes(file, struct.pack('<I', len(mesh.uvs) // 2))
+				self.WriteBytes(file, LittleEndianBytes(mesh.uvs))
+			else:
+				self.WriteBytes(file, struct.pack('<I', 0))
+
+			# Material slots.
+			self.WriteBytes(file, struct.pack('<H', 1))
+			self.WriteString(file, BinaryMeshWriter.MATERIAL_SLOT)
+
+			# Faces.
+			self.WriteBytes(file, struct.pack('<I', mesh.primCount))
+			self.WriteFaces(file, mesh)
+		finally:
+			self.Close(file)
+
+		return self.bytesWritten
+
+	def WriteBytes(self, file, s):
+		file.write(s)
+		self.bytesWritten += len(s)
+
+	def WriteString(self, file, s):
+		self.WriteBytes(file, struct.pack('<H', len(s)) + s)
+
+	def WriteFaces(self, file, mesh):
+		if mesh.primCount == 0:
+			return
+
+		indices = ReversedFaceIndices(mesh, 0)
+		hasUV = mesh.uvs is not None
+		texIndices = None
+		if hasUV:
+			texIndices = ReversedFaceIndices(mesh, 0, mesh.uvIndices)
+
+		vertexCounts = mesh.vertexCounts
+		if min(vertexCounts) == max(vertexCounts):
+			self.WriteUniformFaces(file, mesh, vertexCounts[0], indices, texIndices)
+			return
+
+		# Each face is <count> <vertices> <normals> <texture coordinates> <material>.
+		faceFormats = {}
+		zeros = [0] * max(vertexCounts)
+
+		vertexStart = 0
+		for primStart in xrange(0, mesh.primCount, CHUNK_SIZE):
+			formats = ['<']
+			values = []
+			append = values.append
+			extend = values.extend
+			for vertexCount in vertexCounts[primStart:primStart + CHUNK_SIZE]:
+				faceFormat = faceFormats.get(vertexCount)
+				if faceFormat is None:
+					faceFormat = 'H%dI%dI%dIH' % (vertexCount, vertexCount, vertexCount)
+					faceFormats[vertexCount] = faceFormat
+				formats.append(faceFormat)
+
+				vertexEnd = vertexStart + vertexCount
+				append(vertexCount)
+				extend(indices[vertexStart:vertexEnd])
+				extend(zeros[:vertexCount])
+				if hasUV:
+					extend(texIndices[vertexStart:vertexEnd])
+				else:
+					extend(zeros[:vertexCount])
+				append(0)
+				vertexStart = vertexEnd
+
+			self.WriteBytes(file, struct.pack(''.join(formats), *values))
+
+	##
+	# Faces of the same size are laid out as 32 bit words: the material of a
+	# face followed by the count of the next one is the word <count> << 16.
+	#
+	def WriteUniformFaces(self, file, mesh, vertexCount, indices, texIndices):
+		stride = 3 * vertexCount + 1
+		head = struct.pack('<H', vertexCount)
+		tail = struct.pack('<H', 0)
+
+		for primStart in xrange(0, mesh.primCount, CHUNK_SIZE):
+			primEnd = min(primStart + CHUNK_SIZE, mesh.primCount)
+			vertexStart = primStart * vertexCount
+			vertexEnd = primEnd * vertexCount
+
+			if numpy is not None:
+				words = numpy.zeros((primEnd - primStart, stride), dtype = '<u4')
+				words[:, :vertexCount] = indices[vertexStart:vertexEnd].reshape(-1, vertexCount)
+				if texIndices is not None:
+					words[:, 2 * vertexCount:3 * vertexCount] = texIndices[vertexStart:vertexEnd].reshape(-1, vertexCount)
+				words[:, -1] = vertexCount << 16
+				words = words.tostring()
+			else:
+				words = array.array('i', [0]) * ((primEnd - primStart) * stride)
+				for j in xrange(vertexCount):
+					words[j::stride] = indices[vertexStart + j:vertexEnd:vertexCount]
+					if texIndices is not None:
+						words[2 * vertexCount + j::stride] = texIndices[vertexStart + j:vertexEnd:vertexCount]
+				words[stride - 1::stride] = array.array('i', [vertexCount << 16]) * (primEnd - primStart)
+				words = LittleEndianBytes(words)
+
+			self.WriteBytes(file, head + words[:-4] + tail)
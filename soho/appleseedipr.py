@@ -0,0 +1,278 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Interactive session pushing the changes of the scene to a running renderer.
+#
+# After a full export, the session watches the nodes the project was resolved
+# from. A change resolves again the entities of the changed node only and
+# sends them to the renderer as XML fragments, one JSON message per line over
+# a local socket:
+#
+#   {"type": "project", "path": <project file>, "time": <seconds>}
+#   {"type": "update", "entities": [{"kind": <tag>, "name": <name>, "xml": <xml>}, ...], "time": <seconds>}
+#   {"type": "remove", "entities": [{"kind": <tag>, "name": <name>}, ...], "time": <seconds>}
+#
+# time is when the change happened, so that the renderer can tell the latency.
+# The session outlives the soho script, it is kept by this module until the
+# next export replaces it.
+#
+
+import json
+import socket
+import sys
+import time
+
+try:
+	import hou
+except ImportError:
+	hou = None
+
+##
+# Message types.
+#
+PROJECT = 'project'
+UPDATE  = 'update'
+REMOVE  = 'remove'
+
+DEFAULT_PORT = 9870
+
+CONNECT_TIMEOUT = 5.0
+
+##
+# Global variables.
+#
+theSession = None
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('appleseed: ipr: %s\n' % message)
+
+##
+# Returns (host, port) of an address written host:port.
+#
+def ParseAddress(address):
+	(host, separator, port) = address.rpartition(':')
+	if not separator:
+		return (address or 'localhost', DEFAULT_PORT)
+	return (host or 'localhost', int(port))
+
+##
+# Stops the running session if any, then starts one sending the changes of
+# scene to the renderer listening at address. Returns the session, None if
+# the renderer can not be reached.
+#
+def Start(address, scene, projectFilePath):
+	global theSession
+
+	Stop()
+
+	try:
+		connection = Connection(ParseAddress(address))
+	except (socket.error, ValueError), e:
+		Log('can not connect to %s: %s' % (address, e))
+		return None
+
+	theSession = IprSession(connection, scene)
+	theSession.Send(PROJECT, path = projectFilePath)
+	theSession.WatchScene()
+
+	Log('watching %d nodes, sending changes to %s' % (len(theSession.watched), address))
+	return theSession
+
+def Stop():
+	global theSession
+	if theSession is not None:
+		theSession.Close()
+		theSession = None
+
+
+##
+# Newline delimited JSON messages over a socket.
+#
+class Connection(object):
+
+	def __init__(self, address):
+		self.socket = socket.create_connection(address, CONNECT_TIMEOUT)
+		self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	def Send(self, message):
+		self.socket.sendall(json.dumps(message) + '\n')
+
+	def Close(self):
+		try:
+			self.socket.close()
+		except socket.error:
+			pass
+
+
+##
+# Watches the nodes of an IprScene and sends the entities resolved again from
+# the changed ones.
+#
+# The scene tells the nodes to watch, as (kind, path), and resolves a node of
+# a kind to a list of (tag, name, xml). Nodes are also watched through the
+# objects they are parented to, since moving a parent moves them. Changes are
+# collected and flushed once per iteration of the event loop of Houdini, so
+# that dragging a handle sends one update per redraw; without an event loop
+# they are flushed at once.
+#
+class IprSession(object):
+
+	EVENT_TYPES = ('ParmTupleChanged', 'BeingDeleted')
+
+	def __init__(self, connection, scene):
+		self.connection = connection
+		self.scene = scene
+
+		# Callbacks registered per path, and the scene nodes changing with it.
+		self.watched = {}
+		self.affected = {}
+
+		# Scene nodes changed since the last flush, and when the first one
+		# changed.
+		self.pending = []
+		self.pendingSince = None
+		self.scheduled = False
+
+		self.updates = 0
+		self.entities = 0
+
+	def WatchScene(self):
+		for (kind, path) in self.scene.Nodes():
+			self.Watch(kind, path)
+
+	def Watch(self, kind, path):
+		node = hou.node(path)
+		if node is None:
+			return
+
+		nodes = [node]
+		inputAncestors = getattr(node, 'inputAncestors', None)
+		if inputAncestors is not None:
+			nodes.extend(inputAncestors())
+
+		for watchedNode in nodes:
+			watchedPath = watchedNode.path()
+			self.affected.setdefault(watchedPath, []).append((kind, path))
+			if self.watched.has_key(watchedPath):
+				continue
+
+			callback = self.Callback(watchedPath)
+			try:
+				watchedNode.addEventCallback(self.EventTypes(), callback)
+			except (AttributeError, hou.Error):
+				continue
+			self.watched[watchedPath] = (watchedNode, callback)
+
+	def Callback(self, path):
+		def OnNodeEvent(event_type, **kwargs):
+			self.OnNodeEvent(path, event_type)
+		return OnNodeEvent
+
+	def EventTypes(self):
+		return tuple([getattr(hou.nodeEventType, name) for name in IprSession.EVENT_TYPES])
+
+	def OnNodeEvent(self, path, eventType):
+		if self.connection is None:
+			return
+
+		if eventType == hou.nodeEventType.BeingDeleted:
+			self.watched.pop(path, None)
+			removed = [(kind, nodePath) for (kind, nodePath) in self.affected.pop(path, ()) if nodePath == path]
+			entities = [{'kind' : tag, 'name' : name} for (tag, name) in self.scene.Remove(removed)]
+			if entities:
+				self.Send(REMOVE, entities = entities)
+			return
+
+		if self.pendingSince is None:
+			self.pendingSince = time.time()
+		for change in self.affected.get(path, ()):
+			if change not in self.pending:
+				self.pending.append(change)
+
+		self.Schedule()
+
+	def Schedule(self):
+		if self.scheduled:
+			return
+
+		ui = getattr(hou, 'ui', None)
+		if ui is None or not getattr(hou, 'isUIAvailable', lambda: False)():
+			self.Flush()
+			return
+
+		def FlushOnce():
+			ui.removeEventLoopCallback(FlushOnce)
+			self.Flush()
+
+		self.scheduled = True
+		ui.addEventLoopCallback(FlushOnce)
+
+	##
+	# Resolves the pending nodes again and sends their entities.
+	#
+	def Flush(self):
+		self.scheduled = False
+
+		(pending, since) = (self.pending, self.pendingSince)
+		self.pending = []
+		self.pendingSince = None
+		if not pending or self.connection is None:
+			return
+
+		entities = []
+		for (kind, path) in pending:
+			for (tag, name, xml) in self.scene.Update(kind, path):
+				entities.append({'kind' : tag, 'name' : name, 'xml' : xml})
+
+		if entities:
+			self.Send(UPDATE, since, entities = entities)
+			self.updates += 1
+			self.entities += len(entities)
+
+	def Send(self, messageType, since = None, **message):
+		if self.connection is None:
+			return
+
+		message['type'] = messageType
+		message['time'] = since or time.time()
+		try:
+			self.connection.Send(message)
+		except socket.error, e:
+			Log('connection lost: %s' % e)
+			self.Close()
+
+	def Close(self):
+		for (node, callback) in self.watched.itervalues():
+			try:
+				node.removeEventCallback(self.EventTypes(), callback)
+			except hou.Error:
+				pass
+		self.watched = {}
+		self.affected = {}
+
+		if self.connection is not None:
+			self.connection.Close()
+			self.connection = None
+
+		Log('%d updates, %d entities sent' % (self.updates, self.entities))
@@ -0,0 +1,345 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Runs appleseed.cli on an exported project and follows its progress.
+#
+# The renderer runs as a subprocess, its output is read by a thread so that
+# the caller is never blocked: Houdini polls the render from its event loop,
+# a batch export waits for it. Nothing here depends on Houdini, the launcher
+# is tested against tools/fakecli.py.
+#
+
+import optparse
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+import appleseedcache
+import appleseedgeo
+
+##
+# Progress written by appleseed.cli, the percentage of the frame done from
+# its "rendering, 12.5% done" lines and the tiles rendered out of the tiles
+# of the frame.
+#
+PERCENT_PATTERN = re.compile(r'\brendering, (\d+(?:\.\d+)?)% done\s*$')
+TILE_PATTERN    = re.compile(r'tile\s+(\d+)\s*/\s*(\d+)')
+
+# Lines of the output of the renderer kept for the log of a failed render.
+LOG_LINES = 200
+
+# Seconds given to the renderer to exit once cancelled, before it is killed.
+CANCEL_TIMEOUT = 5.0
+
+# Extension of the assembly files a project refers to.
+ASSEMBLY_FILE_EXTENSION = '.appleseed'
+
+##
+# Global variables.
+#
+
+# Names of the files referred to by the projects and assembly files read, by
+# path, with the size and the modification time they had then.
+theReferencedFileNames = {}
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('appleseed: launcher: %s\n' % message)
+
+
+##
+# Returns the names of the files a project or an assembly file refers to,
+# read again only once its size or modification time changed.
+#
+def ReferencedFileNames(filePath):
+	stat = os.stat(filePath)
+	stamp = (stat.st_size, stat.st_mtime)
+
+	entry = theReferencedFileNames.get(filePath)
+	if entry is not None and entry[0] == stamp:
+		return entry[1]
+
+	file = open(filePath, 'r')
+	try:
+		text = file.read()
+	finally:
+		file.close()
+
+	fileNames = re.findall(r'<parameter name="filename" value="([^"]*)"', text)
+	theReferencedFileNames[filePath] = (stamp, fileNames)
+	return fileNames
+
+##
+# Returns the mesh files a project refers to, and the assembly files with the
+# meshes these refer to in turn. Their names are relative to the directory of
+# the project, in an assembly file too.
+#
+def ProjectMeshFiles(projectFilePath, projectDir = None):
+	if projectDir is None:
+		projectDir = os.path.dirname(os.path.abspath(projectFilePath))
+
+	filePaths = []
+	for fileName in ReferencedFileNames(projectFilePath):
+		filePath = os.path.join(projectDir, fileName)
+		filePaths.append(filePath)
+		if fileName.endswith(ASSEMBLY_FILE_EXTENSION) and os.path.exists(filePath):
+			filePaths.extend(ProjectMeshFiles(filePath, projectDir))
+
+	return filePaths
+
+##
+# Decompresses the compressed meshes a project refers to unless they are
+# already next to their compressed file, expanded since it was written;
+# appleseed only reads plain files.
+#
+def ExpandProjectMeshes(projectFilePath):
+	expandedFilePaths = []
+	for filePath in ProjectMeshFiles(projectFilePath):
+		for suffix in appleseedgeo.COMPRESSED_SUFFIXES.itervalues():
+			compressedFilePath = filePath + suffix
+			if not os.path.exists(compressedFilePath):
+				continue
+
+			if not os.path.exists(filePath) or os.path.getmtime(compressedFilePath) > os.path.getmtime(filePath):
+				expandedFilePaths.append(appleseedgeo.ExpandFile(compressedFilePath))
+			break
+
+	TrackExpandedFiles(expandedFilePaths)
+	return len(expandedFilePaths)
+
+##
+# Records the files expanded into the geometry cache in its index, so that
+# they count in its size and are evicted like the meshes they come from.
+#
+def TrackExpandedFiles(filePaths):
+	fileNames = {}
+	for filePath in filePaths:
+		fileNames.setdefault(os.path.dirname(filePath), []).append(os.path.basename(filePath))
+
+	for (directory, names) in sorted(fileNames.iteritems()):
+		if not os.path.exists(os.path.join(directory, appleseedcache.ContentStore.INDEX_FILE_NAME)):
+			continue
+
+		store = appleseedcache.ContentStore(directory, 0)
+		for name in names:
+			store.Insert(name)
+		store.Save()
+
+##
+# Returns the command line rendering a project into outputFilePath. cli is
+# the path of appleseed.cli, or a command line running it.
+#
+def Command(cli, projectFilePath, outputFilePath, arguments = ()):
+	return shlex.split(cli, posix = os.name != 'nt') + [projectFilePath, '--output', outputFilePath] + list(arguments)
+
+##
+# Starts a render and returns it. The output of the renderer is appended to
+# logFilePath if given.
+#
+def Launch(cli, projectFilePath, outputFilePath, arguments = (), logFilePath = None):
+	ExpandProjectMeshes(projectFilePath)
+
+	render = Render(Command(cli, projectFilePath, outputFilePath, arguments), os.path.dirname(os.path.abspath(projectFilePath)), logFilePath)
+	render.Start()
+	return render
+
+def FormatDuration(seconds):
+	seconds = int(round(seconds))
+	return '%d:%02d:%02d' % (seconds / 3600, seconds / 60 % 60, seconds % 60)
+
+
+##
+# A renderer subprocess and its progress.
+#
+class Render(object):
+
+	def __init__(self, command, workingDir = None, logFilePath = None):
+		self.command = command
+		self.workingDir = workingDir
+		self.logFilePath = logFilePath
+
+		self.process = None
+		self.reader = None
+		self.logFile = None
+		self.lock = threading.Lock()
+
+		self.startTime = None
+		self.endTime = None
+		self.percent = 0.0
+		self.tiles = None
+		self.lines = []
+		self.cancelled = False
+
+	def Start(self):
+		self.startTime = time.time()
+		if self.logFilePath is not None:
+			self.logFile = open(self.logFilePath, 'a')
+			self.logFile.write('%s %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), subprocess.list2cmdline(self.command)))
+			self.logFile.flush()
+
+		devNull = open(os.devnull, 'r')
+		try:
+			self.process = subprocess.Popen(self.command, cwd = self.workingDir, stdin = devNull, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, bufsize = 1, universal_newlines = True)
+		except:
+			self.CloseLog()
+			raise
+		finally:
+			devNull.close()
+
+		self.reader = threading.Thread(target = self.Read)
+		self.reader.setDaemon(True)
+		self.reader.start()
+
+	def Read(self):
+		for line in iter(self.process.stdout.readline, ''):
+			if self.logFile is not None:
+				self.logFile.write(line)
+				self.logFile.flush()
+			self.Parse(line.rstrip('\r\n'))
+		self.process.stdout.close()
+		self.CloseLog()
+
+	def CloseLog(self):
+		if self.logFile is not None:
+			self.logFile.close()
+			self.logFile = None
+
+	##
+	# Updates the progress from a line of the output of the renderer.
+	#
+	def Parse(self, line):
+		self.lock.acquire()
+		try:
+			self.lines.append(line)
+			del self.lines[:-LOG_LINES]
+
+			tile = TILE_PATTERN.search(line)
+			if tile is not None:
+				self.tiles = (int(tile.group(1)), int(tile.group(2)))
+
+			percent = PERCENT_PATTERN.search(line)
+			if percent is not None:
+				self.percent = min(float(percent.group(1)), 100.0)
+			elif tile is not None and self.tiles[1] > 0:
+				self.percent = 100.0 * self.tiles[0] / self.tiles[1]
+		finally:
+			self.lock.release()
+
+	##
+	# Returns the exit code of the renderer, None while it runs.
+	#
+	def Poll(self):
+		returnCode = self.process.poll()
+		if returnCode is not None and self.endTime is None:
+			self.reader.join()
+			self.endTime = time.time()
+		return returnCode
+
+	def Wait(self, timeout = None):
+		deadline = timeout is not None and time.time() + timeout
+		while self.Poll() is None:
+			if deadline and time.time() >= deadline:
+				return None
+			time.sleep(0.05)
+		return self.process.returncode
+
+	def Cancel(self):
+		if self.Poll() is not None:
+			return
+
+		self.cancelled = True
+		try:
+			self.process.terminate()
+		except OSError:
+			return
+
+		if self.Wait(CANCEL_TIMEOUT) is None:
+			try:
+				self.process.kill()
+			except OSError:
+				pass
+			self.Wait()
+
+	def Elapsed(self):
+		return (self.endTime or time.time()) - self.startTime
+
+	##
+	# Returns the seconds left estimated from the progress so far, None until
+	# there is some.
+	#
+	def Eta(self):
+		self.lock.acquire()
+		try:
+			percent = self.percent
+		finally:
+			self.lock.release()
+
+		if percent <= 0.0:
+			return None
+		return self.Elapsed() * (100.0 - percent) / percent
+
+	def Lines(self):
+		self.lock.acquire()
+		try:
+			return list(self.lines)
+		finally:
+			self.lock.release()
+
+	def Status(self):
+		returnCode = self.Poll()
+		if returnCode is not None:
+			if self.cancelled:
+				return 'cancelled after %s' % FormatDuration(self.Elapsed())
+			if returnCode != 0:
+				return 'failed with code %d after %s' % (returnCode, FormatDuration(self.Elapsed()))
+			return 'done in %s' % FormatDuration(self.Elapsed())
+
+		status = '%.1f%% done' % self.percent
+		if self.tiles is not None:
+			status += ', tile %d/%d' % self.tiles
+		eta = self.Eta()
+		if eta is not None:
+			status += ', %s left' % FormatDuration(eta)
+		return status
+
+##
+# Expands the compressed meshes of projects, so that appleseed.cli or
+# appleseed.studio can open them without the launcher.
+#
+def Main(arguments):
+	parser = optparse.OptionParser(usage = '%prog project...', description = 'Expands the compressed meshes of the projects.')
+	(options, projectFilePaths) = parser.parse_args(arguments)
+	if not projectFilePaths:
+		parser.error('expected project files')
+
+	for projectFilePath in projectFilePaths:
+		Log('%s: %d meshes expanded' % (projectFilePath, ExpandProjectMeshes(projectFilePath)))
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,247 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Profile of an export by phase, written as JSON next to the project.
+#
+# A phase is timed from Begin to End, phases nest and the time of a phase
+# less the time of the phases within it is its self time. Counters, such as
+# the parameters evaluated or the bytes written, are sampled at both ends so
+# that every phase gets what it counted. The objects are also profiled one
+# by one. The peak memory is traced by tracemalloc where available, otherwise
+# it is the peak resident size of the process.
+#
+# A disabled profiler does nothing, so that the exporter always calls it.
+#
+
+import json
+import sys
+import time
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+# Objects listed in the report, the slowest first.
+MAX_OBJECTS = 100
+
+# Phases listed in the log, the slowest first.
+MAX_LOGGED_PHASES = 12
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('appleseed: profile: %s\n' % message)
+
+##
+# Returns the peak memory of the process in bytes and how it was measured,
+# (None, None) if it can not be.
+#
+def PeakMemory(tracing):
+	if tracing:
+		return (tracemalloc.get_traced_memory()[1], 'tracemalloc')
+
+	if resource is not None:
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		if sys.platform != 'darwin':
+			peak *= 1024
+		return (peak, 'rusage')
+
+	return (None, None)
+
+
+##
+# Counts the bytes written to a stream.
+#
+class CountingStream(object):
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.bytesWritten = 0
+
+	def write(self, data):
+		self.bytesWritten += len(data)
+		self.stream.write(data)
+
+	def flush(self):
+		self.stream.flush()
+
+
+##
+# Times the phases of an export and what they counted.
+#
+class Profiler(object):
+
+	##
+	# counters are callables returning running totals, by name.
+	#
+	def __init__(self, enabled = True, counters = None):
+		self.enabled = enabled
+		self.counters = counters or {}
+
+		self.startTime = time.time()
+		self.phases = {}
+		self.objects = {}
+		self.streams = []
+
+		# Phases begun, as [name, start time, counters, time of the phases
+		# within].
+		self.stack = []
+
+		self.tracing = False
+		if enabled and tracemalloc is not None and not tracemalloc.is_tracing():
+			tracemalloc.start()
+			self.tracing = True
+
+	def Sample(self):
+		return dict([(name, counter()) for (name, counter) in self.counters.iteritems()])
+
+	def Phase(self, name):
+		phase = self.phases.get(name)
+		if phase is None:
+			phase = {'seconds' : 0.0, 'self_seconds' : 0.0, 'calls' : 0}
+			for counterName in self.counters.iterkeys():
+				phase[counterName] = 0
+			self.phases[name] = phase
+		return phase
+
+	def Begin(self, name):
+		if self.enabled:
+			self.stack.append([name, time.time(), self.Sample(), 0.0])
+
+	##
+	# Ends the phase begun last. Returns its time and what it counted.
+	#
+	def End(self):
+		if not self.enabled:
+			return (0.0, {})
+
+		(name, startTime, startCounters, innerSeconds) = self.stack.pop()
+		seconds = time.time() - startTime
+		counted = self.Sample()
+		for (counterName, value) in counted.iteritems():
+			counted[counterName] = value - startCounters[counterName]
+
+		phase = self.Phase(name)
+		phase['seconds'] += seconds
+		phase['self_seconds'] += seconds - innerSeconds
+		phase['calls'] += 1
+		for (counterName, value) in counted.iteritems():
+			phase[counterName] += value
+
+		if self.stack:
+			self.stack[-1][3] += seconds
+
+		return (seconds, counted)
+
+	##
+	# Adds a phase timed before the profiler was created.
+	#
+	def Record(self, name, seconds):
+		if self.enabled:
+			phase = self.Phase(name)
+			phase['seconds'] += seconds
+			phase['self_seconds'] += seconds
+			phase['calls'] += 1
+
+	def BeginObject(self):
+		self.Begin('objects')
+
+	def EndObject(self, name):
+		(seconds, counted) = self.End()
+		if not self.enabled:
+			return
+
+		entry = self.objects.setdefault(name, {'name' : name, 'seconds' : 0.0})
+		entry['seconds'] += seconds
+		for (counterName, value) in counted.iteritems():
+			entry[counterName] = entry.get(counterName, 0) + value
+
+	##
+	# Returns stream, counting the bytes written to it if enabled.
+	#
+	def Stream(self, stream):
+		if not self.enabled:
+			return stream
+
+		countingStream = CountingStream(stream)
+		self.streams.append(countingStream)
+		return countingStream
+
+	def StreamBytes(self):
+		return sum([stream.bytesWritten for stream in self.streams])
+
+	def Report(self):
+		(peakMemory, peakMemorySource) = PeakMemory(self.tracing)
+		objects = sorted(self.objects.itervalues(), key = lambda entry: -entry['seconds'])
+
+		return {
+			'seconds'            : time.time() - self.startTime,
+			'peak_memory'        : peakMemory,
+			'peak_memory_source' : peakMemorySource,
+			'counters'           : self.Sample(),
+			'phases'             : self.phases,
+			'object_count'       : len(objects),
+			'objects'            : objects[:MAX_OBJECTS],
+		}
+
+	##
+	# Writes the report to filePath and, if log is set, its summary to the
+	# log. Stops tracing the memory.
+	#
+	def Finish(self, filePath, log = False):
+		if not self.enabled:
+			return
+
+		report = self.Report()
+		if self.tracing:
+			tracemalloc.stop()
+			self.tracing = False
+		self.enabled = False
+
+		file = open(filePath, 'w')
+		try:
+			json.dump(report, file, indent = 1, sort_keys = True)
+		finally:
+			file.close()
+
+		if log:
+			self.LogReport(report)
+		Log('wrote %s' % filePath)
+
+	def LogReport(self, report):
+		summary = '%.3f s' % report['seconds']
+		if report['peak_memory'] is not None:
+			summary += ', %.1f MiB peak memory' % (report['peak_memory'] / float(1 << 20))
+		Log(summary)
+
+		phases = sorted(report['phases'].iteritems(), key = lambda (name, phase): -phase['seconds'])
+		for (name, phase) in phases[:MAX_LOGGED_PHASES]:
+			Log('%-16s %9.3f s %9.3f s self %7d calls' % (name, phase['seconds'], phase['self_seconds'], phase['calls']))
+
+		for entry in report['objects'][:5]:
+			Log('%-16s %9.3f s' % (entry['name'], entry['seconds']))
@@ -0,0 +1,1025 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Shading entities of appleseed: materials, BSDFs, EDFs, surface shaders and
+# colors, how they are resolved from the appleseed SHOPs, the entities they
+# refer to and how they are written as XML.
+#
+# They are shared by appleseed.py and the SHOP clerk, so that a SHOP is
+# resolved the same way and once within a session, through the shading graph
+# of appleseedshading, whichever asks for it first.
+#
+
+import copy
+
+import appleseedshading
+
+try:
+	import hou
+except ImportError:
+	hou = None
+
+try:
+	import soho
+except ImportError:
+	soho = None
+
+Attr = appleseedshading.Attr
+
+SCALAR      = appleseedshading.SCALAR
+SCALAR_ATTR = appleseedshading.SCALAR_ATTR
+TUPLE       = appleseedshading.TUPLE
+TUPLE_ATTR  = appleseedshading.TUPLE_ATTR
+
+##
+# Global variables.
+#
+
+# Format of the floats written, see SetFloatFormat().
+theFloatFormat = '%f'
+
+##
+# Global functions.
+#
+def SetFloatFormat(floatFormat):
+	global theFloatFormat
+	theFloatFormat = floatFormat
+
+def Error(message):
+	if soho is not None:
+		soho.error(message)
+	raise ShadingError(message)
+
+##
+# Formatters of the values written into the XML.
+#
+def FormatValue(value):
+	if isinstance(value, Attr):
+		value = value.value[0]
+	return str(value)
+
+def FormatFloats(value):
+	if isinstance(value, Attr):
+		value = value.value[0]
+	if not isinstance(value, (tuple, list)):
+		value = (value,)
+	return ((theFloatFormat + ' ') * len(value))[:-1] % tuple(value)
+
+def FormatInts(value):
+	if isinstance(value, Attr):
+		value = value.value[0]
+	return ('%d ' * len(value))[:-1] % tuple(value)
+
+def FormatMatrix(data):
+	return ((theFloatFormat + ' ') * 16) % tuple(data)
+
+def EscapeXml(text):
+	if '&' in text:
+		text = text.replace('&', '&amp;')
+	if '<' in text:
+		text = text.replace('<', '&lt;')
+	if '>' in text:
+		text = text.replace('>', '&gt;')
+	if '"' in text:
+		text = text.replace('"', '&quot;')
+	return text
+
+
+##
+# Returns the entity resolved from the node at nodePath, its parameters
+# evaluated at the time of moments, which is not the current time within a
+# sequence. The attributes are memoized by the shading graph across frames
+# and exports, the node is only resolved again once its parameters changed or
+# at another time if they depend on time.
+#
+def ResolveShopNode(entityClass, nodePath, moments):
+	shadingGraph = appleseedshading.TheGraph()
+
+	entity = entityClass()
+	attrs = shadingGraph.Lookup(nodePath, entityClass.__name__, moments[0])
+	if attrs is not None:
+		entity.attrs = dict(attrs)
+		return entity
+
+	shopNode = hou.node(nodePath)
+	entity.Resolve(shopNode, moments)
+	shadingGraph.Store(shopNode, entityClass.__name__, entity.attrs, moments[0])
+
+	return entity
+
+##
+# Adds to tables the entity of the node at path and the entities it refers
+# to, directly or not, which are not there yet. An entity is added before the
+# entities it refers to, these in the order of its references. resolve
+# returns the entity of a node from its class and path.
+#
+# The network is walked without recursion, chains of BSDF mixes are as deep
+# as they need.
+#
+def ResolveNetwork(tables, entityClass, path, resolve):
+	pending = [(entityClass, path)]
+	while pending:
+		(entityClass, path) = pending.pop()
+		table = getattr(tables, entityClass.TABLE)
+		if table.has_key(path):
+			continue
+
+		entity = resolve(entityClass, path)
+		table[path] = entity
+
+		references = entity.References()
+		references.reverse()
+		pending.extend(references)
+
+##
+# Drops from tables the shading entities not yet written that neither a
+# material nor one of referrers, e.g. the lights, refers to, directly or not.
+# The entities already written stay, the ones they refer to were written with
+# them.
+#
+# Returns the number of entities dropped.
+#
+def PruneUnreferenced(tables, referrers = ()):
+	pending = [(Material, name) for name in tables.materials.unflushed]
+	for referrer in referrers:
+		pending.extend(referrer.References())
+
+	referenced = set()
+	while pending:
+		(entityClass, name) = pending.pop()
+		key = (entityClass.TABLE, name)
+		if key in referenced:
+			continue
+		referenced.add(key)
+
+		entity = getattr(tables, entityClass.TABLE).get(name)
+		if entity is not None:
+			pending.extend(entity.References())
+
+	pruned = 0
+	for (tableName, writerName) in TABLES:
+		if tableName == Material.TABLE:
+			continue
+
+		table = getattr(tables, tableName)
+		names = set([name for name in table.unflushed if (tableName, name) not in referenced])
+		if names:
+			table.Discard(names)
+			pruned += len(names)
+
+	return pruned
+
+
+##
+# Returns value made hashable, lists and attributes as tuples.
+#
+def Freeze(value):
+	if isinstance(value, Attr):
+		return (Attr, Freeze(value.value))
+	if isinstance(value, (list, tuple)):
+		return tuple([Freeze(item) for item in value])
+	return value
+
+
+##
+# Merges the shading entities of equal contents, e.g. the colors of lights of
+# the same color or the BSDFs of SHOPs copied around. The first entity of
+# some contents is the canonical one, the others are not written and the
+# references to them are rewritten to it.
+#
+# Contents are the attributes but the name, with their references already
+# rewritten, so that BSDFs referring to equal colors are equal too.
+#
+class Deduplicator(object):
+
+	def __init__(self):
+		# Canonical name of the entities by (table, name) and by contents.
+		self.names = {}
+		self.contents = {}
+
+		self.merged = 0
+
+	##
+	# Returns the name of the entity of entityClass and name in tables the
+	# entity is merged into, its own name if it is canonical. The entities
+	# it refers to are canonicalized first, without recursion so that chains
+	# of BSDF mixes are as deep as they need.
+	#
+	def Canonicalize(self, tables, entityClass, name):
+		pending = [(entityClass, name, False)]
+		visiting = set()
+		while pending:
+			(entityClass, name, expanded) = pending.pop()
+			key = (entityClass.TABLE, name)
+			if self.names.has_key(key):
+				continue
+
+			# Entities already written were canonicalized then, unknown ones
+			# and cycles are left alone.
+			entity = getattr(tables, entityClass.TABLE).get(name)
+			if entity is None or (not expanded and key in visiting):
+				self.names[key] = name
+				continue
+
+			if not expanded:
+				visiting.add(key)
+				pending.append((entityClass, name, True))
+				pending.extend([(referenceClass, referenceName, False) for (referenceClass, referenceName) in entity.References()])
+				continue
+
+			rewritten = self.Rewrite(entity)
+			contents = (entityClass.__name__, Freeze(sorted([item for item in rewritten.attrs.iteritems() if item[0] != 'name'])))
+			canonicalName = self.contents.setdefault(contents, name)
+			if canonicalName != name:
+				self.merged += 1
+			self.names[key] = canonicalName
+
+		return self.names[(entityClass.TABLE, name)]
+
+	##
+	# Returns the entity with its references rewritten to the canonical
+	# entities, itself if none changes.
+	#
+	def Rewrite(self, entity):
+		attrs = None
+		for (attribute, className) in entity.ReferenceAttributes():
+			name = entity.attrs.get(attribute)
+			if not name:
+				continue
+
+			canonicalName = self.names.get((ENTITY_CLASSES[className].TABLE, name), name)
+			if canonicalName != name:
+				if attrs is None:
+					attrs = dict(entity.attrs)
+				attrs[attribute] = canonicalName
+
+		if attrs is None:
+			return entity
+
+		rewritten = copy.copy(entity)
+		rewritten.attrs = attrs
+		return rewritten
+
+	##
+	# Returns the entity as written, None if it is merged into another, its
+	# references canonicalized and rewritten.
+	#
+	def Resolve(self, tables, entity):
+		for (entityClass, name) in entity.References():
+			self.Canonicalize(tables, entityClass, name)
+
+		if entity.TABLE in MERGED_TABLES and self.Canonicalize(tables, entity.__class__, entity.attrs['name']) != entity.attrs['name']:
+			return None
+
+		return self.Rewrite(entity)
+
+
+class ShadingError(Exception):
+	pass
+
+
+##
+#
+class Node(object):
+
+	##
+	# <parameter> written for every model, and for each model. Entries are
+	# (attribute, parameter name, formatter), missing attributes are skipped.
+	COMMON_PARAMETERS = ()
+	PARAMETERS = {}
+
+	##
+	# Parameter tuples read from the SHOP for every model, and for each model.
+	# Entries are (attribute, parameter tuple name, kind).
+	COMMON_PARM_TUPLES = ()
+	PARM_TUPLES = {}
+
+	##
+	# Entities referred to for every model, and for each model. Entries are
+	# (attribute, class name), empty and missing attributes are skipped.
+	COMMON_REFERENCES = ()
+	REFERENCES = {}
+
+	# Assembly table of the entities of the class.
+	TABLE = None
+
+	def __init__(self):
+		self.attrs = {}
+
+	def Resolve(self, materialShopNode, moments):
+		pass
+
+	def ResolveParmTuples(self, shopNode, model, moments):
+		appleseedshading.EvalParmTuples(shopNode, self.COMMON_PARM_TUPLES, self.attrs, moments[0])
+		appleseedshading.EvalParmTuples(shopNode, self.PARM_TUPLES.get(model, ()), self.attrs, moments[0])
+
+	##
+	# Returns the attributes referring to entities for the model of the
+	# entity, as (attribute, class name).
+	#
+	def ReferenceAttributes(self):
+		return self.COMMON_REFERENCES + self.REFERENCES.get(self.attrs.get('model'), ())
+
+	##
+	# Returns the entities the entity refers to as (class, name).
+	#
+	def References(self):
+		references = []
+		for (attribute, className) in self.ReferenceAttributes():
+			name = self.attrs.get(attribute)
+			if name:
+				references.append((ENTITY_CLASSES[className], name))
+		return references
+
+
+##
+# Entities of one kind in an assembly, by name. It remembers the entities not
+# yet written so that the serializer could stream them out and drop them,
+# only the name is kept to tell the entity was already processed.
+#
+class EntityTable(dict):
+
+	def __init__(self):
+		super(EntityTable, self).__init__()
+
+		self.unflushed = []
+		self.unflushedNames = set()
+
+	def __setitem__(self, name, entity):
+		dict.__setitem__(self, name, entity)
+		if name not in self.unflushedNames:
+			self.unflushed.append(name)
+			self.unflushedNames.add(name)
+
+	def TakeUnflushed(self):
+		unflushed = self.unflushed
+		self.unflushed = []
+		self.unflushedNames = set()
+		return unflushed
+
+	def Drop(self, name):
+		dict.__setitem__(self, name, None)
+
+	##
+	# Forgets the entities of names not yet written, as if never added.
+	#
+	def Discard(self, names):
+		for name in names:
+			dict.__delitem__(self, name)
+		self.unflushed = [name for name in self.unflushed if name not in names]
+		self.unflushedNames -= names
+
+
+##
+#
+class BSDF(Node):
+
+	NAME  = 'name'
+	MODEL = 'model'
+
+	ASHIKHMIN_BRDF = 'ashikhmin_brdf'
+	ASHIKHMIN_DIFFUSE_REFLECTANCE = 'ashikhmin_diffuse_reflectance'
+	ASHIKHMIN_GLOSSY_REFLECTANCE = 'ashikhmin_glossy_reflectance'
+	ASHIKHMIN_SHININESS_U = 'ashikhmin_shininess_u'
+	ASHIKHMIN_SHININESS_V = 'ashikhmin_shininess_v'
+
+	BSDF_MIX = 'bsdf_mix'
+	BSDF_MIX_BSDF0 = 'bsdf_mix_bsdf0'
+	BSDF_MIX_WEIGHT0 = 'bsdf_mix_weight0'
+	BSDF_MIX_BSDF1 = 'bsdf_mix_bsdf1'
+	BSDF_MIX_WEIGHT1 = 'bsdf_mix_weight1'
+
+	KELEMEN_BRDF = 'kelemen_brdf'
+	KELEMEN_MATTE_REFLECTANCE = 'kelemen_matte_reflectance'
+	KELEMEN_SPECULAR_REFLECTANCE = 'kelemen_specular_reflectance'
+	KELEMEN_ROUGHNESS = 'kelemen_roughness'
+
+	LAMBERTIAN_BRDF = 'lambertian_brdf'
+	LAMBERTIAN_REFLECTANCE = 'lambertian_reflectance'
+
+	SPECULAR_BRDF = 'specular_brdf'
+	SPECULAR_BRDF_REFLECTANCE = 'specular_brdf_reflectance'
+
+	SPECULAR_BTDF = 'specular_btdf'
+	SPECULAR_BTDF_REFLECTANCE = 'specular_btdf_reflectance'
+	SPECULAR_BTDF_TRANSMITTANCE = 'specular_btdf_transmittance'
+	SPECULAR_BTDF_FROM_IOR = 'specular_btdf_from_ior'
+	SPECULAR_BTDF_TO_IOR = 'specular_btdf_to_ior'
+
+	PARAMETERS = {
+		ASHIKHMIN_BRDF : (
+			(ASHIKHMIN_DIFFUSE_REFLECTANCE, ASHIKHMIN_DIFFUSE_REFLECTANCE[10:], FormatValue),
+			(ASHIKHMIN_GLOSSY_REFLECTANCE,  ASHIKHMIN_GLOSSY_REFLECTANCE[10:],  FormatValue),
+			(ASHIKHMIN_SHININESS_U,         ASHIKHMIN_SHININESS_U[10:],         FormatValue),
+			(ASHIKHMIN_SHININESS_V,         ASHIKHMIN_SHININESS_V[10:],         FormatValue),
+		),
+		BSDF_MIX : (
+			(BSDF_MIX_BSDF0,   BSDF_MIX_BSDF0[9:],   FormatValue),
+			(BSDF_MIX_WEIGHT0, BSDF_MIX_WEIGHT0[9:], FormatValue),
+			(BSDF_MIX_BSDF1,   BSDF_MIX_BSDF1[9:],   FormatValue),
+			(BSDF_MIX_WEIGHT1, BSDF_MIX_WEIGHT1[9:], FormatValue),
+		),
+		KELEMEN_BRDF : (
+			(KELEMEN_MATTE_REFLECTANCE,    KELEMEN_MATTE_REFLECTANCE[8:],    FormatValue),
+			(KELEMEN_SPECULAR_REFLECTANCE, KELEMEN_SPECULAR_REFLECTANCE[8:], FormatValue),
+			(KELEMEN_ROUGHNESS,            KELEMEN_ROUGHNESS[8:],            FormatValue),
+		),
+		LAMBERTIAN_BRDF : (
+			(LAMBERTIAN_REFLECTANCE, LAMBERTIAN_REFLECTANCE[11:], FormatValue),
+		),
+		SPECULAR_BRDF : (
+			(SPECULAR_BRDF_REFLECTANCE, SPECULAR_BRDF_REFLECTANCE[14:], FormatValue),
+		),
+		SPECULAR_BTDF : (
+			(SPECULAR_BTDF_REFLECTANCE,   SPECULAR_BTDF_REFLECTANCE[14:],   FormatValue),
+			(SPECULAR_BTDF_TRANSMITTANCE, SPECULAR_BTDF_TRANSMITTANCE[14:], FormatValue),
+			(SPECULAR_BTDF_FROM_IOR,      SPECULAR_BTDF_FROM_IOR[14:],      FormatValue),
+			(SPECULAR_BTDF_TO_IOR,        SPECULAR_BTDF_TO_IOR[14:],        FormatValue),
+		),
+	}
+
+	PARM_TUPLES = {
+		ASHIKHMIN_BRDF : (
+			(ASHIKHMIN_DIFFUSE_REFLECTANCE, ASHIKHMIN_DIFFUSE_REFLECTANCE, SCALAR),
+			(ASHIKHMIN_GLOSSY_REFLECTANCE,  ASHIKHMIN_GLOSSY_REFLECTANCE,  SCALAR),
+			(ASHIKHMIN_SHININESS_U,         ASHIKHMIN_SHININESS_U,         SCALAR_ATTR),
+			(ASHIKHMIN_SHININESS_V,         ASHIKHMIN_SHININESS_V,         SCALAR_ATTR),
+		),
+		BSDF_MIX : (
+			(BSDF_MIX_BSDF0,   BSDF_MIX_BSDF0,   SCALAR),
+			(BSDF_MIX_WEIGHT0, BSDF_MIX_WEIGHT0, SCALAR_ATTR),
+			(BSDF_MIX_BSDF1,   BSDF_MIX_BSDF1,   SCALAR),
+			(BSDF_MIX_WEIGHT1, BSDF_MIX_WEIGHT1, SCALAR_ATTR),
+		),
+		KELEMEN_BRDF : (
+			(KELEMEN_MATTE_REFLECTANCE,    KELEMEN_MATTE_REFLECTANCE,    SCALAR),
+			(KELEMEN_SPECULAR_REFLECTANCE, KELEMEN_SPECULAR_REFLECTANCE, SCALAR),
+			(KELEMEN_ROUGHNESS,            KELEMEN_ROUGHNESS,            SCALAR_ATTR),
+		),
+		LAMBERTIAN_BRDF : (
+			(LAMBERTIAN_REFLECTANCE, LAMBERTIAN_REFLECTANCE, SCALAR),
+		),
+		SPECULAR_BRDF : (
+			(SPECULAR_BRDF_REFLECTANCE, SPECULAR_BRDF_REFLECTANCE, SCALAR),
+		),
+		SPECULAR_BTDF : (
+			(SPECULAR_BTDF_REFLECTANCE,   SPECULAR_BTDF_REFLECTANCE,   SCALAR),
+			(SPECULAR_BTDF_TRANSMITTANCE, SPECULAR_BTDF_TRANSMITTANCE, SCALAR),
+			(SPECULAR_BTDF_FROM_IOR,      SPECULAR_BTDF_FROM_IOR,      SCALAR),
+			(SPECULAR_BTDF_TO_IOR,        SPECULAR_BTDF_TO_IOR,        SCALAR),
+		),
+	}
+
+	REFERENCES = {
+		ASHIKHMIN_BRDF : (
+			(ASHIKHMIN_DIFFUSE_REFLECTANCE, 'Color'),
+			(ASHIKHMIN_GLOSSY_REFLECTANCE,  'Color'),
+		),
+		BSDF_MIX : (
+			(BSDF_MIX_BSDF0, 'BSDF'),
+			(BSDF_MIX_BSDF1, 'BSDF'),
+		),
+		KELEMEN_BRDF : (
+			(KELEMEN_MATTE_REFLECTANCE,    'Color'),
+			(KELEMEN_SPECULAR_REFLECTANCE, 'Color'),
+		),
+		LAMBERTIAN_BRDF : (
+			(LAMBERTIAN_REFLECTANCE, 'Color'),
+		),
+		SPECULAR_BRDF : (
+			(SPECULAR_BRDF_REFLECTANCE, 'Color'),
+		),
+		SPECULAR_BTDF : (
+			(SPECULAR_BTDF_REFLECTANCE,   'Color'),
+			(SPECULAR_BTDF_TRANSMITTANCE, 'Color'),
+		),
+	}
+
+	TABLE = 'bsdfs'
+
+	def __init__(self):
+		super(BSDF, self).__init__()
+
+		self.bsdf0 = None
+		self.bsdf1 = None
+
+	def Resolve(self, shopNode, moments):
+		self.attrs[BSDF.NAME] = shopNode.path()
+		self.attrs[BSDF.MODEL] = appleseedshading.EvalParm(shopNode, BSDF.MODEL, moments[0])
+		self.ResolveParmTuples(shopNode, self.attrs[BSDF.MODEL], moments)
+
+
+##
+#
+class EDF(Node):
+
+	NAME = 'name'
+	MODEL = 'model'
+
+	EXITANCE = 'exitance'
+
+	PARAMETERS = {
+		'diffuse_edf' : (
+			(EXITANCE, EXITANCE, FormatValue),
+		),
+	}
+
+	PARM_TUPLES = {
+		'diffuse_edf' : (
+			(EXITANCE, EXITANCE, SCALAR),
+		),
+	}
+
+	COMMON_REFERENCES = (
+		(EXITANCE, 'Color'),
+	)
+
+	TABLE = 'edfs'
+
+	def __init__(self):
+		super(EDF, self).__init__()
+
+	def Resolve(self, shopNode, moments):
+		self.attrs[EDF.NAME] = shopNode.path()
+		self.attrs[EDF.MODEL] = 'diffuse_edf'
+		self.ResolveParmTuples(shopNode, self.attrs[EDF.MODEL], moments)
+
+##
+#
+class Material(Node):
+
+	NAME     = 'name'
+	MODEL    = 'model'
+
+	BSDF           = 'bsdf'
+	EDF            = 'edf'
+	SURFACE_SHADER = 'surface_shader'
+
+	PARAMETERS = {
+		'generic_material' : (
+			(BSDF,           BSDF,           FormatValue),
+			(EDF,            EDF,            FormatValue),
+			(SURFACE_SHADER, SURFACE_SHADER, FormatValue),
+		),
+	}
+
+	PARM_TUPLES = {
+		'generic_material' : (
+			(BSDF,           BSDF,           SCALAR),
+			(EDF,            EDF,            SCALAR),
+			(SURFACE_SHADER, SURFACE_SHADER, SCALAR),
+		),
+	}
+
+	COMMON_REFERENCES = (
+		(BSDF,           'BSDF'),
+		(EDF,            'EDF'),
+		(SURFACE_SHADER, 'SurfaceShader'),
+	)
+
+	TABLE = 'materials'
+
+	def __init__(self):
+		super(Material, self).__init__()
+
+	def Resolve(self, shopNode, moments):
+		if shopNode.type().name() != 'appleseedMaterial':
+			Error('%s Must be appleseedMaterial.' % shopNode.path())
+
+		self.attrs[Material.NAME] = shopNode.path()
+
+		self.attrs[Material.MODEL] = 'generic_material'
+		self.ResolveParmTuples(shopNode, self.attrs[Material.MODEL], moments)
+
+		for key in (Material.BSDF, Material.EDF):
+			if self.attrs[key] == '':
+				del self.attrs[key]
+
+		if self.attrs[Material.SURFACE_SHADER] == '':
+			Error('Must set surface shader for %s' % shopNode.path())
+
+##
+#
+class Color(Node):
+
+	COLOR = 'color'
+
+	NAME = 'name'
+
+	COLOR_SPACE = 'color_space'
+	COLOR_VALUES = 'color_values'
+	SPECTRAL_VALUES = 'spectral_values'
+	VALUES = 'values'
+	ALPHA = 'alpha'
+	WAVELENGTH = 'wavelength'
+	WAVELENGTH_RANGE = 'wavelength_range'
+	MULTIPLIER = 'multiplier'
+
+	SPECTRAL = 'spectral'
+
+	COMMON_PARM_TUPLES = (
+		(ALPHA,      ALPHA,      SCALAR_ATTR),
+		(MULTIPLIER, MULTIPLIER, SCALAR_ATTR),
+	)
+
+	# Keyed by color space, the values of every space but spectral are read
+	# from the color values.
+	PARM_TUPLES = {
+		SPECTRAL : (
+			(VALUES,     SPECTRAL_VALUES,  SCALAR),
+			(WAVELENGTH, WAVELENGTH_RANGE, TUPLE),
+		),
+		None : (
+			(VALUES, COLOR_VALUES, TUPLE_ATTR),
+		),
+	}
+
+	TABLE = 'colors'
+
+	def __init__(self):
+		super(Color, self).__init__()
+
+	def Resolve(self, shopNode, moments):
+		self.attrs[Color.NAME] = shopNode.path()
+
+		self.attrs[Color.COLOR_SPACE] = appleseedshading.EvalParm(shopNode, Color.COLOR_SPACE, moments[0])
+		if self.attrs[Color.COLOR_SPACE] == Color.SPECTRAL:
+			self.ResolveParmTuples(shopNode, Color.SPECTRAL, moments)
+		else:
+			self.ResolveParmTuples(shopNode, None, moments)
+
+##
+#
+class SurfaceShader(Node):
+
+	NAME  = 'name'
+	MODEL = 'model'
+
+	AO_SURFACE_SHADER  = 'ao_surface_shader'
+	AO_SAMPLING_METHOD = 'ao_sampling_method'
+	AO_SAMPLES         = 'ao_samples'
+	AO_MAX_DISTANCE    = 'ao_max_distance'
+
+	CONSTANT_SURFACE_SHADER = 'constant_surface_shader'
+	CONSTANT_COLOR = 'constant_color'
+
+	DIAGNOSTIC_SURFACE_SHADER = 'diagnostic_surface_shader'
+	DIAGNOSTIC_MODE = 'diagnostic_mode'
+	DIAGNOSTIC_AO = 'ambient_occlusion'
+	DIAGNOSTIC_AO_SAMPLES = 'diagnostic_ao_samples'
+	DIAGNOSTIC_AO_MAX_DISTANCE = 'diagnostic_ao_max_distance'
+
+	FAST_SSS_SURFACE_SHADER = 'fast_sss_surface_shader'
+	FAST_SSS_SCALE = 'fast_sss_scale'
+	FAST_SSS_AMBIENT_SSS = 'fast_sss_ambient_sss'
+	FAST_SSS_VIEW_DEP_SSS = 'fast_sss_view_dep_sss'
+	FAST_SSS_DIFFUSE = 'fast_sss_diffuse'
+	FAST_SSS_POWER = 'fast_sss_power'
+	FAST_SSS_DISTORTION = 'fast_sss_distortion'
+	FAST_SSS_ALBEDO = 'fast_sss_albedo'
+	FAST_SSS_LIGHT_SAMPLES = 'fast_sss_light_samples'
+	FAST_SSS_OCCLUSION_SAMPLES = 'fast_sss_occlusion_samples'
+
+	PHYSICAL_SURFACE_SHADER = 'physical_surface_shader'
+	PHYSICAL_COLOR_MULTIPLIER = 'physical_color_multiplier'
+	PHYSICAL_ALPHA_MULTIPLIER = 'physical_alpha_multiplier'
+	PHYSICAL_AERIAL_PERSP_MODE = 'physical_aerial_persp_mode'
+	PHYSICAL_AERIAL_PERSP_MODE_NONE = 'none'
+	PHYSICAL_AERIAL_PERSP_MODE_ENVIRONMENT_SHADER = 'environment_shader'
+	PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR = 'sky_color'
+	PHYSICAL_AERIAL_PERSP_SKY_COLOR = 'physical_aerial_persp_sky_color'
+	PHYSICAL_AERIAL_PERSP_DISTANCE = 'physical_aerial_persp_distance'
+	PHYSICAL_AERIAL_PERSP_INTENSITY = 'physical_aerial_persp_intensity'
+
+	SMOKE_SURFACE_SHADER = 'smoke_surface_shader'
+	SMOKE_BOUNDING_BOX = 'smoke_bounding_box'
+	SMOKE_BOUNDING_BOX_MIN = 'smoke_bounding_box_min'
+	SMOKE_BOUNDING_BOX_MAX = 'smoke_bounding_box_max'
+	SMOKE_SHADING_MODE = 'smoke_shading_mode'
+	SMOKE_INTERPOLATION_MODE = 'smoke_interpolation_mode'
+	SMOKE_ISOSURFACE_THRESHOLD = 'smoke_isosurface_threshold'
+	SMOKE_FILENAME = 'smoke_filename'
+	SMOKE_STEP_SIZE = 'smoke_step_size'
+	SMOKE_DENSITY_CUTOFF = 'smoke_density_cutoff'
+	SMOKE_DENSITY_SCALE = 'smoke_density_scale'
+	SMOKE_SMOKE_COLOR = 'smoke_smoke_color'
+	SMOKE_FUEL_COLOR = 'smoke_fuel_color'
+	SMOKE_FUEL_SCALE = 'smoke_fuel_scale'
+	SMOKE_LIGHT_DIRECTION = 'smoke_light_direction'
+	SMOKE_LIGHT_COLOR = 'smoke_light_color'
+	SMOKE_COLOR_SCALE = 'smoke_color_scale'
+	SMOKE_VOLUME_OPACITY = 'smoke_volume_opacity'
+	SMOKE_SHADOW_OPACITY = 'smoke_shadow_opacity'
+
+	PARAMETERS = {
+		AO_SURFACE_SHADER : (
+			(AO_SAMPLING_METHOD, AO_SAMPLING_METHOD[3:], FormatValue),
+			(AO_SAMPLES,         AO_SAMPLES[3:],         FormatValue),
+			(AO_MAX_DISTANCE,    AO_MAX_DISTANCE[3:],    FormatValue),
+		),
+		CONSTANT_SURFACE_SHADER : (
+			(CONSTANT_COLOR, CONSTANT_COLOR[9:], FormatValue),
+		),
+		DIAGNOSTIC_SURFACE_SHADER : (
+			(DIAGNOSTIC_MODE,            DIAGNOSTIC_MODE[11:],             FormatValue),
+			(DIAGNOSTIC_AO_SAMPLES,      'ambient_occlusion.samples',      FormatValue),
+			(DIAGNOSTIC_AO_MAX_DISTANCE, 'ambient_occlusion.max_distance', FormatValue),
+		),
+		FAST_SSS_SURFACE_SHADER : (
+			(FAST_SSS_SCALE,             FAST_SSS_SCALE[9:],             FormatValue),
+			(FAST_SSS_AMBIENT_SSS,       FAST_SSS_AMBIENT_SSS[9:],       FormatValue),
+			(FAST_SSS_VIEW_DEP_SSS,      FAST_SSS_VIEW_DEP_SSS[9:],      FormatValue),
+			(FAST_SSS_DIFFUSE,           FAST_SSS_DIFFUSE[9:],           FormatValue),
+			(FAST_SSS_POWER,             FAST_SSS_POWER[9:],             FormatValue),
+			(FAST_SSS_DISTORTION,        FAST_SSS_DISTORTION[9:],        FormatValue),
+			(FAST_SSS_ALBEDO,            FAST_SSS_ALBEDO[9:],            FormatValue),
+			(FAST_SSS_LIGHT_SAMPLES,     FAST_SSS_LIGHT_SAMPLES[9:],     FormatValue),
+			(FAST_SSS_OCCLUSION_SAMPLES, FAST_SSS_OCCLUSION_SAMPLES[9:], FormatValue),
+		),
+		PHYSICAL_SURFACE_SHADER : (
+			(PHYSICAL_COLOR_MULTIPLIER,       PHYSICAL_COLOR_MULTIPLIER[9:],       FormatValue),
+			(PHYSICAL_ALPHA_MULTIPLIER,       PHYSICAL_ALPHA_MULTIPLIER[9:],       FormatValue),
+			(PHYSICAL_AERIAL_PERSP_MODE,      PHYSICAL_AERIAL_PERSP_MODE[9:],      FormatValue),
+			(PHYSICAL_AERIAL_PERSP_SKY_COLOR, PHYSICAL_AERIAL_PERSP_SKY_COLOR[9:], FormatValue),
+			(PHYSICAL_AERIAL_PERSP_DISTANCE,  PHYSICAL_AERIAL_PERSP_DISTANCE[9:],  FormatValue),
+			(PHYSICAL_AERIAL_PERSP_INTENSITY, PHYSICAL_AERIAL_PERSP_INTENSITY[9:], FormatValue),
+		),
+		SMOKE_SURFACE_SHADER : (
+			(SMOKE_BOUNDING_BOX,         SMOKE_BOUNDING_BOX[6:],         FormatFloats),
+			(SMOKE_SHADING_MODE,         SMOKE_SHADING_MODE[6:],         FormatValue),
+			(SMOKE_INTERPOLATION_MODE,   SMOKE_INTERPOLATION_MODE[6:],   FormatValue),
+			(SMOKE_ISOSURFACE_THRESHOLD, SMOKE_ISOSURFACE_THRESHOLD[6:], FormatValue),
+			(SMOKE_FILENAME,             SMOKE_FILENAME[6:],             FormatValue),
+			(SMOKE_STEP_SIZE,            SMOKE_STEP_SIZE[6:],            FormatValue),
+			(SMOKE_DENSITY_CUTOFF,       SMOKE_DENSITY_CUTOFF[6:],       FormatValue),
+			(SMOKE_DENSITY_SCALE,        SMOKE_DENSITY_SCALE[6:],        FormatValue),
+			(SMOKE_SMOKE_COLOR,          SMOKE_SMOKE_COLOR[6:],          FormatFloats),
+			(SMOKE_FUEL_COLOR,           SMOKE_FUEL_COLOR[6:],           FormatFloats),
+			(SMOKE_FUEL_SCALE,           SMOKE_FUEL_SCALE[6:],           FormatValue),
+			(SMOKE_LIGHT_DIRECTION,      SMOKE_LIGHT_DIRECTION[6:],      FormatFloats),
+			(SMOKE_LIGHT_COLOR,          SMOKE_LIGHT_COLOR[6:],          FormatFloats),
+			(SMOKE_COLOR_SCALE,          SMOKE_COLOR_SCALE[6:],          FormatValue),
+			(SMOKE_VOLUME_OPACITY,       SMOKE_VOLUME_OPACITY[6:],       FormatValue),
+			(SMOKE_SHADOW_OPACITY,       SMOKE_SHADOW_OPACITY[6:],       FormatValue),
+		),
+	}
+
+	PARM_TUPLES = {
+		AO_SURFACE_SHADER : (
+			(AO_SAMPLING_METHOD, AO_SAMPLING_METHOD, SCALAR_ATTR),
+			(AO_SAMPLES,         AO_SAMPLES,         SCALAR_ATTR),
+			(AO_MAX_DISTANCE,    AO_MAX_DISTANCE,    SCALAR_ATTR),
+		),
+		CONSTANT_SURFACE_SHADER : (
+			(CONSTANT_COLOR, CONSTANT_COLOR, SCALAR),
+		),
+		DIAGNOSTIC_SURFACE_SHADER : (
+			(DIAGNOSTIC_MODE, DIAGNOSTIC_MODE, SCALAR_ATTR),
+		),
+		FAST_SSS_SURFACE_SHADER : (
+			(FAST_SSS_SCALE,             FAST_SSS_SCALE,             SCALAR_ATTR),
+			(FAST_SSS_AMBIENT_SSS,       FAST_SSS_AMBIENT_SSS,       SCALAR_ATTR),
+			(FAST_SSS_VIEW_DEP_SSS,      FAST_SSS_VIEW_DEP_SSS,      SCALAR_ATTR),
+			(FAST_SSS_DIFFUSE,           FAST_SSS_DIFFUSE,           SCALAR_ATTR),
+			(FAST_SSS_POWER,             FAST_SSS_POWER,             SCALAR_ATTR),
+			(FAST_SSS_DISTORTION,        FAST_SSS_DISTORTION,        SCALAR_ATTR),
+			(FAST_SSS_ALBEDO,            FAST_SSS_ALBEDO,            SCALAR),
+			(FAST_SSS_LIGHT_SAMPLES,     FAST_SSS_LIGHT_SAMPLES,     SCALAR_ATTR),
+			(FAST_SSS_OCCLUSION_SAMPLES, FAST_SSS_OCCLUSION_SAMPLES, SCALAR_ATTR),
+		),
+		PHYSICAL_SURFACE_SHADER : (
+			(PHYSICAL_COLOR_MULTIPLIER,       PHYSICAL_COLOR_MULTIPLIER,       SCALAR_ATTR),
+			(PHYSICAL_ALPHA_MULTIPLIER,       PHYSICAL_ALPHA_MULTIPLIER,       SCALAR_ATTR),
+			(PHYSICAL_AERIAL_PERSP_MODE,      PHYSICAL_AERIAL_PERSP_MODE,      SCALAR),
+			(PHYSICAL_AERIAL_PERSP_DISTANCE,  PHYSICAL_AERIAL_PERSP_DISTANCE,  SCALAR_ATTR),
+			(PHYSICAL_AERIAL_PERSP_INTENSITY, PHYSICAL_AERIAL_PERSP_INTENSITY, SCALAR_ATTR),
+		),
+		SMOKE_SURFACE_SHADER : (
+			(SMOKE_BOUNDING_BOX_MIN,     SMOKE_BOUNDING_BOX_MIN,     TUPLE_ATTR),
+			(SMOKE_BOUNDING_BOX_MAX,     SMOKE_BOUNDING_BOX_MAX,     TUPLE_ATTR),
+			(SMOKE_SHADING_MODE,         SMOKE_SHADING_MODE,         SCALAR_ATTR),
+			(SMOKE_INTERPOLATION_MODE,   SMOKE_INTERPOLATION_MODE,   SCALAR_ATTR),
+			(SMOKE_ISOSURFACE_THRESHOLD, SMOKE_ISOSURFACE_THRESHOLD, SCALAR_ATTR),
+			(SMOKE_FILENAME,             SMOKE_FILENAME,             SCALAR_ATTR),
+			(SMOKE_STEP_SIZE,            SMOKE_STEP_SIZE,            SCALAR_ATTR),
+			(SMOKE_DENSITY_CUTOFF,       SMOKE_DENSITY_CUTOFF,       SCALAR_ATTR),
+			(SMOKE_DENSITY_SCALE,        SMOKE_DENSITY_SCALE,        SCALAR_ATTR),
+			(SMOKE_SMOKE_COLOR,          SMOKE_SMOKE_COLOR,          TUPLE_ATTR),
+			(SMOKE_FUEL_COLOR,           SMOKE_FUEL_COLOR,           TUPLE_ATTR),
+			(SMOKE_FUEL_SCALE,           SMOKE_FUEL_SCALE,           SCALAR_ATTR),
+			(SMOKE_LIGHT_DIRECTION,      SMOKE_LIGHT_DIRECTION,      TUPLE_ATTR),
+			(SMOKE_LIGHT_COLOR,          SMOKE_LIGHT_COLOR,          TUPLE_ATTR),
+			(SMOKE_COLOR_SCALE,          SMOKE_COLOR_SCALE,          SCALAR_ATTR),
+			(SMOKE_VOLUME_OPACITY,       SMOKE_VOLUME_OPACITY,       SCALAR_ATTR),
+			(SMOKE_SHADOW_OPACITY,       SMOKE_SHADOW_OPACITY,       SCALAR_ATTR),
+		),
+	}
+
+	# Read only in the diagnostic mode or the aerial perspective mode they
+	# apply to.
+	DIAGNOSTIC_AO_PARM_TUPLES = (
+		(DIAGNOSTIC_AO_SAMPLES,      DIAGNOSTIC_AO_SAMPLES,      SCALAR_ATTR),
+		(DIAGNOSTIC_AO_MAX_DISTANCE, DIAGNOSTIC_AO_MAX_DISTANCE, SCALAR_ATTR),
+	)
+	PHYSICAL_SKY_COLOR_PARM_TUPLES = (
+		(PHYSICAL_AERIAL_PERSP_SKY_COLOR, PHYSICAL_AERIAL_PERSP_SKY_COLOR, SCALAR),
+	)
+
+	# The sky color is read in the sky color aerial perspective mode only.
+	REFERENCES = {
+		CONSTANT_SURFACE_SHADER : (
+			(CONSTANT_COLOR, 'Color'),
+		),
+		FAST_SSS_SURFACE_SHADER : (
+			(FAST_SSS_ALBEDO, 'Color'),
+		),
+		PHYSICAL_SURFACE_SHADER : (
+			(PHYSICAL_AERIAL_PERSP_SKY_COLOR, 'Color'),
+		),
+	}
+
+	TABLE = 'surfaceShaders'
+
+	def __init__(self):
+		super(SurfaceShader, self).__init__()
+
+	def Resolve(self, shopNode, moments):
+		self.attrs[SurfaceShader.NAME] = shopNode.path()
+		self.attrs[SurfaceShader.MODEL] = appleseedshading.EvalParm(shopNode, SurfaceShader.MODEL, moments[0])
+
+		model = self.attrs[SurfaceShader.MODEL]
+		self.ResolveParmTuples(shopNode, model, moments)
+
+		# AO
+		if model == SurfaceShader.AO_SURFACE_SHADER:
+			if self.attrs[SurfaceShader.AO_SAMPLING_METHOD].value[0] == 'uniform':
+				del self.attrs[SurfaceShader.AO_SAMPLING_METHOD]
+
+		# Diagnostic
+		elif model == SurfaceShader.DIAGNOSTIC_SURFACE_SHADER:
+			if self.attrs[SurfaceShader.DIAGNOSTIC_MODE].value[0] == SurfaceShader.DIAGNOSTIC_AO:
+				appleseedshading.EvalParmTuples(shopNode, SurfaceShader.DIAGNOSTIC_AO_PARM_TUPLES, self.attrs, moments[0])
+				if self.attrs[SurfaceShader.DIAGNOSTIC_AO_SAMPLES].value[0] == 16:
+					del self.attrs[SurfaceShader.DIAGNOSTIC_AO_SAMPLES]
+				if self.attrs[SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE].value[0] == 1.0:
+					del self.attrs[SurfaceShader.DIAGNOSTIC_AO_MAX_DISTANCE]
+
+		# Physical
+		elif model == SurfaceShader.PHYSICAL_SURFACE_SHADER:
+			if self.attrs[SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE] == SurfaceShader.PHYSICAL_AERIAL_PERSP_MODE_SKY_COLOR:
+				appleseedshading.EvalParmTuples(shopNode, SurfaceShader.PHYSICAL_SKY_COLOR_PARM_TUPLES, self.attrs, moments[0])
+
+		# Smoke
+		elif model == SurfaceShader.SMOKE_SURFACE_SHADER:
+			boundingBoxMin = self.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MIN].value[0]
+			boundingBoxMax = self.attrs[SurfaceShader.SMOKE_BOUNDING_BOX_MAX].value[0]
+			self.attrs[SurfaceShader.SMOKE_BOUNDING_BOX] = Attr(boundingBoxMin + boundingBoxMax)
+
+
+##
+# Entity classes by name, as in the references.
+#
+ENTITY_CLASSES = dict([(entityClass.__name__, entityClass) for entityClass in (Material, BSDF, EDF, SurfaceShader, Color)])
+
+##
+# Shading tables of an assembly and their writers, in the order they are
+# written.
+#
+TABLES = (
+	('colors',         'WriteColor'),
+	('bsdfs',          'WriteBSDF'),
+	('edfs',           'WriteEDF'),
+	('surfaceShaders', 'WriteSurfaceShader'),
+	('materials',      'WriteMaterial'),
+)
+
+
+# Tables whose entities of equal contents are merged, see Deduplicator.
+# Materials are assigned by name, they are kept.
+MERGED_TABLES = ('colors', 'bsdfs', 'edfs', 'surfaceShaders')
+
+##
+# Shading entities resolved out of an assembly, e.g. by the SHOP clerk.
+#
+class ShadingTables(object):
+
+	def __init__(self):
+		for (tableName, writerName) in TABLES:
+			setattr(self, tableName, EntityTable())
+
+
+##
+# Writes entities as XML to a stream.
+#
+class XmlWriter(object):
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.depth = 0
+
+	##
+	# XML primitives, attributes are sequences of (name, value).
+	#
+	def Open(self, tag, attributes = ()):
+		self.stream.write('%s<%s%s>\n' % ('\t' * self.depth, tag, self.FormatAttributes(attributes)))
+		self.depth += 1
+
+	def Close(self, tag):
+		self.depth -= 1
+		self.stream.write('%s</%s>\n' % ('\t' * self.depth, tag))
+
+	def Empty(self, tag, attributes = ()):
+		self.stream.write('%s<%s%s />\n' % ('\t' * self.depth, tag, self.FormatAttributes(attributes)))
+
+	def Text(self, tag, text):
+		self.stream.write('%s<%s>%s</%s>\n' % ('\t' * self.depth, tag, EscapeXml(text), tag))
+
+	def FormatAttributes(self, attributes):
+		return ''.join([' %s="%s"' % (name, EscapeXml(value)) for (name, value) in attributes])
+
+	##
+	# Entities.
+	#
+	def WriteParameters(self, node, parameters):
+		for (key, name, format) in parameters:
+			if node.attrs.has_key(key):
+				self.Empty('parameter', ((Attr.NAME, name), (Attr.VALUE, format(node.attrs[key]))))
+
+	def WriteTransform(self, transform):
+		self.Open('transform')
+		self.Text('matrix', FormatMatrix(transform.matrix.data))
+		self.Close('transform')
+
+	##
+	# Writes <tag name model> with the parameters listed by the class of the
+	# node for its model.
+	#
+	def WriteEntity(self, tag, node, transform = None):
+		attributes = [('name', node.attrs['name'])]
+		model = node.attrs.get('model')
+		if model is not None:
+			attributes.append(('model', model))
+
+		self.Open(tag, attributes)
+		self.WriteParameters(node, node.COMMON_PARAMETERS)
+		self.WriteParameters(node, node.PARAMETERS.get(model, ()))
+		if transform is not None:
+			self.WriteTransform(transform)
+		self.Close(tag)
+
+	def WriteMaterial(self, material):
+		self.WriteEntity('material', material)
+
+	def WriteBSDF(self, bsdf):
+		self.WriteEntity('bsdf', bsdf)
+
+	def WriteEDF(self, edf):
+		self.WriteEntity('edf', edf)
+
+	def WriteSurfaceShader(self, surfaceShader):
+		self.WriteEntity('surface_shader', surfaceShader)
+
+	def WriteColor(self, color):
+		self.Open('color', ((Color.NAME, color.attrs[Color.NAME]),))
+
+		self.Empty('parameter', ((Attr.NAME, Color.COLOR_SPACE), (Attr.VALUE, color.attrs[Color.COLOR_SPACE])))
+		if color.attrs.has_key(Color.MULTIPLIER):
+			self.Empty('parameter', ((Attr.NAME, Color.MULTIPLIER), (Attr.VALUE, FormatValue(color.attrs[Color.MULTIPLIER]))))
+
+		if color.attrs[Color.COLOR_SPACE] != 'spectral':
+			self.Text(Color.VALUES, FormatFloats(color.attrs[Color.VALUES]))
+		else:
+			self.Text(Color.VALUES, FormatValue(color.attrs[Color.VALUES]))
+
+		if color.attrs.has_key(Color.ALPHA):
+			self.Text(Color.ALPHA, FormatValue(color.attrs[Color.ALPHA]))
+
+		self.Close('color')
+
+	##
+	# Writes the shading entities of tables not written yet.
+	#
+	def WriteTables(self, tables):
+		for (tableName, writerName) in TABLES:
+			table = getattr(tables, tableName)
+			write = getattr(self, writerName)
+			for name in table.TakeUnflushed():
+				write(table[name])
@@ -0,0 +1,324 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Memoized shading network.
+#
+# soho executes appleseed.py again for every export while the modules it
+# imports stay loaded, the graph kept here survives from one export to the
+# next within a Houdini session.
+#
+
+import hashlib
+
+try:
+	import hou
+except ImportError:
+	hou = None
+
+##
+# Kinds of the values read from a parameter tuple by EvalParmTuples: its first
+# component or all of them, as is or wrapped in an Attr.
+#
+SCALAR      = 0
+SCALAR_ATTR = 1
+TUPLE       = 2
+TUPLE_ATTR  = 3
+
+##
+# Global variables.
+#
+theGraph = None
+
+##
+# Global functions.
+#
+
+##
+# Returns the graph of the session.
+#
+def TheGraph():
+	global theGraph
+	if theGraph is None:
+		theGraph = ShadingGraph()
+	return theGraph
+
+##
+# Returns a hash of the values of the parameters of a node, at time if given.
+#
+def ParmDigest(parms, time = None):
+	sha = hashlib.sha1()
+	for parm in parms:
+		if time is None:
+			value = parm.eval()
+		else:
+			value = parm.evalAtTime(time)
+		sha.update('%s=%r\n' % (parm.name(), value))
+	TheGraph().evaluations += len(parms)
+	return sha.hexdigest()
+
+##
+# Returns True if one of the parameters of a node is animated or driven by an
+# expression depending on time.
+#
+def IsTimeDependent(parms):
+	for parm in parms:
+		isTimeDependent = getattr(parm, 'isTimeDependent', None)
+		if isTimeDependent is None or isTimeDependent():
+			return True
+	return False
+
+def SessionId(node):
+	sessionId = getattr(node, 'sessionId', None)
+	if sessionId is None:
+		return None
+	return sessionId()
+
+##
+# Returns the names of the nodes an entity refers to: its string values, or
+# the values of its Attr, which are the path of an entity of the graph.
+#
+def References(attrs, entries):
+	references = []
+	for value in attrs.itervalues():
+		if isinstance(value, Attr):
+			values = value.value
+		else:
+			values = (value,)
+
+		for value in values:
+			if isinstance(value, basestring) and entries.has_key(value):
+				references.append(value)
+
+	return references
+
+##
+# Returns the first component of the parameter tuple name of node at time.
+#
+def EvalParm(node, name, time):
+	TheGraph().evaluations += 1
+	return node.parmTuple(name).evalAtTime(time)[0]
+
+##
+# Fills attrs from the parameter tuples of node listed in schema, whose
+# entries are (attribute, parameter tuple name, kind), evaluated at time.
+# Every tuple is evaluated by a single call to HOM, whatever the number of its
+# components.
+#
+def EvalParmTuples(node, schema, attrs, time):
+	for (attribute, name, kind) in schema:
+		values = node.parmTuple(name).evalAtTime(time)
+		if kind == SCALAR:
+			attrs[attribute] = values[0]
+		elif kind == SCALAR_ATTR:
+			attrs[attribute] = Attr(values[0])
+		elif kind == TUPLE:
+			attrs[attribute] = tuple(values)
+		else:
+			attrs[attribute] = Attr(tuple(values))
+
+	TheGraph().evaluations += len(schema)
+
+##
+# Value of an entity attribute holding a list, e.g. a color.
+#
+# It is defined here rather than in appleseed.py so that the memoized values
+# remain instances of the same class from one export to the next.
+#
+class Attr(object):
+
+	NAME  = 'name'
+	VALUE = 'value'
+
+	def __init__(self, *args):
+		self.value = list(args)
+
+
+##
+# Resolved shading node.
+#
+class GraphEntry(object):
+
+	def __init__(self, kind, attrs, time, digest, sessionId, timeDependent):
+		self.kind = kind
+		self.attrs = attrs
+		self.time = time
+		self.digest = digest
+		self.sessionId = sessionId
+		self.timeDependent = timeDependent
+
+
+##
+# The attributes of the resolved Material, BSDF, EDF, Color and SurfaceShader
+# nodes keyed by path.
+#
+# Nodes are resolved at a time. An entry is dropped once the node at its path
+# is not the node it was resolved from anymore. Where node event callbacks
+# are available, a change of the parameters of a node marks it dirty and only
+# dirty nodes and nodes depending on time asked at another time are resolved
+# again, the others are returned without evaluating their parameters. Nodes
+# without callbacks are checked against the hash of their parameters at the
+# time asked.
+#
+# Entities refer to the nodes they depend on by name, a node depending on a
+# changed one is written the same and is not resolved again. Dependents()
+# tells which entities are affected by a change.
+#
+class ShadingGraph(object):
+
+	EVENT_TYPES = ('ParmTupleChanged', 'NameChanged', 'BeingDeleted')
+
+	def __init__(self):
+		self.entries = {}
+		self.dirty = set()
+
+		# Callbacks registered per path.
+		self.callbacks = {}
+		# Whether changes are tracked by node event callbacks.
+		self.watching = hou is not None and hasattr(hou, 'nodeEventType')
+
+		self.ResetStatistics()
+
+	def ResetStatistics(self):
+		self.hits = 0
+		self.validations = 0
+		self.resolves = 0
+		self.evaluations = 0
+
+	##
+	# Returns the attributes of the node at path resolved as kind at time,
+	# None if it has to be resolved.
+	#
+	def Lookup(self, path, kind, time):
+		entry = self.Entry(path, kind, time)
+		if entry is None:
+			return None
+
+		return entry.attrs
+
+	##
+	# Returns the entry of the node at path resolved as kind at time, None if
+	# it has to be resolved. An entry stays the same object until the node is
+	# resolved again.
+	#
+	def Entry(self, path, kind, time):
+		entry = self.entries.get(path)
+		if entry is None or entry.kind != kind:
+			return None
+
+		node = hou.node(path)
+		if node is None or SessionId(node) != entry.sessionId:
+			self.Remove(path)
+			return None
+
+		if self.callbacks.has_key(path):
+			if (entry.timeDependent and entry.time != time) or path in self.dirty:
+				return None
+			self.hits += 1
+			return entry
+
+		self.validations += 1
+		if ParmDigest(node.parms(), time) != entry.digest:
+			return None
+
+		return entry
+
+	##
+	# Records the attributes node was resolved to as kind at time.
+	#
+	def Store(self, node, kind, attrs, time):
+		self.Watch(node)
+
+		path = node.path()
+		parms = node.parms()
+		if self.callbacks.has_key(path):
+			entry = GraphEntry(kind, dict(attrs), time, None, SessionId(node), IsTimeDependent(parms))
+		else:
+			entry = GraphEntry(kind, dict(attrs), time, ParmDigest(parms, time), SessionId(node), False)
+		self.entries[path] = entry
+		self.dirty.discard(path)
+		self.resolves += 1
+
+	def Remove(self, path):
+		self.entries.pop(path, None)
+		self.dirty.discard(path)
+
+	def MarkDirty(self, path):
+		self.dirty.add(path)
+
+	##
+	# Returns the paths of the nodes depending on the node at path, directly
+	# or not.
+	#
+	def Dependents(self, path):
+		referrers = {}
+		for (referrer, entry) in self.entries.iteritems():
+			for reference in References(entry.attrs, self.entries):
+				referrers.setdefault(reference, []).append(referrer)
+
+		dependents = set()
+		pending = [path]
+		while pending:
+			for referrer in referrers.get(pending.pop(), ()):
+				if referrer not in dependents:
+					dependents.add(referrer)
+					pending.append(referrer)
+
+		return dependents
+
+	def Watch(self, node):
+		if not self.watching:
+			return
+
+		path = node.path()
+		if self.callbacks.has_key(path):
+			return
+
+		def Callback(event_type, **kwargs):
+			self.OnNodeEvent(path, event_type, kwargs.get('node'))
+
+		try:
+			node.addEventCallback(self.EventTypes(), Callback)
+		except (AttributeError, hou.Error):
+			self.watching = False
+			return
+
+		self.callbacks[path] = Callback
+
+	def EventTypes(self):
+		return tuple([getattr(hou.nodeEventType, name) for name in ShadingGraph.EVENT_TYPES])
+
+	def OnNodeEvent(self, path, eventType, node):
+		self.MarkDirty(path)
+		if eventType == hou.nodeEventType.ParmTupleChanged:
+			return
+
+		# The node is not at path anymore, it is watched again under its new
+		# path once resolved there.
+		callback = self.callbacks.pop(path, None)
+		if eventType == hou.nodeEventType.NameChanged and node is not None and callback is not None:
+			try:
+				node.removeEventCallback(self.EventTypes(), callback)
+			except hou.Error:
+				pass
+		self.Remove(path)
+
+	def Statistics(self):
+		return '%d hits, %d validated, %d resolved, %d nodes, %d parameter evaluations' % (self.hits, self.validations, self.resolves, len(self.entries), self.evaluations)
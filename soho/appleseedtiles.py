@@ -0,0 +1,508 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Splits a frame into regions rendered apart, and stitches their images.
+#
+# A region is rendered from a copy of the project restricted to it by the
+# crop_window parameter of its frame, so that the regions render on as many
+# processes or machines. Their PNG images are stitched row by row, only a row
+# of each image is held at once. The images may cover the whole frame or
+# their region only. Regions rendered elsewhere are stitched from their
+# projects, the images being next to them:
+#
+#   python soho/appleseedtiles.py --output frame.png scene.tile*.appleseed
+#
+
+import optparse
+import os
+import re
+import struct
+import sys
+import zlib
+
+# Size of the tiles of the renderer, the regions are made of whole tiles.
+DEFAULT_TILE_SIZE = 32
+
+PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+# Channels of the PNG color types, palettes are not supported.
+PNG_CHANNELS = {
+	0 : 1,
+	2 : 3,
+	4 : 2,
+	6 : 4,
+}
+
+# PNG row filters.
+FILTER_NONE    = 0
+FILTER_SUB     = 1
+FILTER_UP      = 2
+FILTER_AVERAGE = 3
+FILTER_PAETH   = 4
+
+# Bytes read from an image, and written per IDAT chunk, at once.
+READ_SIZE = 1 << 16
+CHUNK_SIZE = 1 << 20
+
+FRAME_PATTERN       = re.compile(r'(<frame\b[^>]*>)(\s*)(.*?)</frame>', re.S)
+PARAMETER_PATTERN   = re.compile(r'<parameter name="([^"]*)" value="([^"]*)"')
+CROP_WINDOW_PATTERN = re.compile(r'\s*<parameter name="crop_window" value="[^"]*"\s*/>')
+
+CROP_WINDOW = 'crop_window'
+RESOLUTION  = 'resolution'
+TILE_SIZE   = 'tile_size'
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('appleseed: tiles: %s\n' % message)
+
+def ReadText(filePath):
+	file = open(filePath, 'r')
+	try:
+		return file.read()
+	finally:
+		file.close()
+
+##
+# Returns the parameters of the frame of a project, by name.
+#
+def FrameParameters(projectFilePath):
+	match = FRAME_PATTERN.search(ReadText(projectFilePath))
+	if match is None:
+		raise ValueError('no frame in %s' % projectFilePath)
+	return dict(PARAMETER_PATTERN.findall(match.group(3)))
+
+def FrameResolution(parameters):
+	return tuple([int(value) for value in parameters[RESOLUTION].split()])
+
+##
+# Returns the crop window of a frame as (x0, y0, x1, y1) inclusive, within
+# the frame, the whole frame if it has none.
+#
+def FrameWindow(parameters):
+	(width, height) = FrameResolution(parameters)
+	if not parameters.has_key(CROP_WINDOW):
+		return (0, 0, width - 1, height - 1)
+
+	(x0, y0, x1, y1) = [int(value) for value in parameters[CROP_WINDOW].split()]
+	return (max(x0, 0), max(y0, 0), min(x1, width - 1), min(y1, height - 1))
+
+##
+# Returns the edges splitting size pixels into count spans of whole tiles.
+# There are fewer spans than asked if there are fewer tiles.
+#
+def Edges(size, count, tileSize):
+	tiles = (size + tileSize - 1) / tileSize
+	edges = []
+	for i in xrange(count + 1):
+		edge = min(size, tiles * i / count * tileSize)
+		if not edges or edge != edges[-1]:
+			edges.append(edge)
+	return edges
+
+##
+# Returns count regions covering a frame, as (x0, y0, x1, y1) inclusive like
+# crop windows. The frame is split into columns and rows giving regions as
+# square as possible.
+#
+def Regions(width, height, count, tileSize = DEFAULT_TILE_SIZE):
+	best = None
+	for columns in xrange(1, count + 1):
+		if count % columns != 0:
+			continue
+		rows = count / columns
+		aspect = (float(width) / columns) / (float(height) / rows)
+		score = max(aspect, 1.0 / aspect)
+		if best is None or score < best[0]:
+			best = (score, columns, rows)
+
+	(score, columns, rows) = best
+	xs = Edges(width, columns, tileSize)
+	ys = Edges(height, rows, tileSize)
+
+	regions = []
+	for j in xrange(len(ys) - 1):
+		for i in xrange(len(xs) - 1):
+			regions.append((xs[i], ys[j], xs[i + 1] - 1, ys[j + 1] - 1))
+	return regions
+
+def TileFilePath(filePath, index):
+	(root, extension) = os.path.splitext(filePath)
+	return '%s.tile%02d%s' % (root, index, extension)
+
+##
+# Writes a copy of the project per region, the crop window of its frame set
+# to the region in place of the one it had. The regions split the crop window
+# of the frame if it has one, the whole frame otherwise. Returns the
+# resolution of the frame and the copies, as [(project file path, region)].
+#
+def SplitProject(projectFilePath, count):
+	text = ReadText(projectFilePath)
+	match = FRAME_PATTERN.search(text)
+	if match is None:
+		raise ValueError('no frame in %s' % projectFilePath)
+
+	parameters = dict(PARAMETER_PATTERN.findall(match.group(3)))
+	(width, height) = FrameResolution(parameters)
+	(x0, y0, x1, y1) = FrameWindow(parameters)
+	tileSize = int(parameters.get(TILE_SIZE, str(DEFAULT_TILE_SIZE)).split()[0])
+
+	regions = Regions(x1 - x0 + 1, y1 - y0 + 1, count, tileSize)
+	frameParameters = CROP_WINDOW_PATTERN.sub('', match.group(2) + match.group(3))
+
+	tiles = []
+	for (index, (rx0, ry0, rx1, ry1)) in enumerate(regions):
+		region = (x0 + rx0, y0 + ry0, x0 + rx1, y0 + ry1)
+		cropWindow = '<parameter name="%s" value="%d %d %d %d" />' % ((CROP_WINDOW,) + region)
+		tileFilePath = TileFilePath(projectFilePath, index)
+		file = open(tileFilePath, 'w')
+		try:
+			file.write(text[:match.end(2)])
+			file.write(cropWindow)
+			file.write(frameParameters)
+			file.write(text[match.end(3):])
+		finally:
+			file.close()
+		tiles.append((tileFilePath, region))
+
+	return ((width, height), tiles)
+
+##
+# Stitches the images of regions into a PNG image of resolution. tiles are
+# [(region, image file path)], the images all of the same format. Pixels
+# out of every region are left at 0.
+#
+def Stitch(outputFilePath, resolution, tiles):
+	(width, height) = resolution
+
+	readers = []
+	try:
+		for (region, imageFilePath) in tiles:
+			reader = PngReader(imageFilePath)
+			readers.append(reader)
+
+			(x0, y0, x1, y1) = region
+			if (reader.width, reader.height) == (width, height):
+				origin = (0, 0)
+			elif (reader.width, reader.height) == (x1 - x0 + 1, y1 - y0 + 1):
+				origin = (x0, y0)
+			else:
+				raise ValueError('%s is %dx%d, neither the frame nor its region' % (imageFilePath, reader.width, reader.height))
+
+			if (reader.bitDepth, reader.colorType) != (readers[0].bitDepth, readers[0].colorType):
+				raise ValueError('%s is not of the format of %s' % (imageFilePath, readers[0].filePath))
+			reader.region = region
+			reader.origin = origin
+
+		pixelSize = readers[0].pixelSize
+		writer = PngWriter(outputFilePath, width, height, readers[0].bitDepth, readers[0].colorType)
+		try:
+			for y in xrange(height):
+				row = bytearray(width * pixelSize)
+				for reader in readers:
+					(x0, y0, x1, y1) = reader.region
+					if reader.file is None or y < reader.origin[1]:
+						continue
+
+					imageRow = reader.ReadRow()
+					if y < y0:
+						continue
+					if y == y1:
+						reader.Close()
+
+					start = (x0 - reader.origin[0]) * pixelSize
+					row[x0 * pixelSize:(x1 + 1) * pixelSize] = imageRow[start:start + (x1 - x0 + 1) * pixelSize]
+
+				writer.WriteRow(row)
+		finally:
+			writer.Close()
+	finally:
+		for reader in readers:
+			reader.Close()
+
+##
+# Stitches the images of region projects, each named after its project.
+#
+def StitchProjects(outputFilePath, tileProjectFilePaths):
+	resolution = None
+	tiles = []
+	for tileProjectFilePath in tileProjectFilePaths:
+		parameters = FrameParameters(tileProjectFilePath)
+		if resolution is None:
+			resolution = FrameResolution(parameters)
+		region = tuple([int(value) for value in parameters[CROP_WINDOW].split()])
+		tiles.append((region, os.path.splitext(tileProjectFilePath)[0] + '.png'))
+
+	Stitch(outputFilePath, resolution, tiles)
+
+
+##
+# Reads the rows of a non-interlaced PNG image one at a time.
+#
+class PngReader(object):
+
+	def __init__(self, filePath):
+		self.filePath = filePath
+		self.file = open(filePath, 'rb')
+		if self.file.read(8) != PNG_SIGNATURE:
+			self.Close()
+			raise ValueError('%s is not a PNG image' % filePath)
+
+		(chunkType, data) = self.ReadChunk()
+		if chunkType != 'IHDR':
+			self.Close()
+			raise ValueError('%s has no header' % filePath)
+
+		(self.width, self.height, self.bitDepth, self.colorType, compression, filter, interlace) = struct.unpack('>IIBBBBB', data)
+		if not PNG_CHANNELS.has_key(self.colorType) or self.bitDepth < 8 or interlace != 0:
+			self.Close()
+			raise ValueError('%s is paletted, of less than 8 bits or interlaced' % filePath)
+
+		self.pixelSize = PNG_CHANNELS[self.colorType] * self.bitDepth / 8
+		self.rowSize = self.width * self.pixelSize
+
+		self.decompressor = zlib.decompressobj()
+		self.data = ''
+		self.offset = 0
+		self.remaining = 0
+		self.previous = bytearray(self.rowSize)
+		self.previousIsZero = True
+		self.zeros = bytearray(self.rowSize)
+
+	def ReadChunk(self):
+		(length, chunkType) = struct.unpack('>I4s', self.file.read(8))
+		data = self.file.read(length)
+		self.file.read(4)
+		return (chunkType, data)
+
+	##
+	# Returns the next compressed bytes of the image, streamed from its IDAT
+	# chunks.
+	#
+	def ReadCompressed(self):
+		while self.remaining == 0:
+			header = self.file.read(8)
+			if len(header) < 8:
+				raise ValueError('%s is truncated' % self.filePath)
+
+			(length, chunkType) = struct.unpack('>I4s', header)
+			if chunkType == 'IDAT':
+				self.remaining = length
+				if length == 0:
+					self.file.read(4)
+				continue
+			if chunkType == 'IEND':
+				raise ValueError('%s is truncated' % self.filePath)
+			self.file.seek(length + 4, os.SEEK_CUR)
+
+		data = self.file.read(min(self.remaining, READ_SIZE))
+		self.remaining -= len(data)
+		if self.remaining == 0:
+			self.file.read(4)
+		return data
+
+	##
+	# Returns up to size more bytes of the image, without decompressing
+	# ahead more than that since black rows compress a thousand times.
+	#
+	def Decompress(self, size):
+		data = self.decompressor.unconsumed_tail
+		if not data:
+			data = self.ReadCompressed()
+		return self.decompressor.decompress(data, size)
+
+	def ReadRow(self):
+		size = self.rowSize + 1
+		while len(self.data) - self.offset < size:
+			self.data = self.data[self.offset:] + self.Decompress(size)
+			self.offset = 0
+
+		filterType = ord(self.data[self.offset])
+		row = bytearray(self.data[self.offset + 1:self.offset + size])
+		self.offset += size
+
+		# Rows left black, out of the region rendered, are common and
+		# reconstructed without a pass over their bytes.
+		isZero = row == self.zeros
+		if not (filterType == FILTER_NONE or (isZero and self.previousIsZero)):
+			self.Unfilter(filterType, row)
+			isZero = row == self.zeros
+
+		self.previous = row
+		self.previousIsZero = isZero
+		return row
+
+	def Unfilter(self, filterType, row):
+		(previous, pixelSize) = (self.previous, self.pixelSize)
+
+		if filterType == FILTER_SUB:
+			for i in xrange(pixelSize, len(row)):
+				row[i] = (row[i] + row[i - pixelSize]) & 0xff
+
+		elif filterType == FILTER_UP:
+			for i in xrange(len(row)):
+				row[i] = (row[i] + previous[i]) & 0xff
+
+		elif filterType == FILTER_AVERAGE:
+			for i in xrange(pixelSize):
+				row[i] = (row[i] + (previous[i] >> 1)) & 0xff
+			for i in xrange(pixelSize, len(row)):
+				row[i] = (row[i] + ((row[i - pixelSize] + previous[i]) >> 1)) & 0xff
+
+		elif filterType == FILTER_PAETH:
+			for i in xrange(pixelSize):
+				row[i] = (row[i] + previous[i]) & 0xff
+			for i in xrange(pixelSize, len(row)):
+				(a, b, c) = (row[i - pixelSize], previous[i], previous[i - pixelSize])
+				pa = abs(b - c)
+				pb = abs(a - c)
+				pc = abs(a + b - c - c)
+				if pa <= pb and pa <= pc:
+					predictor = a
+				elif pb <= pc:
+					predictor = b
+				else:
+					predictor = c
+				row[i] = (row[i] + predictor) & 0xff
+
+		else:
+			raise ValueError('%s has an unknown filter %d' % (self.filePath, filterType))
+
+	def Close(self):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+
+##
+# Writes a PNG image one row at a time.
+#
+class PngWriter(object):
+
+	def __init__(self, filePath, width, height, bitDepth, colorType, level = 6):
+		self.file = open(filePath, 'wb')
+		self.file.write(PNG_SIGNATURE)
+		self.WriteChunk('IHDR', struct.pack('>IIBBBBB', width, height, bitDepth, colorType, 0, 0, 0))
+
+		self.compressor = zlib.compressobj(level)
+		self.pending = []
+		self.pendingSize = 0
+
+	def WriteChunk(self, chunkType, data):
+		self.file.write(struct.pack('>I', len(data)))
+		self.file.write(chunkType)
+		self.file.write(data)
+		self.file.write(struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff))
+
+	def WriteRow(self, row):
+		self.Append(self.compressor.compress('\0' + str(row)))
+		if self.pendingSize >= CHUNK_SIZE:
+			self.FlushChunk()
+
+	def Append(self, data):
+		if data:
+			self.pending.append(data)
+			self.pendingSize += len(data)
+
+	def FlushChunk(self):
+		if self.pending:
+			self.WriteChunk('IDAT', ''.join(self.pending))
+			self.pending = []
+			self.pendingSize = 0
+
+	def Close(self):
+		if self.file is None:
+			return
+
+		self.Append(self.compressor.flush())
+		self.FlushChunk()
+		self.WriteChunk('IEND', '')
+		self.file.close()
+		self.file = None
+
+
+##
+# Renders the regions of a frame with a farm, then stitches their images.
+# It is polled like the farm.
+#
+class TiledRender(object):
+
+	def __init__(self, farm, outputFilePath, resolution, tiles):
+		self.farm = farm
+		self.outputFilePath = outputFilePath
+		self.resolution = resolution
+		self.tiles = tiles
+		self.workers = farm.workers
+		self.failed = None
+
+	def Poll(self):
+		if self.failed is not None:
+			return self.failed
+
+		failed = self.farm.Poll()
+		if failed is None:
+			return None
+
+		if failed == 0:
+			try:
+				Stitch(self.outputFilePath, self.resolution, self.tiles)
+			except (IOError, ValueError), e:
+				Log('can not stitch %s: %s' % (self.outputFilePath, e))
+				failed = 1
+		self.failed = failed
+		return failed
+
+	def Wait(self, timeout = None):
+		failed = self.farm.Wait(timeout)
+		if failed is None:
+			return None
+		return self.Poll()
+
+	def Cancel(self):
+		self.farm.Cancel()
+
+	def Status(self):
+		status = self.farm.Status('regions')
+		if self.Poll() == 0:
+			status += ', stitched into %s' % self.outputFilePath
+		return status
+
+
+def Main(arguments):
+	parser = optparse.OptionParser(usage = '%prog --output image project...')
+	parser.add_option('-o', '--output', help = 'PNG image to write')
+	(options, tileProjectFilePaths) = parser.parse_args(arguments)
+	if not options.output or not tileProjectFilePaths:
+		parser.error('expected an output image and region projects')
+
+	try:
+		StitchProjects(options.output, tileProjectFilePaths)
+	except (IOError, KeyError, ValueError), e:
+		Log('can not stitch %s: %s' % (options.output, e))
+		return 1
+
+	Log('stitched %d regions into %s' % (len(tileProjectFilePaths), options.output))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
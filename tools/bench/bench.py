@@ -0,0 +1,335 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Benchmark of the exporter without Houdini.
+#
+# Every scene of SCENES is built into the hou, soho and sohog stand-ins of
+# tools/bench/standins and exported by soho/appleseed.py, in a process of its
+# own, the way Houdini runs it. The export time, the polygons and instances
+# exported per second, the peak memory and the size of the project and of
+# the meshes are reported. The digest of the output is checked against
+# golden.json, so that an optimization can be told not to change it:
+#
+#   python tools/bench/bench.py small instances-100k
+#   python tools/bench/bench.py --set geometry_format=binarymesh
+#   python tools/bench/bench.py --update-golden small
+#
+# The arguments of a scene can be changed too, e.g. -D depth=800. Scenes
+# built with other arguments or parameters are not checked.
+#
+
+import hashlib
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STANDINS_DIR = os.path.join(BENCH_DIR, 'standins')
+SOHO_DIR = os.path.join(os.path.dirname(os.path.dirname(BENCH_DIR)), 'soho')
+GOLDEN_FILE_PATH = os.path.join(BENCH_DIR, 'golden.json')
+
+PROJECT_FILE_NAME = 'scene.appleseed'
+RESULT_FILE_NAME = 'result.json'
+LOG_FILE_NAME = 'export.log'
+
+# Arguments of scenes.Build() by scene name.
+SCENES = {
+	'small'          : {'objects' : 3,  'columns' : 20,   'rows' : 20,   'instances' : 40,     'depth' : 2},
+	'polygons-1m'    : {'objects' : 4,  'columns' : 500,  'rows' : 500},
+	'polygons-10m'   : {'objects' : 10, 'columns' : 1000, 'rows' : 1000, 'uv' : 0},
+	'polygons-50m'   : {'objects' : 50, 'columns' : 1000, 'rows' : 1000, 'uv' : 0},
+	'instances-100k' : {'objects' : 4,  'columns' : 10,   'rows' : 10,   'instances' : 100000},
+	'mix-deep'       : {'objects' : 8,  'columns' : 10,   'rows' : 10,   'depth' : 200, 'materials' : 8},
+}
+
+# Scenes run when none is given.
+DEFAULT_SCENES = ('small', 'polygons-1m', 'instances-100k', 'mix-deep')
+
+##
+# Global functions.
+#
+def Log(message):
+	sys.stderr.write('bench: %s\n' % message)
+
+def ParseValue(text):
+	for convert in (int, float):
+		try:
+			return convert(text)
+		except ValueError:
+			pass
+	return text
+
+##
+# Returns the values of the name=value assignments, by name.
+#
+def ParseAssignments(assignments):
+	values = {}
+	for assignment in assignments:
+		(name, separator, value) = assignment.partition('=')
+		if not separator:
+			raise ValueError('%s is not name=value' % assignment)
+		values[name] = [ParseValue(text) for text in value.split(',')]
+		if len(values[name]) == 1:
+			values[name] = values[name][0]
+	return values
+
+def PeakMemory():
+	if resource is None:
+		return None
+
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform != 'darwin':
+		peak *= 1024
+	return peak
+
+##
+# Returns the files written next to the project, relative to directory.
+#
+def OutputFiles(directory):
+	filePaths = []
+	for (dirPath, dirNames, fileNames) in os.walk(directory):
+		dirNames.sort()
+		for fileName in sorted(fileNames):
+			filePath = os.path.relpath(os.path.join(dirPath, fileName), directory)
+			if filePath not in (PROJECT_FILE_NAME, RESULT_FILE_NAME, LOG_FILE_NAME):
+				filePaths.append(filePath)
+	return filePaths
+
+##
+# Returns the digest of the project and of the files written next to it, the
+# directory left out. The export is deterministic, every other byte counts.
+#
+def Digest(directory):
+	digest = hashlib.sha1()
+
+	file = open(os.path.join(directory, PROJECT_FILE_NAME), 'rb')
+	try:
+		project = file.read()
+	finally:
+		file.close()
+	project = project.replace(directory, '')
+	digest.update(project)
+
+	for filePath in OutputFiles(directory):
+		digest.update(filePath.replace(os.sep, '/') + '\0')
+		file = open(os.path.join(directory, filePath), 'rb')
+		try:
+			for data in iter(lambda: file.read(1 << 20), ''):
+				digest.update(data)
+		finally:
+			file.close()
+
+	return digest.hexdigest()
+
+##
+# Builds the scene with arguments, exports it to directory with the ROP
+# parameters parms and writes the result there. Runs in a process of its own.
+#
+def RunCase(directory, arguments, parms):
+	sys.path[0:0] = [STANDINS_DIR, SOHO_DIR]
+
+	import hou
+	import soho
+	import scenes
+
+	counts = scenes.Build(**arguments)
+
+	projectFilePath = os.path.join(directory, PROJECT_FILE_NAME)
+	hou.theHipFileName = os.path.join(directory, 'bench.hip')
+	soho.theParms['soho_diskfile'] = projectFilePath
+	soho.theParms.update(parms)
+
+	file = open(os.path.join(SOHO_DIR, 'appleseed.py'), 'rb')
+	try:
+		code = compile(file.read(), os.path.join(SOHO_DIR, 'appleseed.py'), 'exec')
+	finally:
+		file.close()
+
+	stdout = sys.stdout
+	sys.stdout = open(projectFilePath, 'w')
+	try:
+		startTime = time.time()
+		exec code in {'__name__' : '__builtin__'}
+		seconds = time.time() - startTime
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
+	result = dict(counts)
+	result['seconds'] = seconds
+	result['peak_memory'] = PeakMemory()
+	result['project_bytes'] = os.path.getsize(projectFilePath)
+	result['mesh_files'] = 0
+	result['mesh_bytes'] = 0
+	for filePath in OutputFiles(directory):
+		result['mesh_files'] += 1
+		result['mesh_bytes'] += os.path.getsize(os.path.join(directory, filePath))
+	result['digest'] = Digest(directory)
+
+	file = open(os.path.join(directory, RESULT_FILE_NAME), 'w')
+	try:
+		json.dump(result, file)
+	finally:
+		file.close()
+
+##
+# Runs the scene name in a process of its own, returns its result or None if
+# the export failed.
+#
+def Bench(name, arguments, parms, keep):
+	directory = tempfile.mkdtemp(prefix = 'bench-%s-' % name)
+	try:
+		command = [sys.executable, os.path.abspath(__file__), '--run-case', directory, json.dumps(arguments), json.dumps(parms)]
+		logFile = open(os.path.join(directory, LOG_FILE_NAME), 'w')
+		try:
+			returnCode = subprocess.call(command, stderr = logFile)
+		finally:
+			logFile.close()
+
+		if returnCode != 0:
+			Log('%s: export failed with exit code %d, see %s' % (name, returnCode, os.path.join(directory, LOG_FILE_NAME)))
+			keep = True
+			return None
+
+		file = open(os.path.join(directory, RESULT_FILE_NAME))
+		try:
+			return json.load(file)
+		finally:
+			file.close()
+	finally:
+		if keep:
+			Log('%s: output kept in %s' % (name, directory))
+		else:
+			shutil.rmtree(directory, True)
+
+def FormatBytes(size):
+	if size is None:
+		return '-'
+	for unit in ('B', 'KiB', 'MiB'):
+		if size < 1024:
+			return '%.1f %s' % (size, unit)
+		size /= 1024.0
+	return '%.1f GiB' % size
+
+def Rate(count, seconds):
+	if not count or seconds <= 0.0:
+		return '-'
+	return '%.0f/s' % (count / seconds)
+
+def Report(name, result, check):
+	Log('%-15s %8.2f s %12s polygons %10s instances %10s peak %10s project %10s in %d meshes %s' % (
+		name, result['seconds'], Rate(result['polygons'], result['seconds']), Rate(result['instances'], result['seconds']),
+		FormatBytes(result['peak_memory']), FormatBytes(result['project_bytes']), FormatBytes(result['mesh_bytes']), result['mesh_files'], check))
+
+def LoadGolden():
+	if not os.path.exists(GOLDEN_FILE_PATH):
+		return {}
+
+	file = open(GOLDEN_FILE_PATH)
+	try:
+		return json.load(file)
+	finally:
+		file.close()
+
+def SaveGolden(golden):
+	file = open(GOLDEN_FILE_PATH, 'w')
+	try:
+		json.dump(golden, file, indent = 1, separators = (',', ': '), sort_keys = True)
+		file.write('\n')
+	finally:
+		file.close()
+
+def Main(arguments):
+	if len(arguments) == 4 and arguments[0] == '--run-case':
+		RunCase(arguments[1], dict([(str(name), value) for (name, value) in json.loads(arguments[2]).iteritems()]), json.loads(arguments[3]))
+		return 0
+
+	parser = optparse.OptionParser(usage = '%prog [options] [scene ...]', description = 'Scenes: %s.' % ', '.join(sorted(SCENES)))
+	parser.add_option('-D', '--define', action = 'append', default = [], metavar = 'NAME=VALUE', help = 'changes an argument of the scenes')
+	parser.add_option('--set', action = 'append', default = [], metavar = 'PARM=VALUE', help = 'sets a parameter of the ROP')
+	parser.add_option('--json', metavar = 'FILE', help = 'writes the results to FILE')
+	parser.add_option('--keep', action = 'store_true', help = 'keeps the exported files')
+	parser.add_option('--update-golden', action = 'store_true', help = 'stores the digests of the scenes as golden')
+	(options, names) = parser.parse_args(arguments)
+
+	for name in names:
+		if not SCENES.has_key(name):
+			parser.error('unknown scene %s' % name)
+
+	try:
+		defines = ParseAssignments(options.define)
+		parms = ParseAssignments(options.set)
+	except ValueError, e:
+		parser.error(str(e))
+
+	# Only the scenes as defined, exported with the default parameters, are
+	# compared with their golden digest.
+	checked = not defines and not parms
+	golden = LoadGolden()
+
+	results = {}
+	failures = 0
+	for name in names or DEFAULT_SCENES:
+		sceneArguments = dict(SCENES[name])
+		sceneArguments.update(defines)
+
+		result = Bench(name, sceneArguments, parms, options.keep)
+		if result is None:
+			failures += 1
+			continue
+		results[name] = result
+
+		check = ''
+		if options.update_golden:
+			golden[name] = result['digest']
+			check = 'golden updated'
+		elif checked and golden.has_key(name):
+			if golden[name] == result['digest']:
+				check = 'golden ok'
+			else:
+				check = 'golden MISMATCH'
+				failures += 1
+		Report(name, result, check)
+
+	if options.update_golden:
+		SaveGolden(golden)
+
+	if options.json:
+		file = open(options.json, 'w')
+		try:
+			json.dump(results, file, indent = 1, sort_keys = True)
+		finally:
+			file.close()
+
+	return 1 if failures else 0
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,247 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Synthetic scenes of the benchmark, built into the hou, soho and sohog
+# stand-ins of tools/bench/standins.
+#
+# A scene has a camera, point lights, a material per object whose BSDF is a
+# chain of BSDF mixes of the given depth, grid objects and a point instancer
+# scattering the grids. The grids may be put into subnets or into node
+# groups of /obj. Everything is computed from indices, the same arguments
+# always build the same scene.
+#
+
+import hou
+import soho
+import sohog
+
+IDENTITY = [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1]
+
+# Spacing of the points of the grids and of the instances.
+GRID_SPACING = 0.1
+INSTANCE_SPACING = 2.0
+
+##
+# Global functions.
+#
+def Translation(x, y, z):
+	return IDENTITY[:12] + [x, y, z, 1]
+
+##
+# Builds a scene of objects grids of columns by rows quads and of instances
+# points instancing the grids. The BSDF of each material is a chain of depth
+# BSDF mixes, lambertian if depth is 0. The grids go in turn into as many
+# subnets, and node groups of /obj, as subnets and groups if not 0.
+#
+# Returns the counts of the scene, by name.
+#
+def Build(objects = 1, columns = 10, rows = 10, uv = 1, instances = 0, depth = 0, lights = 2, materials = 1, subnets = 0, groups = 0):
+	hou.Reset()
+	soho.Reset()
+	sohog.Reset()
+
+	objNode = hou.Node('/obj', 'obj')
+	parentPaths = ['/obj']
+	if subnets:
+		parentPaths = ['/obj/set%d' % i for i in xrange(subnets)]
+		for parentPath in parentPaths:
+			hou.Node(parentPath, 'subnet')
+	nodeGroups = [objNode.addNodeGroup('group%d' % i) for i in xrange(groups)]
+
+	BuildCamera()
+
+	for i in xrange(lights):
+		BuildLight(i)
+
+	materialPaths = [BuildMaterial(i, depth) for i in xrange(max(materials, 1))]
+
+	objectPaths = []
+	for i in xrange(objects):
+		objectNode = BuildGrid(i, columns, rows, uv, materialPaths[i % len(materialPaths)], parentPaths[i % len(parentPaths)])
+		if nodeGroups:
+			nodeGroups[i % len(nodeGroups)].addNode(objectNode)
+		objectPaths.append(objectNode.path())
+
+	if instances and objects:
+		BuildInstancer(instances, objectPaths)
+
+	return {
+		'polygons'  : objects * columns * rows,
+		'objects'   : objects,
+		'instances' : instances,
+		'bsdfs'     : len(materialPaths) * (2 * depth + 1),
+	}
+
+def BuildCamera():
+	world = Translation(0, 0, 10)
+	hou.Node('/obj/cam1', 'cam', {'res' : (640, 480), 'resx' : 640, 'resy' : 480, 'aperture' : 41.4214, 'focal' : 50.0}, world = world)
+	soho.theObjectLists['objlist:camera'].append(soho.SohoObject('/obj/cam1', {'aperture' : 41.4214, 'focal' : 50.0, 'resx' : 640, 'resy' : 480}, world))
+
+def BuildLight(i):
+	path = '/obj/light%d' % i
+	world = Translation(i * 4.0 - 2.0, 5, 5)
+	values = {'light_color' : (1.0, 1.0, 1.0), 'coneenable' : i % 2, 'coneangle' : 45.0, 'conedelta' : 5.0}
+	hou.Node(path, 'hlight', values, world = world)
+
+	values['object:name'] = path
+	soho.theObjectLists['objlist:light'].append(soho.SohoObject(path, values, world))
+
+##
+# Returns the path of the material i.
+#
+def BuildMaterial(i, depth):
+	prefix = '/shop/m%d' % i
+
+	def Color(name, value):
+		path = '%s_%s' % (prefix, name)
+		hou.Node(path, 'appleseedColor', {'color_space' : 'srgb', 'color_values' : (value, value, value), 'alpha' : 1.0, 'multiplier' : 1.0})
+		return path
+
+	def Lambert(name, value):
+		path = '%s_%s' % (prefix, name)
+		hou.Node(path, 'appleseedBSDF', {'model' : 'lambertian_brdf', 'lambertian_reflectance' : Color(name + '_color', value)})
+		return path
+
+	# Each mix blends a lambertian BSDF with the mix below it.
+	bsdfPath = Lambert('leaf', 0.5)
+	for level in xrange(depth - 1, -1, -1):
+		mixPath = '%s_mix%d' % (prefix, level)
+		hou.Node(mixPath, 'appleseedBSDF', {
+			'model'            : 'bsdf_mix',
+			'bsdf_mix_bsdf0'   : Lambert('lambert%d' % level, (level % 10) / 10.0),
+			'bsdf_mix_weight0' : 0.5,
+			'bsdf_mix_bsdf1'   : bsdfPath,
+			'bsdf_mix_weight1' : 0.5,
+		})
+		bsdfPath = mixPath
+
+	surfaceShaderPath = prefix + '_surface'
+	hou.Node(surfaceShaderPath, 'appleseedSurfaceShader', {
+		'model'                           : 'physical_surface_shader',
+		'physical_color_multiplier'       : 1.0,
+		'physical_alpha_multiplier'       : 1.0,
+		'physical_aerial_persp_mode'      : 'none',
+		'physical_aerial_persp_distance'  : 1000.0,
+		'physical_aerial_persp_intensity' : 0.01,
+	})
+
+	hou.Node(prefix, 'appleseedMaterial', {'bsdf' : bsdfPath, 'edf' : '', 'surface_shader' : surfaceShaderPath})
+	return prefix
+
+##
+# Returns the object node of the grid i, a child of parentPath.
+#
+def BuildGrid(i, columns, rows, uv, materialPath, parentPath = '/obj'):
+	objectPath = '%s/geo%d' % (parentPath, i)
+	sopPath = objectPath + '/grid1'
+	world = Translation((i % 10) * columns * GRID_SPACING, 0, -(i / 10) * rows * GRID_SPACING)
+
+	sohog.theSources[sopPath] = Grid(columns, rows, uv)
+	objectNode = hou.Node(objectPath, 'geo', {'shop_materialpath' : materialPath}, displayPath = sopPath, world = world)
+	hou.Node(sopPath, 'grid')
+	soho.theObjectLists['objlist:instance'].append(soho.SohoObject(objectPath, {'object:soppath' : sopPath}, world))
+
+	return objectNode
+
+##
+# Builds the instancer of the first four of the objects at prototypePaths.
+#
+def BuildInstancer(count, prototypePaths):
+	objectPath = '/obj/instancer'
+	sopPath = objectPath + '/scatter1'
+
+	prototypes = ['..' + path[len('/obj'):] for path in prototypePaths[:4]]
+	sohog.theSources[sopPath] = Points(count, prototypes)
+	hou.Node(objectPath, 'instance', {'shop_materialpath' : '', 'instancepath' : prototypes[0], 'ptinstance' : 1}, displayPath = sopPath)
+	hou.Node(sopPath, 'scatter')
+	soho.theObjectLists['objlist:instance'].append(soho.SohoObject(objectPath, {'object:soppath' : sopPath, 'instancepath' : prototypes[0], 'ptinstance' : 1}, IDENTITY))
+
+
+##
+# A grid of columns by rows quads in the XZ plane, with a height field, and
+# uv on its vertices if asked.
+#
+class Grid(object):
+
+	def __init__(self, columns, rows, uv):
+		self.columns = columns
+		self.rows = rows
+
+		self.pointCount = (columns + 1) * (rows + 1)
+		self.primCount = columns * rows
+		self.pointAttribs = ['P']
+		self.vertexAttribs = []
+		if uv:
+			self.vertexAttribs.append('uv')
+
+	def Point(self, name, i):
+		(y, x) = divmod(i, self.columns + 1)
+		return (x * GRID_SPACING, ((x * 7 + y * 13) % 17) * 0.01, y * GRID_SPACING)
+
+	def Bounds(self):
+		return (0.0, 0.0, 0.0, self.columns * GRID_SPACING, 0.16, self.rows * GRID_SPACING)
+
+	def VertexCount(self, i):
+		return 4
+
+	def Corner(self, i, j):
+		(y, x) = divmod(i, self.columns)
+		return (x + (j == 1 or j == 2), y + (j >= 2))
+
+	def Vertex(self, name, i, j):
+		(x, y) = self.Corner(i, j)
+		if name == 'geo:pointref':
+			return [y * (self.columns + 1) + x]
+		return (x / float(self.columns), y / float(self.rows), 0.0)
+
+
+##
+# Points on a square lattice, scaled and oriented, instancing the given
+# prototypes in turn.
+#
+class Points(object):
+
+	def __init__(self, count, prototypes):
+		self.side = max(int(count ** 0.5), 1)
+		self.prototypes = prototypes
+
+		self.pointCount = count
+		self.primCount = 0
+		self.pointAttribs = ['P', 'N', 'pscale', 'instance']
+		self.vertexAttribs = []
+
+	def Point(self, name, i):
+		if name == 'P':
+			(y, x) = divmod(i, self.side)
+			return (x * INSTANCE_SPACING, 0.0, -y * INSTANCE_SPACING)
+		if name == 'N':
+			return (0.0, 0.0, 1.0) if i % 2 else (1.0, 0.0, 0.0)
+		if name == 'pscale':
+			return (0.5 + (i % 5) * 0.1,)
+		if name == 'instance':
+			return [self.prototypes[i % len(self.prototypes)]]
+		raise KeyError(name)
+
+	def VertexCount(self, i):
+		raise IndexError(i)
+
+	def Vertex(self, name, i, j):
+		raise IndexError(i)
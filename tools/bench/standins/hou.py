@@ -0,0 +1,312 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Stand-in for the hou module of Houdini, the part of it the exporter uses.
+#
+# Nodes hold their parameters in a dict and are created by the scenes of
+# tools/bench/scenes.py. Setting a parameter or destroying a node calls the
+# event callbacks of the node, so that an IPR session can be driven too.
+#
+
+import os
+
+##
+# Global variables.
+#
+theNodes = {}
+theTime = 0.0
+theHipFileName = '/tmp/bench.hip'
+
+FPS = 24.0
+
+class Error(Exception):
+	pass
+
+class OperationFailed(Error):
+	pass
+
+class OperationInterrupted(Error):
+	pass
+
+class nodeEventType(object):
+	ParmTupleChanged = 'ParmTupleChanged'
+	NameChanged      = 'NameChanged'
+	BeingDeleted     = 'BeingDeleted'
+
+class hipFile(object):
+
+	@staticmethod
+	def name():
+		return theHipFileName
+
+##
+# Global functions.
+#
+def node(path):
+	if not path:
+		return None
+	return theNodes.get(path)
+
+def time():
+	return theTime
+
+def timeToFrame(time):
+	return time * FPS + 1.0
+
+def frameToTime(frame):
+	return (frame - 1.0) / FPS
+
+def isUIAvailable():
+	return False
+
+def Reset():
+	global theTime
+	theNodes.clear()
+	theTime = 0.0
+
+def Values(value):
+	if isinstance(value, (tuple, list)):
+		return tuple(value)
+	return (value,)
+
+
+class NodeType(object):
+
+	def __init__(self, name):
+		self.typeName = name
+
+	def name(self):
+		return self.typeName
+
+
+class Parm(object):
+
+	def __init__(self, node, name):
+		self.node = node
+		self.parmName = name
+
+	def name(self):
+		return self.parmName
+
+	def eval(self):
+		return self.node.values[self.parmName]
+
+	def evalAtTime(self, time):
+		return self.eval()
+
+	def isTimeDependent(self):
+		return self.node.timeDependent
+
+	def set(self, value):
+		self.node.SetValue(self.parmName, value)
+
+
+class ParmTuple(Parm):
+
+	def eval(self):
+		return Values(self.node.values[self.parmName])
+
+
+##
+# A node, its parameters are values or tuples of values by name. displayPath
+# is the path of the SOP displayed by an object.
+#
+class Node(object):
+
+	def __init__(self, path, typeName, values = None, displayPath = None, timeDependent = False, world = None):
+		self.nodePath = path
+		self.nodeType = NodeType(typeName)
+		self.values = dict(values or {})
+		self.displayPath = displayPath
+		self.timeDependent = timeDependent
+		self.world = Matrix4(world or 1)
+		self.callbacks = []
+		self.groups = []
+
+		theNodes[path] = self
+
+	def path(self):
+		return self.nodePath
+
+	def name(self):
+		return os.path.basename(self.nodePath)
+
+	def type(self):
+		return self.nodeType
+
+	def sessionId(self):
+		return id(self)
+
+	def parent(self):
+		return node(os.path.dirname(self.nodePath))
+
+	def node(self, path):
+		if not path.startswith('/'):
+			path = os.path.normpath(os.path.join(self.nodePath, path))
+		return node(path)
+
+	def displayNode(self):
+		return node(self.displayPath)
+
+	def inputAncestors(self):
+		return ()
+
+	def nodeGroups(self):
+		return list(self.groups)
+
+	def addNodeGroup(self, name):
+		nodeGroup = NodeGroup(name)
+		self.groups.append(nodeGroup)
+		return nodeGroup
+
+	def isTimeDependent(self):
+		return self.timeDependent
+
+	def evalParm(self, name):
+		return self.values[name]
+
+	def evalParmTuple(self, name):
+		return Values(self.values[name])
+
+	def parm(self, name):
+		if not self.values.has_key(name):
+			return None
+		return Parm(self, name)
+
+	def parmTuple(self, name):
+		if not self.values.has_key(name):
+			return None
+		return ParmTuple(self, name)
+
+	def parms(self):
+		return [Parm(self, name) for name in sorted(self.values.iterkeys())]
+
+	def worldTransform(self):
+		return self.world
+
+	def setWorldTransform(self, matrix):
+		self.world = matrix
+		self.Notify(nodeEventType.ParmTupleChanged)
+
+	def geometry(self):
+		return Geometry()
+
+	def geometryAtFrame(self, frame):
+		return Geometry()
+
+	def addEventCallback(self, eventTypes, callback):
+		self.callbacks.append((tuple(eventTypes), callback))
+
+	def removeEventCallback(self, eventTypes, callback):
+		self.callbacks = [(types, function) for (types, function) in self.callbacks if function != callback]
+
+	def destroy(self):
+		self.Notify(nodeEventType.BeingDeleted)
+		theNodes.pop(self.nodePath, None)
+
+	def SetValue(self, name, value):
+		self.values[name] = value
+		self.Notify(nodeEventType.ParmTupleChanged)
+
+	def Notify(self, eventType):
+		for (eventTypes, callback) in list(self.callbacks):
+			if eventType in eventTypes:
+				callback(event_type = eventType, node = self)
+
+
+##
+# A group of the children of a node, holding nodes by path.
+#
+class NodeGroup(object):
+
+	def __init__(self, name):
+		self.groupName = name
+		self.paths = []
+
+	def name(self):
+		return self.groupName
+
+	def nodes(self):
+		return tuple([node(path) for path in self.paths if theNodes.has_key(path)])
+
+	def addNode(self, node):
+		self.paths.append(node.path())
+
+
+##
+# Geometry of a node, always empty: the meshes of the scenes are read
+# through sohog.
+#
+class Geometry(object):
+
+	def prims(self):
+		return []
+
+	def iterPrims(self):
+		return []
+
+	def loadFromFile(self, fileName):
+		raise OperationFailed('can not load %s' % fileName)
+
+
+##
+# A 4x4 matrix in rows, transforming row vectors like the matrices of
+# Houdini.
+#
+class Matrix4(object):
+
+	def __init__(self, values = 1):
+		if isinstance(values, Matrix4):
+			values = values.data
+		elif isinstance(values, (int, float)):
+			values = [values * (i % 5 == 0) for i in xrange(16)]
+		elif len(values) == 4:
+			values = [value for row in values for value in row]
+		self.data = [float(value) for value in values]
+
+	def asTuple(self):
+		return tuple(self.data)
+
+	def transposed(self):
+		return Matrix4([self.data[column * 4 + row] for row in xrange(4) for column in xrange(4)])
+
+	def __mul__(self, other):
+		if not isinstance(other, Matrix4):
+			other = Matrix4(other)
+		(a, b) = (self.data, other.data)
+		return Matrix4([sum([a[row * 4 + k] * b[k * 4 + column] for k in xrange(4)]) for row in xrange(4) for column in xrange(4)])
+
+	def inverted(self):
+		rows = [self.data[row * 4:row * 4 + 4] + [float(row == column) for column in xrange(4)] for row in xrange(4)]
+		for column in xrange(4):
+			pivot = max(xrange(column, 4), key = lambda row: abs(rows[row][column]))
+			if rows[pivot][column] == 0.0:
+				raise OperationFailed('matrix is not invertible')
+			(rows[column], rows[pivot]) = (rows[pivot], rows[column])
+
+			scale = rows[column][column]
+			rows[column] = [value / scale for value in rows[column]]
+			for row in xrange(4):
+				if row != column and rows[row][column] != 0.0:
+					factor = rows[row][column]
+					rows[row] = [value - factor * pivotValue for (value, pivotValue) in zip(rows[row], rows[column])]
+
+		return Matrix4([value for row in rows for value in row[4:]])
@@ -0,0 +1,176 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Stand-in for the soho module of Houdini, the part of it the exporter uses.
+#
+# The parameters of the ROP are held in theParms, the objects of the scene in
+# theObjectLists by object list name and the paths of the members of bundles
+# in theBundles. Like soho, parameters skipping their default are not
+# evaluated unless set to another value, and only the objects and lights
+# matching the patterns given to addObjects() are listed.
+#
+
+import fnmatch
+import os
+import sys
+
+##
+# Global variables.
+#
+theParms = {}
+theObjectLists = {}
+theBundles = {}
+
+# Names of the objects added, by object list name.
+theAddedNames = {}
+
+OBJECT_LISTS = ('objlist:camera', 'objlist:light', 'objlist:instance')
+
+##
+# Global functions.
+#
+def Reset():
+	theParms.clear()
+	theObjectLists.clear()
+	theBundles.clear()
+	theAddedNames.clear()
+	for name in OBJECT_LISTS:
+		theObjectLists[name] = []
+		theAddedNames[name] = set()
+
+def Values(value):
+	if isinstance(value, (tuple, list)):
+		return list(value)
+	return [value]
+
+def getDefaultedFloat(name, default):
+	return Values(theParms.get(name, default))
+
+getDefaultedInt = getDefaultedFloat
+getDefaultedString = getDefaultedFloat
+
+def initialize(now, camera):
+	return True
+
+##
+# Returns True if the object at path matches pattern: names, paths or
+# @bundles with wildcards, separated by spaces or commas, the ones starting
+# with ^ removing what they match.
+#
+def Match(pattern, path):
+	matched = False
+	for token in pattern.replace(',', ' ').split():
+		exclude = token.startswith('^')
+		if exclude:
+			token = token[1:]
+
+		if token.startswith('@'):
+			found = path in theBundles.get(token[1:], ())
+		else:
+			found = fnmatch.fnmatchcase(path, token) or fnmatch.fnmatchcase(os.path.basename(path), token)
+
+		if found:
+			matched = not exclude
+	return matched
+
+def addObjects(now, geometry, lights, fog, *arguments):
+	for (listName, pattern) in (('objlist:instance', geometry), ('objlist:light', lights)):
+		for sohoObject in theObjectLists[listName]:
+			if Match(pattern, sohoObject.getName()):
+				theAddedNames[listName].add(sohoObject.getName())
+	return True
+
+def lockObjects(now):
+	pass
+
+def objectList(name):
+	if name == 'objlist:camera':
+		return theObjectLists[name]
+	return [sohoObject for sohoObject in theObjectLists.get(name, []) if sohoObject.getName() in theAddedNames[name]]
+
+def error(message):
+	raise RuntimeError(message)
+
+def warning(message):
+	sys.stderr.write('soho: warning: %s\n' % message)
+
+##
+# Returns the parameters of parms with their values in values, by key. The
+# parameters skipping their default are left out unless set to another value.
+#
+def Evaluate(parms, values):
+	result = {}
+	for (key, parm) in parms.iteritems():
+		if values.has_key(key):
+			value = Values(values[key])
+			if not parm.SkipDefault or value != list(parm.Value):
+				result[key] = SohoParm(parm.Label, parm.Type, value, parm.SkipDefault, key)
+		elif not parm.SkipDefault:
+			result[key] = SohoParm(parm.Label, parm.Type, parm.Value, parm.SkipDefault, key)
+	return result
+
+
+class SohoParm(object):
+
+	def __init__(self, name, type, default, skipdefault = True, key = None):
+		self.Label = name
+		self.Type = type
+		self.Value = list(default)
+		self.SkipDefault = skipdefault
+		self.Key = key or name
+
+
+class SohoGlue(object):
+
+	def evaluate(self, parms, now, camera):
+		return Evaluate(parms, theParms)
+
+sohoglue = SohoGlue()
+
+
+##
+# An object of the scene, parms are its values by soho name and world its
+# transform.
+#
+class SohoObject(object):
+
+	def __init__(self, name, parms = None, world = None):
+		self.name = name
+		self.parms = dict(parms or {})
+		self.world = list(world or [1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 0, 1])
+
+	def getName(self):
+		return self.name
+
+	def getDefaultedString(self, name, now, default):
+		return Values(self.parms.get(name, default))
+
+	getDefaultedInt = getDefaultedString
+	getDefaultedFloat = getDefaultedString
+
+	def evalFloat(self, name, now, values):
+		if name != 'space:world':
+			return False
+		values[:] = self.world
+		return True
+
+	def evaluate(self, parms, now):
+		return Evaluate(parms, self.parms)
@@ -0,0 +1,83 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Stand-in for the sohog module of Houdini.
+#
+# The geometry of a SOP is a source registered in theSources by SOP path. A
+# source computes its points, primitives and attributes by index, e.g. the
+# grids of tools/bench/scenes.py, so that scenes of tens of millions of
+# polygons take no memory until the exporter reads them.
+#
+# A source has pointCount, primCount, vertexAttribs and pointAttribs, and the
+# methods Point(name, i), VertexCount(i) and Vertex(name, i, j). Its bounds
+# are known if it has Bounds() too.
+#
+
+##
+# Global variables.
+#
+theSources = {}
+
+##
+# Global functions.
+#
+def Reset():
+	theSources.clear()
+
+
+class SohoGeometry(object):
+
+	def __init__(self, sopPath, now = 0.0):
+		self.sopPath = sopPath
+		self.source = theSources[sopPath]
+
+	def globalValue(self, name):
+		source = self.source
+		if name == 'geo:pointcount':
+			return [source.pointCount]
+		if name == 'geo:primcount':
+			return [source.primCount]
+		if name == 'geo:vertexattribs':
+			return list(source.vertexAttribs)
+		if name == 'geo:pointattribs':
+			return list(source.pointAttribs)
+		if name == 'geo:boundingbox' and hasattr(source, 'Bounds'):
+			return list(source.Bounds())
+		return None
+
+	##
+	# Returns a handle to an attribute, None if there is no such attribute.
+	#
+	def attribute(self, attributeClass, name):
+		if attributeClass == 'geo:point' and name not in self.source.pointAttribs:
+			return None
+		if attributeClass == 'geo:vertex' and name not in self.source.vertexAttribs and name != 'geo:pointref':
+			return None
+		return (attributeClass, name)
+
+	def value(self, handle, i):
+		(attributeClass, name) = handle
+		if attributeClass == 'geo:prim':
+			return [self.source.VertexCount(i)]
+		return self.source.Point(name, i)
+
+	def vertex(self, handle, i, j):
+		return self.source.Vertex(handle[1], i, j)
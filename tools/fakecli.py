@@ -0,0 +1,122 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Stand-in for appleseed.cli, to test the launcher without a renderer.
+#
+# It takes the command line of appleseed.cli, checks the project and the
+# meshes it refers to, prints the progress of a render tile by tile and
+# writes a flat grey PNG of the resolution of the frame. Within the crop
+# window of the frame if any, the grey depends on the window and the rest is
+# black:
+#
+#   python tools/fakecli.py project.appleseed --output frame.png
+#
+# The environment tunes the render:
+#
+#   FAKECLI_TILES  tiles rendered, 16 by default
+#   FAKECLI_DELAY  seconds per tile, 0.05 by default
+#   FAKECLI_EXIT   exit code once rendered, 0 by default
+#
+
+import optparse
+import os
+import struct
+import sys
+import time
+import zlib
+from xml.dom import minidom
+
+def Message(level, text):
+	sys.stdout.write('%s <%s>%s%s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), level, ' ' * (8 - len(level)), text))
+	sys.stdout.flush()
+
+##
+# Writes an 8 bits RGB PNG, grey within the window (x0, y0, x1, y1) and black
+# out of it.
+#
+def WritePng(filePath, width, height, window, grey):
+	def Chunk(chunkType, data):
+		return struct.pack('>I', len(data)) + chunkType + data + struct.pack('>I', zlib.crc32(chunkType + data) & 0xffffffff)
+
+	(x0, y0, x1, y1) = window
+	black = '\0' + '\0' * (width * 3)
+	row = '\0' + '\0' * (x0 * 3) + chr(grey) * ((x1 - x0 + 1) * 3) + '\0' * ((width - x1 - 1) * 3)
+	file = open(filePath, 'wb')
+	try:
+		file.write('\x89PNG\r\n\x1a\n')
+		file.write(Chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+		file.write(Chunk('IDAT', zlib.compress(black * y0 + row * (y1 - y0 + 1) + black * (height - y1 - 1))))
+		file.write(Chunk('IEND', ''))
+	finally:
+		file.close()
+
+def Main(arguments):
+	parser = optparse.OptionParser(usage = '%prog project [options]')
+	parser.add_option('-o', '--output', help = 'image to write')
+	parser.add_option('-t', '--threads', type = 'int')
+	parser.add_option('--message-verbosity')
+	(options, arguments) = parser.parse_args(arguments)
+	if len(arguments) != 1:
+		Message('error', 'expected one project file')
+		return 1
+
+	projectFilePath = arguments[0]
+	Message('info', 'loading project file %s...' % projectFilePath)
+	try:
+		project = minidom.parse(projectFilePath)
+	except Exception, e:
+		Message('error', 'failed to load project file %s: %s' % (projectFilePath, e))
+		return 1
+
+	projectDir = os.path.dirname(os.path.abspath(projectFilePath))
+	for parameter in project.getElementsByTagName('parameter'):
+		if parameter.getAttribute('name') == 'filename':
+			meshFilePath = os.path.join(projectDir, parameter.getAttribute('value'))
+			if not os.path.exists(meshFilePath):
+				Message('error', 'file not found: %s' % meshFilePath)
+				return 1
+
+	(width, height) = (640, 480)
+	window = None
+	for parameter in project.getElementsByTagName('parameter'):
+		if parameter.getAttribute('name') == 'resolution':
+			(width, height) = [int(value) for value in parameter.getAttribute('value').split()]
+		elif parameter.getAttribute('name') == 'crop_window':
+			window = [int(value) for value in parameter.getAttribute('value').split()]
+	if window is None:
+		window = (0, 0, width - 1, height - 1)
+
+	tiles = int(os.environ.get('FAKECLI_TILES', 16))
+	delay = float(os.environ.get('FAKECLI_DELAY', 0.05))
+	Message('info', 'rendering frame %dx%d, %d tiles...' % (width, height, tiles))
+	for tile in xrange(1, tiles + 1):
+		time.sleep(delay)
+		Message('info', 'tile %d/%d rendered' % (tile, tiles))
+		Message('info', 'rendering, %.1f%% done' % (100.0 * tile / tiles))
+
+	if options.output:
+		WritePng(options.output, width, height, window, 64 + (window[0] * 7 + window[1] * 13) % 128)
+		Message('info', 'wrote image file %s' % options.output)
+
+	return int(os.environ.get('FAKECLI_EXIT', 0))
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))
@@ -0,0 +1,119 @@
+# Copyright (c) 2012 Bo Zhou<bo.schwarzstein@gmail.com>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+##
+# Stand-in for a renderer receiving the changes of an IPR session, see
+# soho/appleseedipr.py.
+#
+# It keeps the entities it was sent and prints every message with its
+# latency, the time from the change in Houdini to its reception:
+#
+#   python tools/iprserver.py --port 9870
+#
+
+import json
+import optparse
+import socket
+import sys
+import time
+
+DEFAULT_PORT = 9870
+
+##
+# Entities received, by (kind, name).
+#
+class IprServer(object):
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.projectFilePath = None
+		self.entities = {}
+		self.messages = 0
+
+	def Receive(self, message):
+		latency = (time.time() - message.get('time', time.time())) * 1000.0
+		self.messages += 1
+
+		messageType = message.get('type')
+		if messageType == 'project':
+			self.projectFilePath = message.get('path')
+			self.entities = {}
+			self.stream.write('project %s\n' % self.projectFilePath)
+
+		elif messageType == 'update':
+			for entity in message.get('entities', ()):
+				self.entities[(entity['kind'], entity['name'])] = entity['xml']
+				self.stream.write('update %s %s (%.1f ms)\n' % (entity['kind'], entity['name'], latency))
+
+		elif messageType == 'remove':
+			for entity in message.get('entities', ()):
+				self.entities.pop((entity['kind'], entity['name']), None)
+				self.stream.write('remove %s %s (%.1f ms)\n' % (entity['kind'], entity['name'], latency))
+
+		else:
+			self.stream.write('unknown message %r\n' % messageType)
+
+		self.stream.flush()
+
+	def Serve(self, connection):
+		pending = ''
+		while True:
+			data = connection.recv(65536)
+			if not data:
+				break
+
+			lines = (pending + data).split('\n')
+			pending = lines.pop()
+			for line in lines:
+				if line.strip():
+					self.Receive(json.loads(line))
+
+
+def Main(arguments):
+	parser = optparse.OptionParser(usage = '%prog [options]')
+	parser.add_option('--host', default = 'localhost', help = 'address to listen at')
+	parser.add_option('--port', type = 'int', default = DEFAULT_PORT, help = 'port to listen at')
+	parser.add_option('--once', action = 'store_true', help = 'exit once the first session is over')
+	(options, arguments) = parser.parse_args(arguments)
+
+	listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	listener.bind((options.host, options.port))
+	listener.listen(1)
+	sys.stdout.write('listening at %s:%d\n' % (options.host, listener.getsockname()[1]))
+	sys.stdout.flush()
+
+	server = IprServer(sys.stdout)
+	while True:
+		(connection, address) = listener.accept()
+		try:
+			server.Serve(connection)
+		finally:
+			connection.close()
+
+		sys.stdout.write('session over, %d messages, %d entities\n' % (server.messages, len(server.entities)))
+		sys.stdout.flush()
+		if options.once:
+			break
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(Main(sys.argv[1:]))